@@ -0,0 +1,223 @@
+"""
+Учет активных пользователей: DAU, WAU, MAU и липкость
+
+Колонка last_activity хранит только последнее появление пользователя,
+поэтому по ней нельзя узнать, сколько пользователей было активно
+в прошлом месяце. Хранить множества ID за каждый день - память и место
+растут вместе с аудиторией. Вместо этого user_bot отмечает активность
+в дневных скетчах HyperLogLog (hll.py): скетч занимает фиксированный
+объем, а объединение скетчей за любые дни дает число уникальных
+пользователей за этот период с ошибкой около 1%.
+
+ActivityTracker копит скетчи в памяти и периодически объединяет их
+с сохраненными в таблице activity_sketches (обработчики не ждут базу).
+Для событий, которые сами не пишут в users (открытие мини-приложения),
+он также пачкой обновляет last_activity. Сохранение идет в отдельном
+потоке, чтобы занятая база не задерживала цикл событий.
+Отчеты (build_report, count_range) читают скетчи по одному, поэтому память
+не зависит ни от числа пользователей, ни от длины периода.
+"""
+import asyncio
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from database import Database
+from hll import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+WEEK_DAYS = 7
+MONTH_DAYS = 30
+
+
+def today() -> date:
+    """Текущий день (UTC, как registered_at и last_activity в базе)"""
+    return datetime.now(timezone.utc).date()
+
+
+class ActivityTracker:
+    """Накопление дневных скетчей активности и их сохранение в базу"""
+    
+    def __init__(self, db: Database, flush_interval: float = 60.0):
+        """
+        Args:
+            db: База данных
+            flush_interval: Интервал сохранения скетчей в базу (секунды)
+        """
+        self.db = db
+        self.flush_interval = flush_interval
+        # День (YYYY-MM-DD) -> скетч, еще не сохраненный в базу
+        self._sketches: Dict[str, HyperLogLog] = {}
+        # ID пользователя -> время активности для users.last_activity
+        self._touched: Dict[int, str] = {}
+        # Словари меняют и цикл событий (track), и поток сохранения (обмен
+        # на пустые и возврат несохраненного) - только под этой блокировкой.
+        # Она не удерживается во время записи в базу, поэтому track не ждет базу
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+    
+    def track(self, user_id: int, touch: bool = False):
+        """
+        Отметить активность пользователя сегодня (не обращается к базе)
+        
+        Args:
+            touch: Обновить и users.last_activity (если обработчик не сделал этого сам)
+        """
+        now = datetime.now(timezone.utc)
+        day = now.date().isoformat()
+        with self._lock:
+            sketch = self._sketches.get(day)
+            if sketch is None:
+                sketch = self._sketches[day] = HyperLogLog()
+            sketch.add(user_id)
+            if touch:
+                self._touched[user_id] = now.strftime('%Y-%m-%d %H:%M:%S')
+    
+    def start(self):
+        """Запустить периодическое сохранение скетчей"""
+        self._task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        """Остановить сохранение скетчей и сохранить накопленное"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+    
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+    
+    def flush(self):
+        """Сохранить накопленное в базу (блокирующий вызов)"""
+        # Блокировка: сохранение из потока run и из stop не выполняются одновременно
+        with self._flush_lock:
+            self._flush_touched()
+            self._flush_sketches()
+    
+    def _flush_touched(self):
+        with self._lock:
+            touched, self._touched = self._touched, {}
+        if not touched:
+            return
+        
+        try:
+            self.db.touch_users(touched)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении последней активности: {e}")
+            # Более поздние отметки, пришедшие во время сохранения, не затираем
+            with self._lock:
+                for user_id, moment in touched.items():
+                    self._touched.setdefault(user_id, moment)
+    
+    def _flush_sketches(self):
+        with self._lock:
+            sketches, self._sketches = self._sketches, {}
+        if not sketches:
+            return
+        
+        try:
+            self.db.merge_activity_sketches(sketches)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении скетчей активности: {e}")
+            # Повторное объединение безопасно: вернем скетчи и сохраним в следующий раз
+            with self._lock:
+                for day, sketch in sketches.items():
+                    if day in self._sketches:
+                        sketch.merge(self._sketches[day])
+                    self._sketches[day] = sketch
+
+
+class ActivityReport(NamedTuple):
+    """Активные пользователи на день"""
+    day: date
+    dau: int
+    wau: int               # Уникальные за 7 дней, заканчивающихся day
+    mau: int               # Уникальные за 30 дней, заканчивающихся day
+    average_dau: float     # Средний DAU за те же 30 дней
+    stickiness: Optional[float]  # Средний DAU / MAU
+
+
+def build_report(db: Database, day: date) -> ActivityReport:
+    """Посчитать DAU/WAU/MAU и липкость на день (один проход по 30 скетчам)"""
+    first_day = day - timedelta(days=MONTH_DAYS - 1)
+    week_start = (day - timedelta(days=WEEK_DAYS - 1)).isoformat()
+    month, week = HyperLogLog(), HyperLogLog()
+    dau = 0
+    daily_total = 0
+    
+    for sketch_day, sketch in db.iter_activity_sketches(first_day.isoformat(), day.isoformat()):
+        count = sketch.count()
+        daily_total += count
+        if sketch_day == day.isoformat():
+            dau = count
+        if sketch_day >= week_start:
+            week.merge(sketch)
+        month.merge(sketch)
+    
+    mau = month.count()
+    average_dau = daily_total / MONTH_DAYS
+    return ActivityReport(
+        day=day,
+        dau=dau,
+        wau=week.count(),
+        mau=mau,
+        average_dau=average_dau,
+        stickiness=average_dau / mau if mau else None,
+    )
+
+
+def count_range(db: Database, first_day: date, last_day: date) -> Tuple[int, float]:
+    """
+    Уникальные пользователи за период (включительно)
+    
+    Returns:
+        (уникальных пользователей, средний DAU за период)
+    """
+    union = HyperLogLog()
+    daily_total = 0
+    for _, sketch in db.iter_activity_sketches(first_day.isoformat(), last_day.isoformat()):
+        daily_total += sketch.count()
+        union.merge(sketch)
+    days = (last_day - first_day).days + 1
+    return union.count(), daily_total / days
+
+
+def render_report(report: ActivityReport) -> str:
+    """Отчет на день в виде сообщения (parse_mode=HTML)"""
+    stickiness = "—" if report.stickiness is None else f"{report.stickiness * 100:.1f}%"
+    return (
+        f"📅 <b>Активные пользователи на {report.day.strftime('%d.%m.%Y')}</b>\n\n"
+        f"• DAU (за день): <b>{report.dau}</b>\n"
+        f"• WAU (за 7 дней): <b>{report.wau}</b>\n"
+        f"• MAU (за 30 дней): <b>{report.mau}</b>\n"
+        f"• Средний DAU за 30 дней: <b>{report.average_dau:.0f}</b>\n"
+        f"• Липкость (средний DAU / MAU): <b>{stickiness}</b>\n\n"
+        "<i>Оценка HyperLogLog, погрешность около 1%. Дни - по UTC.</i>"
+    )
+
+
+def render_range(first_day: date, last_day: date, unique: int, average_dau: float) -> str:
+    """Отчет за период в виде сообщения (parse_mode=HTML)"""
+    days = (last_day - first_day).days + 1
+    text = (
+        f"📅 <b>Активные пользователи с {first_day.strftime('%d.%m.%Y')} "
+        f"по {last_day.strftime('%d.%m.%Y')}</b> ({days} дн.)\n\n"
+    )
+    if not unique:
+        return text + "Нет данных за этот период."
+    
+    return text + (
+        f"• Уникальных пользователей: <b>{unique}</b>\n"
+        f"• Средний DAU: <b>{average_dau:.0f}</b>\n"
+        f"• Липкость (средний DAU / уникальные): <b>{average_dau / unique * 100:.1f}%</b>\n\n"
+        "<i>Оценка HyperLogLog, погрешность около 1%. Дни - по UTC.</i>"
+    )
@@ -3,7 +3,8 @@ Admin Bot - Бот для администраторов
 Функции:
 - Создание рассылки для пользователей user_bot (с поддержкой изображений и кнопок)
 - Расширенная статистика пользователей
-- Отложенные рассылки
+- Статистика кампаний (start параметров)
+- Отложенные и повторяющиеся рассылки
 - Сегментация пользователей
 - Шаблоны рассылок
 - Управление пользователями
@@ -11,24 +12,47 @@ Admin Bot - Бот для администраторов
 """
 import asyncio
 import logging
+import html
 import json
 import os
-from datetime import datetime, timedelta
-from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+from aiogram import Dispatcher, types, F
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     InlineKeyboardMarkup, 
     InlineKeyboardButton,
-    InputMediaPhoto,
-    FSInputFile
+    InputMediaPhoto
 )
 from aiogram.enums import ParseMode, ChatAction
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from config import ADMIN_BOT_TOKEN, USER_BOT_TOKEN, ADMIN_IDS, WEB_APP_URL
-from database import Database
+from config import (
+    ADMIN_BOT_TOKEN, USER_BOT_TOKEN, ADMIN_IDS, WEB_APP_URL,
+    SCHEDULER_INSTANCE_ID, SCHEDULER_LEASE_SECONDS, SCHEDULER_POLL_SECONDS, SCHEDULER_MAX_ATTEMPTS,
+    SCHEDULER_CHECKPOINT_RECIPIENTS, SCHEDULER_CHECKPOINT_SECONDS,
+    AUDIENCE_SNAPSHOT_LEAD_MINUTES, AUDIENCE_SNAPSHOT_DIR,
+    FSM_STORAGE_TTL_HOURS, FSM_FLUSH_INTERVAL_SECONDS, BROADCAST_PHOTOS_DIR,
+    COHORT_WEEKS, COHORT_REFRESH_MINUTES, REPORT_WORKERS, REPORT_TIMEOUT_SECONDS,
+    ANALYTICS_MIRROR_FILE, ANALYTICS_REFRESH_SECONDS, ANALYTICS_CHANGES_RETENTION_HOURS,
+    CLICK_BASE_URL, CLICK_SECRET
+)
+from shared import get_database, get_bot, get_session
+from analytics_mirror import AnalyticsDatabase, AnalyticsMirror, describe_staleness
+from fsm_storage import SQLiteStorage
+from segments import SEGMENT_NAMES, EXPR_PREFIX, SegmentError, describe_segment
+from recurrence import parse_recurrence, first_fire, next_fire, describe_recurrence
+from audience_snapshot import AudienceSnapshot, snapshot_path, write_snapshot, remove_snapshot
+from exporter import EXPORT_DATASETS, EXPORT_FORMATS, ExportFile, build_export, discard_export
+from reports import ReportRunner, ReportCancelled, ReportTimeout
+from redirect_server import make_click_url
+import activity
+import charts
+import cohorts
+import events
+import sessions
 
 # Проверка обязательных параметров
 if not ADMIN_BOT_TOKEN:
@@ -41,16 +65,43 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Инициализация базы данных
+db = get_database()
+
+# Отчеты читают зеркало аналитики, а не основную базу, в которую пишет user_bot
+if ANALYTICS_MIRROR_FILE:
+    analytics_mirror = AnalyticsMirror(
+        db, ANALYTICS_MIRROR_FILE, retention_seconds=ANALYTICS_CHANGES_RETENTION_HOURS * 3600
+    )
+    analytics_db = AnalyticsDatabase(ANALYTICS_MIRROR_FILE)
+else:
+    analytics_mirror = None
+    analytics_db = db
+
+# Тяжелые отчеты (выгрузки, графики, когорты) считаются в пуле процессов,
+# чтобы не задерживать обработку команд и рассылки
+report_runner = ReportRunner(max_workers=REPORT_WORKERS, timeout=REPORT_TIMEOUT_SECONDS)
+
+# Когортный отчет (/cohorts) пересчитывается не чаще раза в COHORT_REFRESH_MINUTES
+cohort_engine = cohorts.CohortEngine(
+    analytics_db, weeks=COHORT_WEEKS, refresh_minutes=COHORT_REFRESH_MINUTES, runner=report_runner.run
+)
+
+# PNG графики аналитики: перестраиваются только при изменении данных
+chart_cache = charts.ChartCache(runner=report_runner.run)
+
 # Инициализация бота и диспетчера
-bot = Bot(token=ADMIN_BOT_TOKEN)
-storage = MemoryStorage()
+# Состояния FSM хранятся в базе, чтобы черновики переживали перезапуск
+bot = get_bot(ADMIN_BOT_TOKEN)
+storage = SQLiteStorage(
+    db,
+    ttl_seconds=FSM_STORAGE_TTL_HOURS * 3600,
+    flush_interval=FSM_FLUSH_INTERVAL_SECONDS
+)
 dp = Dispatcher(storage=storage)
 
-# Инициализация базы данных
-db = Database()
-
 # Бот для отправки сообщений пользователям
-user_bot = Bot(token=USER_BOT_TOKEN) if USER_BOT_TOKEN else None
+user_bot = get_bot(USER_BOT_TOKEN) if USER_BOT_TOKEN else None
 
 
 def is_admin(user_id: int) -> bool:
@@ -58,12 +109,72 @@ def is_admin(user_id: int) -> bool:
     return user_id in ADMIN_IDS
 
 
+def click_tracking_enabled() -> bool:
+    """Учитываются ли переходы по кнопкам рассылок (redirect_server.py)"""
+    return bool(CLICK_BASE_URL and CLICK_SECRET)
+
+
+def broadcast_keyboard(buttons: Optional[List[dict]], link_ids: Optional[List[int]] = None,
+                       user_id: Optional[int] = None) -> Optional[InlineKeyboardMarkup]:
+    """
+    Клавиатура рассылки
+    
+    С link_ids кнопки ведут через сервис переходов по подписанной ссылке
+    получателя user_id, иначе - прямо на адрес кнопки.
+    """
+    if not buttons:
+        return None
+    if not link_ids:
+        return InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text=btn['text'], url=btn['url'])]
+            for btn in buttons
+        ])
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=btn['text'], url=make_click_url(CLICK_BASE_URL, CLICK_SECRET, link_id, user_id))]
+        for btn, link_id in zip(buttons, link_ids)
+    ])
+
+
+def analytics_freshness() -> str:
+    """Подпись о свежести данных отчета (пусто, если зеркало аналитики выключено)"""
+    if analytics_mirror is None:
+        return ""
+    return "\n\n" + describe_staleness(analytics_db.get_synced_at())
+
+
+# Размер страницы списков (история, шаблоны, поиск пользователей)
+PAGE_SIZE = 10
+HISTORY_DETAILED_PAGE_SIZE = 15
+
+
+def page_cursor(data: str, prefix: str) -> Optional[int]:
+    """Курсор страницы из callback_data (пусто или 'first' - первая страница)"""
+    value = data[len(prefix):].lstrip('_')
+    return int(value) if value.isdigit() else None
+
+
+def pagination_row(prefix: str, next_cursor: Optional[int], is_first: bool) -> List[InlineKeyboardButton]:
+    """
+    Кнопки навигации keyset-пагинации
+    
+    Курсор следующей страницы передается в callback_data, поэтому каждая
+    страница читается из базы одним коротким запросом по индексу.
+    """
+    row = []
+    if not is_first:
+        row.append(InlineKeyboardButton(text="⏮ В начало", callback_data=f"{prefix}first"))
+    if next_cursor is not None:
+        row.append(InlineKeyboardButton(text="Далее ▶️", callback_data=f"{prefix}{next_cursor}"))
+    return row
+
+
 class BroadcastStates(StatesGroup):
     """Состояния для создания рассылки"""
     waiting_for_content = State()  # Ожидание контента (текст, фото, или фото+текст)
     waiting_for_buttons = State()  # Ожидание кнопок (опционально)
     waiting_for_confirmation = State()  # Ожидание подтверждения
     waiting_for_segment = State()  # Ожидание выбора сегмента
+    waiting_for_segment_expression = State()  # Ожидание условия сегмента
 
 
 class TemplateStates(StatesGroup):
@@ -78,6 +189,7 @@ class ScheduledBroadcastStates(StatesGroup):
     waiting_for_content = State()
     waiting_for_buttons = State()
     waiting_for_segment = State()
+    waiting_for_segment_expression = State()
     waiting_for_datetime = State()
     waiting_for_confirmation = State()
 
@@ -98,6 +210,7 @@ async def cmd_start(message: types.Message):
         "👋 <b>Добро пожаловать в Admin Bot!</b>\n\n"
         "🚀 <b>Основные команды:</b>\n"
         "/stats - 📊 Расширенная статистика\n"
+        "/campaigns - 🔗 Кампании (start параметры)\n"
         "/broadcast - 📢 Создать рассылку\n"
         "/schedule - ⏰ Отложенная рассылка\n"
         "/templates - 📝 Шаблоны рассылок\n"
@@ -128,7 +241,13 @@ async def cmd_help(message: types.Message):
         "📖 <b>Полная справка по командам:</b>\n\n"
         "📊 <b>Статистика и аналитика:</b>\n"
         "/stats - Расширенная статистика с графиками\n"
-        "/analytics - Детальная аналитика\n\n"
+        "/analytics - Детальная аналитика\n"
+        "/stats условие - Размер сегмента по условию\n"
+        "/campaigns - Регистрации и активность по start параметрам\n"
+        "/cohorts - Удержание и отток по неделям регистрации\n"
+        "/activity [день] [по день] - DAU/WAU/MAU или уникальные за период (ДД.ММ.ГГГГ)\n"
+        "/funnel [дней] - Воронка: /start → мини-приложение → переход по ссылке\n"
+        "/export - Выгрузка пользователей и рассылок (CSV/JSON Lines)\n\n"
         "📢 <b>Рассылки:</b>\n"
         "/broadcast - Мгновенная рассылка (все/сегмент)\n"
         "/schedule - Отложенная рассылка по расписанию\n"
@@ -143,9 +262,10 @@ async def cmd_help(message: types.Message):
         "/user_block - Заблокировать пользователя\n\n"
         "⚙️ <b>Прочее:</b>\n"
         "/cancel - Отменить текущую операцию\n"
+        "/pool - Состояние соединений с Bot API\n"
         "/help - Показать эту справку\n\n"
         "💡 <b>Особенности:</b>\n"
-        "• Сегментация: новые, активные, неактивные\n"
+        "• Сегментация: новые, активные, неактивные или свое условие\n"
         "• Отложенные рассылки с планированием\n"
         "• Шаблоны для быстрого создания рассылок\n"
         "• Детальная аналитика и статистика"
@@ -155,19 +275,27 @@ async def cmd_help(message: types.Message):
 
 
 @dp.message(Command("stats"))
-async def cmd_stats(message: types.Message):
-    """Показать расширенную статистику пользователей"""
+async def cmd_stats(message: types.Message, command: CommandObject):
+    """Показать расширенную статистику пользователей (или размер сегмента: /stats условие)"""
     if not is_admin(message.from_user.id):
         return
     
+    if command.args:
+        await read_segment_expression(message, command.args, require_users=False)
+        return
+    
+    await send_stats(message, message.from_user.id)
+
+
+async def send_stats(message: types.Message, admin_id: int):
+    """Отправить расширенную статистику пользователей в чат сообщения"""
     try:
-        stats = db.get_detailed_stats()
-        total_users = db.get_user_count()
+        stats = analytics_db.get_detailed_stats()
         
         # Получаем статистику по сегментам
-        new_users = len(db.get_active_users_by_segment('new'))
-        active_users = len(db.get_active_users_by_segment('active'))
-        inactive_users = len(db.get_active_users_by_segment('inactive'))
+        new_users = analytics_db.count_segment('new')
+        active_users = analytics_db.count_segment('active')
+        inactive_users = analytics_db.count_segment('inactive')
         
         stats_text = (
             "📊 <b>Расширенная статистика</b>\n\n"
@@ -185,7 +313,10 @@ async def cmd_stats(message: types.Message):
             f"• Всего рассылок: <b>{stats['total_broadcasts']}</b>\n"
             f"• Отправлено сообщений: <b>{stats['total_sent']}</b>\n"
             f"• Отложенных: <b>{stats['scheduled_broadcasts']}</b>\n\n"
+            "🛡 <b>Антифлуд:</b>\n"
+            f"• Отброшено сообщений: <b>{db.get_counter('throttle_dropped')}</b>\n\n"
             "Используйте /analytics для детальной аналитики."
+            f"{analytics_freshness()}"
         )
         
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -195,7 +326,7 @@ async def cmd_stats(message: types.Message):
         
         await message.answer(text=stats_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
     except Exception as e:
-        logger.error(f"Ошибка при получении статистики: {e}")
+        logger.error(f"Ошибка при получении статистики для администратора {admin_id}: {e}")
         await message.answer("❌ Ошибка при получении статистики.")
 
 
@@ -253,11 +384,12 @@ async def process_broadcast_content(message: types.Message, state: FSMContext):
         photo_file_id = message.photo[-1].file_id  # Берем фото наибольшего размера
         # Скачиваем фото для дальнейшей отправки
         try:
-            photo_file = await bot.get_file(photo_file_id)
-            import os
-            os.makedirs("/tmp/broadcast_photos", exist_ok=True)
-            photo_path = f"/tmp/broadcast_photos/broadcast_{message.from_user.id}_{message.message_id}.jpg"
-            await photo_file.download(photo_path)
+            os.makedirs(BROADCAST_PHOTOS_DIR, exist_ok=True)
+            photo_path = os.path.join(
+                BROADCAST_PHOTOS_DIR,
+                f"broadcast_{message.from_user.id}_{message.message_id}.jpg"
+            )
+            await sessions.save_file(bot, photo_file_id, photo_path)
         except Exception as e:
             logger.error(f"Ошибка при загрузке фото: {e}")
             await message.answer("❌ Ошибка при загрузке фото. Попробуйте снова.")
@@ -292,7 +424,8 @@ async def process_broadcast_content(message: types.Message, state: FSMContext):
         [
             InlineKeyboardButton(text="✅ Активные (30 дней)", callback_data="segment_active"),
             InlineKeyboardButton(text="😴 Неактивные", callback_data="segment_inactive")
-        ]
+        ],
+        [InlineKeyboardButton(text="🧩 Свое условие", callback_data="segment_custom")]
     ])
     
     if photo_file_id:
@@ -316,16 +449,13 @@ async def process_segment_selection(callback: types.CallbackQuery, state: FSMCon
         return
     
     segment_type = callback.data.replace("segment_", "")
-    segment_names = {
-        'all': '👥 Все пользователи',
-        'new': '🆕 Новые (7 дней)',
-        'active': '✅ Активные (30 дней)',
-        'inactive': '😴 Неактивные'
-    }
+    if segment_type == 'custom':
+        await ask_segment_expression(callback, state, BroadcastStates.waiting_for_segment_expression)
+        return
     
     await state.update_data(segment_type=segment_type)
     
-    await callback.answer(f"Выбран сегмент: {segment_names.get(segment_type, segment_type)}")
+    await callback.answer(f"Выбран сегмент: {SEGMENT_NAMES.get(segment_type, segment_type)}")
     
     # Получаем данные из состояния
     data = await state.get_data()
@@ -334,7 +464,7 @@ async def process_segment_selection(callback: types.CallbackQuery, state: FSMCon
     photo_file_id = data.get('photo_file_id')
     
     preview_text = (
-        f"✅ Сегмент выбран: <b>{segment_names.get(segment_type, segment_type)}</b>\n\n"
+        f"✅ Сегмент выбран: <b>{describe_segment(segment_type)}</b>\n\n"
     )
     
     if has_photo:
@@ -367,6 +497,82 @@ async def process_segment_selection(callback: types.CallbackQuery, state: FSMCon
     await state.set_state(BroadcastStates.waiting_for_buttons)
 
 
+SEGMENT_EXPRESSION_HELP = (
+    "🧩 <b>Свое условие сегмента</b>\n\n"
+    "Отправьте условие, например:\n"
+    "<code>registered &lt; 14d and start_param = \"vk_ads\" and not blocked</code>\n\n"
+    "<b>Поля:</b>\n"
+    "• <code>registered</code>, <code>active</code> - регистрация / последняя активность: "
+    "<code>&lt; 14d</code> (не старше 14 дней), <code>&gt; 30d</code>, <code>&gt;= 2024-12-01</code>\n"
+    "• <code>start_param</code> - последний start параметр, <code>campaign</code> - при регистрации\n"
+    "• <code>username</code>, <code>user_id</code> (<code>user_id in (1, 2)</code>)\n"
+    "<b>Флаги:</b> <code>blocked</code>, <code>has_username</code>, <code>has_start_param</code>\n"
+    "<b>Операторы:</b> = != &lt; &lt;= &gt; &gt;= in (\"a\", \"b\"), and, or, not, скобки\n"
+    "<b>Единицы:</b> m, h, d, w\n"
+    "Значения чувствительны к регистру: <code>start_param = VK2</code>\n\n"
+    "Заблокированные пользователи исключаются, если в условии нет <code>blocked</code>.\n"
+    "Для отмены используйте /cancel"
+)
+
+
+async def ask_segment_expression(callback: types.CallbackQuery, state: FSMContext, next_state: State):
+    """Запросить у администратора условие сегмента"""
+    await callback.answer()
+    await callback.message.answer(SEGMENT_EXPRESSION_HELP, parse_mode=ParseMode.HTML)
+    await state.set_state(next_state)
+
+
+async def read_segment_expression(message: types.Message, expression: str,
+                                  require_users: bool = True) -> Optional[str]:
+    """
+    Проверить условие сегмента и показать администратору размер сегмента
+    
+    Returns:
+        segment_type вида 'expr:...' или None (ошибка уже показана администратору)
+    """
+    segment_type = f"{EXPR_PREFIX}{expression.strip()}"
+    
+    try:
+        plan = db.explain_segment(segment_type)
+        count = db.count_segment(segment_type)
+    except SegmentError as e:
+        await message.answer(
+            f"❌ Ошибка в условии: {html.escape(str(e))}\n\nИсправьте условие или используйте /cancel",
+            parse_mode=ParseMode.HTML
+        )
+        return None
+    
+    text = f"🎯 Сегмент: {describe_segment(segment_type)}\n👥 Пользователей: <b>{count}</b>"
+    if not plan['uses_index']:
+        text += "\n\n⚠️ <i>Условие не сужается индексом: выборка просматривает всю таблицу пользователей.</i>"
+    await message.answer(text, parse_mode=ParseMode.HTML)
+    
+    if require_users and count == 0:
+        await message.answer("❌ В сегменте нет пользователей. Измените условие или используйте /cancel")
+        return None
+    return segment_type
+
+
+@dp.message(BroadcastStates.waiting_for_segment_expression)
+async def process_segment_expression(message: types.Message, state: FSMContext):
+    """Обработка условия сегмента для обычной рассылки"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    segment_type = await read_segment_expression(message, message.text or '')
+    if not segment_type:
+        return
+    
+    await state.update_data(segment_type=segment_type)
+    await message.answer(
+        "Хотите добавить кнопки? Отправьте:\n"
+        "• <b>да</b> или <b>кнопки</b> - добавить кнопки\n"
+        "• <b>нет</b> или <b>пропустить</b> - продолжить без кнопок",
+        parse_mode=ParseMode.HTML
+    )
+    await state.set_state(BroadcastStates.waiting_for_buttons)
+
+
 @dp.message(BroadcastStates.waiting_for_buttons)
 async def process_broadcast_buttons(message: types.Message, state: FSMContext):
     """Обработка кнопок для рассылки"""
@@ -540,13 +746,10 @@ async def confirm_broadcast(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    # Создаем клавиатуру с кнопками (если есть)
-    keyboard = None
-    if buttons_data:
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=btn['text'], url=btn['url'])]
-            for btn in buttons_data
-        ])
+    # Ссылки кнопок для учета переходов (у каждого получателя своя подписанная ссылка)
+    link_ids = None
+    if buttons_data and click_tracking_enabled():
+        link_ids = db.create_broadcast_links(buttons_data)
     
     # Отправляем сообщение о начале рассылки с прогресс-баром
     progress_message = await message.answer(
@@ -562,21 +765,25 @@ async def confirm_broadcast(message: types.Message, state: FSMContext):
     # Отправляем сообщения с анимацией прогресса
     sent_count = 0
     failed_count = 0
+    # Фото загружается один раз, дальше отправляется по file_id, который вернул Telegram
+    uploaded_photo_id = None
     
     for index, user_id in enumerate(user_ids, 1):
         try:
+            keyboard = broadcast_keyboard(buttons_data, link_ids, user_id)
             # Отправляем контент
             if has_photo and photo_path:
                 # Используем сохраненный путь к фото
                 try:
-                    photo_input = FSInputFile(photo_path)
-                    await user_bot.send_photo(
+                    sent_message = await user_bot.send_photo(
                         chat_id=user_id,
-                        photo=photo_input,
+                        photo=uploaded_photo_id or sessions.input_file(user_bot, photo_path),
                         caption=broadcast_text if broadcast_text else None,
                         reply_markup=keyboard,
                         parse_mode=ParseMode.HTML if broadcast_text else None
                     )
+                    if uploaded_photo_id is None:
+                        uploaded_photo_id = sent_message.photo[-1].file_id
                 except Exception as e:
                     # Если не удалось отправить через файл, используем file_id
                     logger.warning(f"Не удалось отправить фото через файл, использую file_id: {e}")
@@ -651,12 +858,14 @@ async def confirm_broadcast(message: types.Message, state: FSMContext):
         'segment_type': segment_type
     }
     
-    db.save_broadcast(
+    broadcast_id = db.save_broadcast(
         admin_id=message.from_user.id,
         message_text=json.dumps(broadcast_content, ensure_ascii=False),
         sent_count=sent_count,
         failed_count=failed_count
     )
+    if link_ids:
+        db.attach_broadcast_links(link_ids, broadcast_id)
     
     # Финальное сообщение с результатами
     final_text = (
@@ -709,7 +918,8 @@ async def cmd_schedule(message: types.Message, state: FSMContext):
         "• Только фото\n\n"
         "После этого вы сможете выбрать сегмент и время отправки.\n\n"
         "Формат времени: <code>DD.MM.YYYY HH:MM</code>\n"
-        "Например: <code>25.12.2024 15:30</code>\n\n"
+        "Например: <code>25.12.2024 15:30</code>\n"
+        "Или расписание: <code>каждые 7d</code>, <code>cron 0 10 * * 1</code>\n\n"
         "Для отмены отправьте /cancel"
     )
     
@@ -755,7 +965,8 @@ async def process_scheduled_content(message: types.Message, state: FSMContext):
         [
             InlineKeyboardButton(text="✅ Активные (30 дней)", callback_data="sched_segment_active"),
             InlineKeyboardButton(text="😴 Неактивные", callback_data="sched_segment_inactive")
-        ]
+        ],
+        [InlineKeyboardButton(text="🧩 Свое условие", callback_data="sched_segment_custom")]
     ])
     
     if photo_file_id:
@@ -779,18 +990,15 @@ async def process_scheduled_segment(callback: types.CallbackQuery, state: FSMCon
         return
     
     segment_type = callback.data.replace("sched_segment_", "")
-    segment_names = {
-        'all': '👥 Все пользователи',
-        'new': '🆕 Новые (7 дней)',
-        'active': '✅ Активные (30 дней)',
-        'inactive': '😴 Неактивные'
-    }
+    if segment_type == 'custom':
+        await ask_segment_expression(callback, state, ScheduledBroadcastStates.waiting_for_segment_expression)
+        return
     
     await state.update_data(segment_type=segment_type)
-    await callback.answer(f"Выбран сегмент: {segment_names.get(segment_type, segment_type)}")
+    await callback.answer(f"Выбран сегмент: {SEGMENT_NAMES.get(segment_type, segment_type)}")
     
     help_text = (
-        f"✅ Сегмент: <b>{segment_names.get(segment_type, segment_type)}</b>\n\n"
+        f"✅ Сегмент: <b>{describe_segment(segment_type)}</b>\n\n"
         "⏰ <b>Укажите время отправки:</b>\n\n"
         "Формат: <code>DD.MM.YYYY HH:MM</code>\n"
         "Примеры:\n"
@@ -807,6 +1015,26 @@ async def process_scheduled_segment(callback: types.CallbackQuery, state: FSMCon
     await state.set_state(ScheduledBroadcastStates.waiting_for_buttons)
 
 
+@dp.message(ScheduledBroadcastStates.waiting_for_segment_expression)
+async def process_scheduled_segment_expression(message: types.Message, state: FSMContext):
+    """Обработка условия сегмента для отложенной рассылки"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    segment_type = await read_segment_expression(message, message.text or '')
+    if not segment_type:
+        return
+    
+    await state.update_data(segment_type=segment_type)
+    await message.answer(
+        "Хотите добавить кнопки? Отправьте:\n"
+        "• <b>да</b> - добавить кнопки\n"
+        "• <b>пропустить</b> - без кнопок",
+        parse_mode=ParseMode.HTML
+    )
+    await state.set_state(ScheduledBroadcastStates.waiting_for_buttons)
+
+
 @dp.message(ScheduledBroadcastStates.waiting_for_buttons)
 async def process_scheduled_buttons(message: types.Message, state: FSMContext):
     """Обработка кнопок для отложенной рассылки"""
@@ -874,7 +1102,11 @@ async def ask_scheduled_datetime(message: types.Message, state: FSMContext):
         "Примеры:\n"
         "• <code>25.12.2024 15:30</code>\n"
         "• <code>01.01.2025 10:00</code>\n\n"
-        "Время указывается в часовом поясе сервера."
+        "Время указывается в часовом поясе сервера.\n\n"
+        "🔁 <b>Повторяющаяся рассылка:</b>\n"
+        "• <code>каждые 7d</code> - каждые 7 дней (единицы: m, h, d, w)\n"
+        "• <code>каждые 1w с 25.12.2024 15:30</code> - с указанного времени\n"
+        "• <code>cron 0 10 * * 1</code> - по cron-выражению (пн в 10:00)"
     )
     await message.answer(text=help_text, parse_mode=ParseMode.HTML)
     await state.set_state(ScheduledBroadcastStates.waiting_for_datetime)
@@ -887,9 +1119,14 @@ async def process_scheduled_datetime(message: types.Message, state: FSMContext):
         return
     
     try:
-        # Парсим дату и время
+        # Парсим дату и время или расписание повторяющейся рассылки
         datetime_str = message.text.strip()
-        scheduled_dt = datetime.strptime(datetime_str, "%d.%m.%Y %H:%M")
+        recurrence = None
+        if datetime_str[:1].isdigit():
+            scheduled_dt = datetime.strptime(datetime_str, "%d.%m.%Y %H:%M")
+        else:
+            recurrence, start_at = parse_recurrence(datetime_str)
+            scheduled_dt = first_fire(recurrence, start_at)
         
         # Проверяем, что время в будущем
         if scheduled_dt <= datetime.now():
@@ -917,20 +1154,15 @@ async def process_scheduled_datetime(message: types.Message, state: FSMContext):
             admin_id=message.from_user.id,
             message_text=json.dumps(broadcast_content, ensure_ascii=False),
             scheduled_at=scheduled_dt.isoformat(),
-            segment_type=segment_type
+            segment_type=segment_type,
+            recurrence=recurrence
         )
         
-        segment_names = {
-            'all': '👥 Все пользователи',
-            'new': '🆕 Новые (7 дней)',
-            'active': '✅ Активные (30 дней)',
-            'inactive': '😴 Неактивные'
-        }
-        
         success_text = (
             "✅ <b>Отложенная рассылка создана!</b>\n\n"
             f"📅 <b>Время отправки:</b> {scheduled_dt.strftime('%d.%m.%Y %H:%M')}\n"
-            f"🎯 <b>Сегмент:</b> {segment_names.get(segment_type, segment_type)}\n"
+            f"🔁 <b>Повтор:</b> {describe_recurrence(recurrence)}\n"
+            f"🎯 <b>Сегмент:</b> {describe_segment(segment_type)}\n"
             f"📝 <b>Контент:</b> {'С фото' if has_photo else 'Текст'}\n"
             f"🔘 <b>Кнопок:</b> {len(buttons_data) if buttons_data else 0}\n\n"
             "Рассылка будет отправлена автоматически в указанное время."
@@ -943,37 +1175,25 @@ async def process_scheduled_datetime(message: types.Message, state: FSMContext):
         await message.answer(
             "❌ Неверный формат даты и времени!\n\n"
             "Используйте формат: <code>DD.MM.YYYY HH:MM</code>\n"
-            "Пример: <code>25.12.2024 15:30</code>",
+            "Пример: <code>25.12.2024 15:30</code>\n"
+            "Или расписание: <code>каждые 7d</code>, <code>cron 0 10 * * 1</code>",
             parse_mode=ParseMode.HTML
         )
 
 
 # ==================== ШАБЛОНЫ ====================
 
-@dp.message(Command("templates"))
-async def cmd_templates(message: types.Message):
-    """Показать список шаблонов"""
-    if not is_admin(message.from_user.id):
-        return
-    
-    templates = db.get_templates(message.from_user.id)
+def render_templates_page(admin_id: int, before_id: Optional[int] = None):
+    """Страница списка шаблонов: (текст, клавиатура) или (None, None), если шаблонов нет"""
+    templates, next_cursor = db.get_templates_page(admin_id, before_id, limit=PAGE_SIZE)
     
-    if not templates:
-        await message.answer(
-            "📝 <b>Шаблоны рассылок</b>\n\n"
-            "У вас пока нет сохраненных шаблонов.\n\n"
-            "💡 <b>Как создать шаблон:</b>\n"
-            "1. Создайте рассылку через /broadcast\n"
-            "2. После успешной рассылки используйте /template_save [название]\n\n"
-            "Или создайте новый шаблон прямо сейчас.",
-            parse_mode=ParseMode.HTML
-        )
-        return
+    if not templates and before_id is None:
+        return None, None
     
     text = "📝 <b>Ваши шаблоны:</b>\n\n"
     keyboard_buttons = []
     
-    for template in templates[:10]:  # Показываем первые 10
+    for template in templates:
         name = template['name']
         created = datetime.fromisoformat(template['created_at']).strftime("%d.%m.%Y")
         text += f"• <b>{name}</b> (создан {created})\n"
@@ -984,15 +1204,64 @@ async def cmd_templates(message: types.Message):
             )
         ])
     
+    navigation = pagination_row("templates_page_", next_cursor, before_id is None)
+    if navigation:
+        keyboard_buttons.append(navigation)
+    
     keyboard_buttons.append([
         InlineKeyboardButton(text="🗑 Удалить", callback_data="template_delete_menu"),
         InlineKeyboardButton(text="➕ Создать", callback_data="template_create")
     ])
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+
+async def send_templates(message: types.Message, admin_id: int):
+    """Отправить первую страницу шаблонов администратора"""
+    text, keyboard = render_templates_page(admin_id)
+    
+    if not text:
+        await message.answer(
+            "📝 <b>Шаблоны рассылок</b>\n\n"
+            "У вас пока нет сохраненных шаблонов.\n\n"
+            "💡 <b>Как создать шаблон:</b>\n"
+            "1. Создайте рассылку через /broadcast\n"
+            "2. После успешной рассылки используйте /template_save [название]\n\n"
+            "Или создайте новый шаблон прямо сейчас.",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
     await message.answer(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
 
 
+@dp.message(Command("templates"))
+async def cmd_templates(message: types.Message):
+    """Показать список шаблонов"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    await send_templates(message, message.from_user.id)
+
+
+@dp.callback_query(F.data.startswith("templates_page_"))
+async def templates_page(callback: types.CallbackQuery):
+    """Следующая страница шаблонов"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    text, keyboard = render_templates_page(
+        callback.from_user.id, page_cursor(callback.data, "templates_page_")
+    )
+    if not text:
+        await callback.answer("❌ Нет шаблонов", show_alert=True)
+        return
+    
+    await callback.message.edit_text(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    await callback.answer()
+
+
 @dp.callback_query(F.data.startswith("template_use_"))
 async def use_template(callback: types.CallbackQuery, state: FSMContext):
     """Использовать шаблон для рассылки"""
@@ -1036,7 +1305,8 @@ async def use_template(callback: types.CallbackQuery, state: FSMContext):
         [
             InlineKeyboardButton(text="✅ Активные (30 дней)", callback_data="segment_active"),
             InlineKeyboardButton(text="😴 Неактивные", callback_data="segment_inactive")
-        ]
+        ],
+        [InlineKeyboardButton(text="🧩 Свое условие", callback_data="segment_custom")]
     ])
     
     if template['photo_file_id']:
@@ -1052,14 +1322,15 @@ async def use_template(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(BroadcastStates.waiting_for_segment)
 
 
-@dp.callback_query(F.data == "template_delete_menu")
+@dp.callback_query(F.data.startswith("template_delete_menu"))
 async def template_delete_menu(callback: types.CallbackQuery):
     """Меню удаления шаблонов"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    templates = db.get_templates(callback.from_user.id)
+    before_id = page_cursor(callback.data, "template_delete_menu")
+    templates, next_cursor = db.get_templates_page(callback.from_user.id, before_id, limit=PAGE_SIZE)
     
     if not templates:
         await callback.answer("❌ Нет шаблонов для удаления", show_alert=True)
@@ -1068,7 +1339,7 @@ async def template_delete_menu(callback: types.CallbackQuery):
     text = "🗑 <b>Выберите шаблон для удаления:</b>\n\n"
     keyboard_buttons = []
     
-    for template in templates[:10]:
+    for template in templates:
         keyboard_buttons.append([
             InlineKeyboardButton(
                 text=f"🗑 {template['name'][:30]}",
@@ -1076,6 +1347,10 @@ async def template_delete_menu(callback: types.CallbackQuery):
             )
         ])
     
+    navigation = pagination_row("template_delete_menu_", next_cursor, before_id is None)
+    if navigation:
+        keyboard_buttons.append(navigation)
+    
     keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
     await callback.message.edit_text(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
     await callback.answer()
@@ -1103,7 +1378,7 @@ async def template_delete(callback: types.CallbackQuery):
     
     if deleted:
         await callback.answer(f"✅ Шаблон '{template['name']}' удален")
-        await cmd_templates(callback.message)
+        await send_templates(callback.message, callback.from_user.id)
     else:
         await callback.answer("❌ Ошибка при удалении", show_alert=True)
 
@@ -1207,6 +1482,31 @@ async def cmd_users(message: types.Message, state: FSMContext):
     await state.set_state(UserManagementStates.waiting_for_search)
 
 
+def render_user_search_page(query: str, after_user_id: Optional[int] = None):
+    """Страница результатов поиска: (пользователи, текст, клавиатура)"""
+    users, next_cursor = db.search_users_page(query, after_user_id, limit=PAGE_SIZE)
+    
+    text = f"🔍 <b>Результаты поиска «{html.escape(query)}»:</b>\n\n"
+    keyboard_buttons = []
+    
+    for user in users:
+        name = f"{user['first_name'] or ''} {user['last_name'] or ''}".strip() or "Без имени"
+        username = f"@{user['username']}" if user['username'] else "нет username"
+        text += f"• {name} ({username}) - ID: {user['user_id']}\n"
+        keyboard_buttons.append([
+            InlineKeyboardButton(
+                text=f"👤 {name[:20]}",
+                callback_data=f"user_info_{user['user_id']}"
+            )
+        ])
+    
+    navigation = pagination_row("users_page_", next_cursor, after_user_id is None)
+    if navigation:
+        keyboard_buttons.append(navigation)
+    
+    return users, text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+
 @dp.message(UserManagementStates.waiting_for_search)
 async def process_user_search(message: types.Message, state: FSMContext):
     """Обработка поиска пользователей"""
@@ -1214,7 +1514,7 @@ async def process_user_search(message: types.Message, state: FSMContext):
         return
     
     query = message.text.strip()
-    users = db.search_users(query)
+    users, text, keyboard = render_user_search_page(query)
     
     if not users:
         await message.answer("❌ Пользователи не найдены.")
@@ -1247,25 +1547,33 @@ async def process_user_search(message: types.Message, state: FSMContext):
         
         await message.answer(text=user_text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
     else:
-        # Показываем список
-        text = f"🔍 <b>Найдено пользователей: {len(users)}</b>\n\n"
-        keyboard_buttons = []
-        
-        for user in users[:10]:
-            name = f"{user['first_name'] or ''} {user['last_name'] or ''}".strip() or "Без имени"
-            username = f"@{user['username']}" if user['username'] else "нет username"
-            text += f"• {name} ({username}) - ID: {user['user_id']}\n"
-            keyboard_buttons.append([
-                InlineKeyboardButton(
-                    text=f"👤 {name[:20]}",
-                    callback_data=f"user_info_{user['user_id']}"
-                )
-            ])
-        
-        keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
         await message.answer(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
     
+    # Запрос остается в данных FSM для перехода по страницам
     await state.clear()
+    await state.update_data(user_search_query=query)
+
+
+@dp.callback_query(F.data.startswith("users_page_"))
+async def users_page(callback: types.CallbackQuery, state: FSMContext):
+    """Следующая страница результатов поиска пользователей"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    data = await state.get_data()
+    query = data.get('user_search_query')
+    if not query:
+        await callback.answer("❌ Поиск устарел, выполните его заново через /users", show_alert=True)
+        return
+    
+    users, text, keyboard = render_user_search_page(query, page_cursor(callback.data, "users_page_"))
+    if not users:
+        await callback.answer("Больше результатов нет", show_alert=True)
+        return
+    
+    await callback.message.edit_text(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    await callback.answer()
 
 
 @dp.callback_query(F.data.startswith("user_toggle_"))
@@ -1345,13 +1653,16 @@ async def cmd_analytics(message: types.Message):
         return
     
     try:
-        stats = db.get_detailed_stats()
-        date_stats = db.get_user_stats_by_date(days=30)
+        stats = analytics_db.get_detailed_stats()
+        date_stats = analytics_db.get_user_stats_by_date(days=30)
         
         # Формируем график роста (текстовый)
         growth_chart = "📈 <b>Рост пользователей (последние 30 дней):</b>\n\n"
         
-        if date_stats:
+        if date_stats and charts.is_available():
+            # PNG график - по кнопке "График роста", здесь только итог
+            growth_chart += f"За 30 дней: <b>{sum(row['count'] for row in date_stats)}</b> новых пользователей\n"
+        elif date_stats:
             # Берем последние 7 дней для компактности
             recent_stats = date_stats[:7]
             max_count = max([s['count'] for s in recent_stats], default=1)
@@ -1408,8 +1719,14 @@ async def cmd_analytics(message: types.Message):
         else:
             analytics_text += "• Среднее сообщений на рассылку: <b>0</b>\n"
         
+        analytics_text += analytics_freshness()
+        
         keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="📈 График роста", callback_data="analytics_growth")],
+            [InlineKeyboardButton(text="📢 График рассылок", callback_data="analytics_broadcasts")],
+            [InlineKeyboardButton(text="👥 Когорты и удержание", callback_data="analytics_cohorts")],
+            [InlineKeyboardButton(text="📅 DAU / WAU / MAU", callback_data="analytics_activity")],
+            [InlineKeyboardButton(text="🔻 Воронка", callback_data="analytics_funnel")],
             [InlineKeyboardButton(text="📊 Экспорт данных", callback_data="analytics_export")]
         ])
         
@@ -1442,7 +1759,7 @@ async def analytics_growth(callback: types.CallbackQuery):
         return
     
     try:
-        date_stats = db.get_user_stats_by_date(days=30)
+        date_stats = analytics_db.get_user_stats_by_date(days=30)
         
         if not date_stats:
             await callback.answer("Нет данных для графика", show_alert=True)
@@ -1454,6 +1771,15 @@ async def analytics_growth(callback: types.CallbackQuery):
         
         await callback.answer()
         
+        if charts.is_available() and callback.message:
+            await chart_cache.send(
+                callback.message, 'growth',
+                tuple((row['date'], row['count']) for row in date_stats),
+                charts.render_growth, date_stats,
+                caption="📈 Рост пользователей за 30 дней" + analytics_freshness()
+            )
+            return
+        
         growth_chart = "📈 <b>График роста пользователей (30 дней):</b>\n\n"
         
         # Показываем все дни
@@ -1496,6 +1822,217 @@ async def analytics_growth(callback: types.CallbackQuery):
         await callback.answer("❌ Ошибка при построении графика", show_alert=True)
 
 
+@dp.callback_query(F.data == "analytics_broadcasts")
+async def analytics_broadcasts(callback: types.CallbackQuery):
+    """График отправленных сообщений и ошибок по последним рассылкам"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    if not charts.is_available():
+        await callback.answer("Для графиков установите matplotlib", show_alert=True)
+        return
+    
+    broadcasts = analytics_db.get_broadcast_stats(limit=30)
+    if not broadcasts:
+        await callback.answer("Рассылок еще не было", show_alert=True)
+        return
+    
+    await callback.answer()
+    try:
+        await chart_cache.send(
+            callback.message, 'broadcasts',
+            tuple((row['id'], row['sent_count'], row['failed_count']) for row in broadcasts),
+            charts.render_broadcasts, broadcasts,
+            caption=f"📢 Последние рассылки: {len(broadcasts)}" + analytics_freshness()
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при построении графика рассылок: {e}", exc_info=True)
+        await callback.message.answer("❌ Ошибка при построении графика.")
+
+
+@dp.message(Command("cohorts"))
+async def cmd_cohorts(message: types.Message):
+    """Когортный анализ: удержание, отток, давность активности"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    await send_cohorts(message)
+
+
+@dp.callback_query(F.data == "analytics_cohorts")
+async def analytics_cohorts(callback: types.CallbackQuery):
+    """Когортный анализ через callback"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await callback.answer()
+    await send_cohorts(callback.message)
+
+
+async def send_cohorts(message: types.Message):
+    """Отправить когортный отчет"""
+    if not cohorts.is_available():
+        await message.answer("❌ Для когортного анализа установите numpy: pip install -r requirements.txt")
+        return
+    
+    try:
+        report = await cohort_engine.get_report()
+    except ReportTimeout as e:
+        await message.answer(f"⏱ {e}. Попробуйте позже.")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при расчете когорт: {e}", exc_info=True)
+        await message.answer("❌ Ошибка при расчете когорт.")
+        return
+    
+    await message.answer(text=cohorts.render_report(report), parse_mode=ParseMode.HTML)
+    
+    if charts.is_available():
+        try:
+            await chart_cache.send(
+                message, 'cohorts', report.generated_at, charts.render_cohorts, report
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при построении графика когорт: {e}", exc_info=True)
+
+
+@dp.message(Command("activity"))
+async def cmd_activity(message: types.Message, command: CommandObject):
+    """
+    Активные пользователи по скетчам HyperLogLog
+    
+    /activity - DAU/WAU/MAU на сегодня, /activity ДД.ММ.ГГГГ - на день,
+    /activity ДД.ММ.ГГГГ ДД.ММ.ГГГГ - уникальные пользователи за период
+    """
+    if not is_admin(message.from_user.id):
+        return
+    
+    try:
+        days = [datetime.strptime(arg, "%d.%m.%Y").date() for arg in (command.args or "").split()]
+    except ValueError:
+        days = None
+    if days is None or len(days) > 2 or (len(days) == 2 and days[0] > days[1]):
+        await message.answer(
+            "❌ Формат: /activity [ДД.ММ.ГГГГ] [ДД.ММ.ГГГГ]\n"
+            "Например: /activity 01.09.2024 30.09.2024"
+        )
+        return
+    
+    await send_activity(message, *days)
+
+
+@dp.callback_query(F.data == "analytics_activity")
+async def analytics_activity(callback: types.CallbackQuery):
+    """DAU/WAU/MAU на сегодня через callback"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await callback.answer()
+    await send_activity(callback.message)
+
+
+async def send_activity(message: types.Message, first_day=None, last_day=None):
+    """Отправить отчет об активных пользователях на день или за период"""
+    try:
+        if last_day is None:
+            day = first_day or activity.today()
+            report = await report_runner.run(('activity', day), activity.build_report, db, day)
+            text = activity.render_report(report)
+        else:
+            unique, average_dau = await report_runner.run(
+                ('activity', first_day, last_day), activity.count_range, db, first_day, last_day
+            )
+            text = activity.render_range(first_day, last_day, unique, average_dau)
+    except ReportTimeout as e:
+        await message.answer(f"⏱ {e}. Попробуйте позже.")
+        return
+    except Exception as e:
+        logger.error(f"Ошибка при расчете активности: {e}", exc_info=True)
+        await message.answer("❌ Ошибка при расчете активности.")
+        return
+    
+    await message.answer(text=text, parse_mode=ParseMode.HTML)
+
+
+@dp.message(Command("funnel"))
+async def cmd_funnel(message: types.Message, command: CommandObject):
+    """Воронка за N дней (по умолчанию 30)"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    days = 30
+    if command.args:
+        if not command.args.strip().isdigit() or not 1 <= int(command.args) <= 365:
+            await message.answer("❌ Формат: /funnel [дней от 1 до 365]")
+            return
+        days = int(command.args)
+    
+    await send_funnel(message, days)
+
+
+@dp.callback_query(F.data == "analytics_funnel")
+async def analytics_funnel(callback: types.CallbackQuery):
+    """Воронка за 30 дней через callback"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await callback.answer()
+    await send_funnel(callback.message, 30)
+
+
+async def send_funnel(message: types.Message, days: int):
+    """Отправить воронку по счетчикам funnel_daily"""
+    try:
+        totals, campaigns = db.get_funnel(events.FUNNEL_STEPS, days=days)
+    except Exception as e:
+        logger.error(f"Ошибка при получении воронки: {e}", exc_info=True)
+        await message.answer("❌ Ошибка при получении воронки.")
+        return
+    
+    await message.answer(text=events.render_funnel(totals, campaigns, days), parse_mode=ParseMode.HTML)
+
+
+@dp.message(Command("pool"))
+async def cmd_pool(message: types.Message):
+    """Состояние пула HTTP соединений с Bot API"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    await message.answer(text=sessions.render_stats(get_session().stats()), parse_mode=ParseMode.HTML)
+
+
+def export_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура выбора набора данных и формата выгрузки"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text=f"{title} · {export_format.upper()}",
+                                 callback_data=f"export_{dataset}_{export_format}")
+            for export_format in EXPORT_FORMATS
+        ]
+        for dataset, title in EXPORT_DATASETS.items()
+    ])
+
+
+EXPORT_MENU_TEXT = (
+    "📊 <b>Экспорт данных</b>\n\n"
+    "Выберите набор данных и формат. Файл придет документом "
+    "(CSV или JSON Lines, сжатый gzip)."
+)
+
+
+@dp.message(Command("export"))
+async def cmd_export(message: types.Message):
+    """Меню выгрузки данных"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    await message.answer(text=EXPORT_MENU_TEXT, reply_markup=export_keyboard(), parse_mode=ParseMode.HTML)
+
+
 @dp.callback_query(F.data == "analytics_export")
 async def analytics_export(callback: types.CallbackQuery):
     """Экспорт данных аналитики"""
@@ -1503,72 +2040,118 @@ async def analytics_export(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
+    await callback.answer()
+    await callback.message.answer(text=EXPORT_MENU_TEXT, reply_markup=export_keyboard(), parse_mode=ParseMode.HTML)
+
+
+@dp.callback_query(F.data.startswith("export_"))
+async def export_data(callback: types.CallbackQuery):
+    """Выгрузить набор данных и отправить документом"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    dataset, _, export_format = callback.data[len("export_"):].rpartition('_')
+    if dataset not in EXPORT_DATASETS or export_format not in EXPORT_FORMATS:
+        await callback.answer("❌ Неизвестная выгрузка", show_alert=True)
+        return
+    
+    await callback.answer()
+    key = ('export', dataset, export_format)
+    progress = await callback.message.answer(
+        f"⏳ Готовлю выгрузку «{EXPORT_DATASETS[dataset]}»...",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(text="❌ Отменить", callback_data=f"report_cancel_{dataset}_{export_format}")
+        ]])
+    )
+    document = None
+    
     try:
-        stats = db.get_detailed_stats()
-        date_stats = db.get_user_stats_by_date(days=30)
-        
-        export_text = "📊 <b>Экспорт данных аналитики</b>\n\n"
-        export_text += "📈 <b>Статистика пользователей:</b>\n"
-        export_text += f"Всего: {stats['total_users']}\n"
-        export_text += f"Новые сегодня: {stats['new_today']}\n"
-        export_text += f"Новые за неделю: {stats['new_week']}\n"
-        export_text += f"Новые за месяц: {stats['new_month']}\n"
-        export_text += f"Активные (30 дней): {stats['active_month']}\n\n"
-        
-        export_text += "📢 <b>Статистика рассылок:</b>\n"
-        export_text += f"Всего рассылок: {stats['total_broadcasts']}\n"
-        export_text += f"Отправлено сообщений: {stats['total_sent']}\n"
-        export_text += f"Отложенных: {stats['scheduled_broadcasts']}\n\n"
-        
-        if date_stats:
-            export_text += "📅 <b>Регистрации по датам (последние 30 дней):</b>\n"
-            for stat in reversed(date_stats[:30]):
-                date_str = stat['date']
-                try:
-                    # Парсим дату из SQLite формата YYYY-MM-DD
-                    if isinstance(date_str, str):
-                        if 'T' in date_str:
-                            date_obj = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                        else:
-                            date_obj = datetime.strptime(date_str, "%Y-%m-%d")
-                    else:
-                        date_obj = datetime.fromisoformat(str(date_str))
-                    date = date_obj.strftime("%d.%m.%Y")
-                except Exception as e:
-                    logger.warning(f"Ошибка парсинга даты {date_str}: {e}")
-                    date = str(date_str)
-                export_text += f"{date}: {stat['count']}\n"
-        
-        # Отправляем как файл (в виде текста, так как Telegram Bot API не поддерживает CSV напрямую)
-        await callback.message.answer(
-            text=export_text,
-            parse_mode=ParseMode.HTML
+        # Одинаковые выгрузки, запрошенные одновременно, считаются один раз
+        # Наборы по пользователям и рассылкам читаются из зеркала аналитики
+        source = analytics_db if dataset in ('users', 'broadcasts', 'registrations') else db
+        path, filename, count = await report_runner.run(
+            key, build_export, source, dataset, export_format, discard=discard_export
         )
-        
-        await callback.answer("✅ Данные экспортированы")
-        
+        document = ExportFile(path, filename)
+        await callback.message.answer_document(
+            document=document,
+            caption=f"{EXPORT_DATASETS[dataset]}: {count} строк"
+        )
+        await progress.delete()
+    except ReportCancelled:
+        await progress.edit_text("🚫 Выгрузка отменена.")
+    except ReportTimeout as e:
+        await progress.edit_text(f"⏱ {e}. Попробуйте позже.")
     except Exception as e:
-        logger.error(f"Ошибка при экспорте: {e}")
-        await callback.answer("❌ Ошибка при экспорте", show_alert=True)
+        logger.error(f"Ошибка при экспорте {dataset} ({export_format}): {e}", exc_info=True)
+        await progress.edit_text("❌ Ошибка при экспорте данных.")
+    finally:
+        if document is not None:
+            document.close()
+
+
+@dp.callback_query(F.data.startswith("report_cancel_"))
+async def report_cancel(callback: types.CallbackQuery):
+    """Отменить выгрузку"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    dataset, _, export_format = callback.data[len("report_cancel_"):].rpartition('_')
+    if report_runner.cancel(('export', dataset, export_format)):
+        await callback.answer("Выгрузка отменяется")
+    else:
+        await callback.answer("Выгрузка уже завершена", show_alert=True)
 
 
 # ==================== ИСТОРИЯ РАССЫЛОК ====================
 
-@dp.message(Command("history"))
-async def cmd_history(message: types.Message):
-    """Показать историю рассылок"""
+@dp.message(Command("campaigns"))
+async def cmd_campaigns(message: types.Message):
+    """Показать статистику кампаний (start параметров)"""
     if not is_admin(message.from_user.id):
         return
     
-    broadcasts = db.get_broadcast_stats(limit=20)
+    campaigns = db.get_campaign_stats(limit=20)
     
-    if not broadcasts:
-        await message.answer("📜 История рассылок пуста.")
+    if not campaigns:
+        await message.answer(
+            "🔗 Кампаний пока нет.\n\n"
+            "Кампания появляется, когда пользователь приходит по ссылке вида "
+            "<code>https://t.me/&lt;бот&gt;?start=название</code>.",
+            parse_mode=ParseMode.HTML
+        )
         return
     
+    text = (
+        "🔗 <b>Кампании (start параметры):</b>\n\n"
+        "<i>Регистрации - первое касание, возвраты - уже зарегистрированные "
+        "пользователи, пришедшие по ссылке. Активность - по кампании первого касания.</i>\n\n"
+    )
+    
+    for campaign in campaigns:
+        text += (
+            f"🔑 <b>{campaign['start_param']}</b>\n"
+            f"• Регистраций: <b>{campaign['signups']}</b>\n"
+            f"• Возвратов: <b>{campaign['returning_users']}</b>\n"
+            f"• Переходов всего: {campaign['touches']}\n"
+            f"• Активны 7 / 30 дней: {campaign['active_7d']} / {campaign['active_30d']}\n\n"
+        )
+    
+    await message.answer(text=text, parse_mode=ParseMode.HTML)
+
+
+def render_history_page(before_id: Optional[int] = None):
+    """Страница истории рассылок: (текст, клавиатура) или (None, None), если история пуста"""
+    broadcasts, next_cursor = db.get_broadcast_history_page(before_id, limit=PAGE_SIZE)
+    
+    if not broadcasts:
+        return None, None
+    
     text = "📜 <b>История рассылок:</b>\n\n"
     
-    for broadcast in broadcasts[:10]:
+    for broadcast in broadcasts:
         created = datetime.fromisoformat(broadcast['created_at']).strftime("%d.%m.%Y %H:%M")
         content = json.loads(broadcast['message_text']) if broadcast['message_text'] else {}
         
@@ -1577,15 +2160,11 @@ async def cmd_history(message: types.Message):
             f"✅ Отправлено: {broadcast['sent_count']}\n"
             f"❌ Ошибок: {broadcast['failed_count']}\n"
         )
+        if broadcast.get('failed_at'):
+            text += "⚠️ Не выполнена до конца\n"
         
         if content.get('segment_type'):
-            segment_names = {
-                'all': '👥 Все',
-                'new': '🆕 Новые',
-                'active': '✅ Активные',
-                'inactive': '😴 Неактивные'
-            }
-            text += f"🎯 Сегмент: {segment_names.get(content['segment_type'], content['segment_type'])}\n"
+            text += f"🎯 Сегмент: {describe_segment(content['segment_type'])}\n"
         
         if content.get('has_photo'):
             text += "📷 С фото\n"
@@ -1594,13 +2173,48 @@ async def cmd_history(message: types.Message):
         
         text += "\n"
     
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📊 Детальная статистика", callback_data="history_detailed")]
+    keyboard_buttons = []
+    navigation = pagination_row("history_page_", next_cursor, before_id is None)
+    if navigation:
+        keyboard_buttons.append(navigation)
+    keyboard_buttons.append([
+        InlineKeyboardButton(text="📊 Детальная статистика", callback_data="history_detailed")
     ])
     
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+
+@dp.message(Command("history"))
+async def cmd_history(message: types.Message):
+    """Показать историю рассылок"""
+    if not is_admin(message.from_user.id):
+        return
+    
+    text, keyboard = render_history_page()
+    
+    if not text:
+        await message.answer("📜 История рассылок пуста.")
+        return
+    
     await message.answer(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
 
 
+@dp.callback_query(F.data.startswith("history_page_"))
+async def history_page(callback: types.CallbackQuery):
+    """Следующая страница истории рассылок"""
+    if not is_admin(callback.from_user.id):
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    text, keyboard = render_history_page(page_cursor(callback.data, "history_page_"))
+    if not text:
+        await callback.answer("История пуста", show_alert=True)
+        return
+    
+    await callback.message.edit_text(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+    await callback.answer()
+
+
 # ==================== CALLBACK ОБРАБОТЧИКИ МЕНЮ ====================
 
 @dp.callback_query(F.data == "menu_stats")
@@ -1617,9 +2231,8 @@ async def menu_stats(callback: types.CallbackQuery):
         await callback.answer()
         logger.info(f"Callback menu_stats обработан для пользователя {callback.from_user.id}")
         
-        # Используем callback.message.answer вместо передачи callback.message в функцию
         if callback.message:
-            await cmd_stats(callback.message)
+            await send_stats(callback.message, callback.from_user.id)
         else:
             # Если message недоступен, отправляем через бота
             await bot.send_message(callback.from_user.id, "Используйте команду /stats")
@@ -1689,7 +2302,7 @@ async def menu_templates(callback: types.CallbackQuery):
         await callback.answer()
         
         if callback.message:
-            await cmd_templates(callback.message)
+            await send_templates(callback.message, callback.from_user.id)
         else:
             await bot.send_message(callback.from_user.id, "Используйте команду /templates")
     except Exception as e:
@@ -1735,7 +2348,12 @@ async def menu_history(callback: types.CallbackQuery):
         await callback.answer()
         
         if callback.message:
-            await cmd_history(callback.message)
+            # cmd_history проверяет message.from_user, а у сообщения меню это бот
+            text, keyboard = render_history_page()
+            if text:
+                await callback.message.answer(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+            else:
+                await callback.message.answer("📜 История рассылок пуста.")
         else:
             await bot.send_message(callback.from_user.id, "Используйте команду /history")
     except Exception as e:
@@ -1746,26 +2364,28 @@ async def menu_history(callback: types.CallbackQuery):
             pass
 
 
-@dp.callback_query(F.data == "history_detailed")
+@dp.callback_query(F.data.startswith("history_detailed"))
 async def history_detailed(callback: types.CallbackQuery):
     """Детальная история рассылок"""
     if not is_admin(callback.from_user.id):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    broadcasts = db.get_broadcast_stats(limit=50)
+    before_id = page_cursor(callback.data, "history_detailed")
+    broadcasts, next_cursor = analytics_db.get_broadcast_history_page(before_id, limit=HISTORY_DETAILED_PAGE_SIZE)
     
     if not broadcasts:
         await callback.answer("История пуста", show_alert=True)
         return
     
     text = "📜 <b>Детальная история рассылок:</b>\n\n"
+    clicks = analytics_db.get_broadcast_clicks([b['id'] for b in broadcasts])
     
     total_sent = sum(b['sent_count'] for b in broadcasts)
     total_failed = sum(b['failed_count'] for b in broadcasts)
     
-    text += f"📊 <b>Общая статистика:</b>\n"
-    text += f"Всего рассылок: {len(broadcasts)}\n"
+    text += f"📊 <b>Статистика страницы:</b>\n"
+    text += f"Рассылок: {len(broadcasts)}\n"
     text += f"Отправлено сообщений: {total_sent}\n"
     text += f"Ошибок: {total_failed}\n"
     if (total_sent + total_failed) > 0:
@@ -1774,27 +2394,31 @@ async def history_detailed(callback: types.CallbackQuery):
     else:
         text += "Успешность: 0%\n\n"
     
-    text += "📅 <b>Последние рассылки:</b>\n\n"
+    text += "📅 <b>Рассылки:</b>\n\n"
     
-    for broadcast in broadcasts[:15]:
+    for broadcast in broadcasts:
         created = datetime.fromisoformat(broadcast['created_at']).strftime("%d.%m %H:%M")
         content = json.loads(broadcast['message_text']) if broadcast['message_text'] else {}
         
         text += f"📅 {created}\n"
         text += f"✅ {broadcast['sent_count']} | ❌ {broadcast['failed_count']}\n"
+        if broadcast['id'] in clicks:
+            # Доля считается по уникальным пользователям: повторные клики не дают больше 100%
+            link_stats = clicks[broadcast['id']]
+            click_rate = link_stats['clickers'] / broadcast['sent_count'] * 100 if broadcast['sent_count'] else 0
+            text += f"👆 Перешли: {link_stats['clickers']} ({click_rate:.1f}%), переходов: {link_stats['clicks']}\n"
         
         if content.get('segment_type'):
-            segment_names = {
-                'all': '👥 Все',
-                'new': '🆕 Новые',
-                'active': '✅ Активные',
-                'inactive': '😴 Неактивные'
-            }
-            text += f"🎯 {segment_names.get(content['segment_type'], content['segment_type'])}\n"
+            text += f"🎯 {describe_segment(content['segment_type'])}\n"
         
         text += "\n"
     
-    await callback.message.edit_text(text=text, parse_mode=ParseMode.HTML)
+    text += analytics_freshness().lstrip()
+    
+    navigation = pagination_row("history_detailed_", next_cursor, before_id is None)
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[navigation] if navigation else [])
+    
+    await callback.message.edit_text(text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
     await callback.answer()
 
 
@@ -1817,114 +2441,354 @@ async def handle_message(message: types.Message):
     )
 
 
+async def cleanup_abandoned_drafts():
+    """Периодическое удаление брошенных черновиков FSM и их фото"""
+    ttl_seconds = FSM_STORAGE_TTL_HOURS * 3600
+    
+    while True:
+        try:
+            storage.purge_expired()
+            
+            # Фото черновиков, которые так и не были отправлены
+            if os.path.isdir(BROADCAST_PHOTOS_DIR):
+                expire_before = datetime.now().timestamp() - ttl_seconds
+                for entry in os.scandir(BROADCAST_PHOTOS_DIR):
+                    if entry.is_file() and entry.stat().st_mtime < expire_before:
+                        os.remove(entry.path)
+                        logger.info(f"Удалено фото брошенного черновика: {entry.name}")
+        except Exception as e:
+            logger.error(f"Ошибка при очистке брошенных черновиков: {e}")
+        
+        await asyncio.sleep(3600)
+
+
+async def refresh_analytics_mirror():
+    """Периодическая синхронизация зеркала аналитики"""
+    while True:
+        await asyncio.sleep(ANALYTICS_REFRESH_SECONDS)
+        try:
+            await asyncio.to_thread(analytics_mirror.refresh)
+        except Exception as e:
+            logger.error(f"Ошибка при обновлении зеркала аналитики: {e}")
+
+
 async def check_scheduled_broadcasts():
-    """Проверка и отправка отложенных рассылок"""
+    """
+    Проверка и отправка отложенных рассылок
+    
+    Каждая рассылка сначала захватывается в аренду (lease), поэтому
+    планировщик можно запускать в нескольких экземплярах admin_bot:
+    рассылку выполняет ровно один экземпляр, а рассылки упавшего
+    экземпляра подхватываются после истечения его аренды.
+    """
     while True:
         try:
-            scheduled = db.get_scheduled_broadcasts()
-            now = datetime.now()
+            # Заранее сохраняем снимки аудитории для ближайших рассылок
+            horizon = (datetime.now() + timedelta(minutes=AUDIENCE_SNAPSHOT_LEAD_MINUTES)).isoformat(timespec='seconds')
+            while True:
+                broadcast = db.claim_broadcast_for_snapshot(SCHEDULER_INSTANCE_ID, SCHEDULER_LEASE_SECONDS, horizon)
+                if not broadcast:
+                    break
+                await prepare_audience_snapshot(broadcast)
             
-            for broadcast in scheduled:
-                scheduled_time = datetime.fromisoformat(broadcast['scheduled_at'])
-                
-                # Если время наступило (с запасом в 1 минуту)
-                if scheduled_time <= now:
-                    try:
-                        await send_scheduled_broadcast(broadcast)
-                        # Помечаем рассылку как выполненную
-                        conn = db.get_connection()
-                        cursor = conn.cursor()
-                        cursor.execute(
-                            'UPDATE broadcasts SET is_scheduled = 0 WHERE id = ?',
-                            (broadcast['id'],)
-                        )
-                        conn.commit()
-                        conn.close()
-                        logger.info(f"Отложенная рассылка {broadcast['id']} отправлена")
-                    except Exception as e:
-                        logger.error(f"Ошибка при отправке отложенной рассылки {broadcast['id']}: {e}")
+            # Выполняем все наступившие рассылки, которые удалось захватить
+            while True:
+                broadcast = db.claim_due_broadcast(SCHEDULER_INSTANCE_ID, SCHEDULER_LEASE_SECONDS)
+                if not broadcast:
+                    break
+                await run_claimed_broadcast(broadcast)
             
-            # Проверяем каждую минуту
-            await asyncio.sleep(60)
+            await asyncio.sleep(SCHEDULER_POLL_SECONDS)
             
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Ошибка в планировщике рассылок: {e}")
-            await asyncio.sleep(60)
+            await asyncio.sleep(SCHEDULER_POLL_SECONDS)
 
 
-async def send_scheduled_broadcast(broadcast: dict):
-    """Отправить отложенную рассылку"""
-    if not user_bot:
+async def create_audience_snapshot(broadcast: dict, snapshot_at: Optional[str] = None) -> Tuple[str, str]:
+    """
+    Сохранить снимок аудитории рассылки в файл (чтение БД - в отдельном потоке)
+    
+    Args:
+        snapshot_at: Момент среза (UTC); по умолчанию - текущий
+    
+    Returns:
+        (путь к файлу снимка, момент среза)
+    """
+    snapshot_at = snapshot_at or datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    path = snapshot_path(AUDIENCE_SNAPSHOT_DIR, broadcast['id'], broadcast['next_fire_at'])
+    await asyncio.to_thread(write_snapshot, db, broadcast.get('segment_type') or 'all', path, snapshot_at)
+    return path, snapshot_at
+
+
+async def prepare_audience_snapshot(broadcast: dict):
+    """Подготовить снимок аудитории заранее и освободить аренду рассылки"""
+    try:
+        path, snapshot_at = await create_audience_snapshot(broadcast)
+    except Exception as e:
+        # Аренда истечет сама, а снимок будет создан непосредственно перед отправкой
+        logger.error(f"Не удалось сохранить снимок аудитории рассылки {broadcast['id']}: {e}")
         return
     
-    content = json.loads(broadcast['message_text'])
-    segment_type = broadcast.get('segment_type', 'all')
+    if not db.set_broadcast_snapshot(broadcast['id'], SCHEDULER_INSTANCE_ID, path, snapshot_at):
+        remove_snapshot(path)
+
+
+async def keep_broadcast_lease(broadcast_id: int, lease_lost: asyncio.Event, progress: dict):
+    """
+    Периодически продлевать аренду рассылки, пока она отправляется
     
-    # Получаем пользователей по сегменту
-    user_ids = db.get_active_users_by_segment(segment_type)
+    Вместе с продлением сохраняется и контрольная точка (позиция в снимке
+    аудитории); чаще ее сохраняет сам цикл отправки (send_scheduled_broadcast).
+    """
+    interval = max(SCHEDULER_LEASE_SECONDS / 3, 1)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            renewed = db.renew_broadcast_lease(
+                broadcast_id, SCHEDULER_INSTANCE_ID, SCHEDULER_LEASE_SECONDS, progress
+            )
+        except Exception as e:
+            # Временная ошибка БД: пробуем снова, аренда ещё не истекла
+            logger.warning(f"Не удалось продлить аренду рассылки {broadcast_id}: {e}")
+            continue
+        if not renewed:
+            logger.error(f"Аренда рассылки {broadcast_id} потеряна, отправка будет остановлена")
+            lease_lost.set()
+            return
+
+
+async def fail_claimed_broadcast(broadcast: dict, progress: dict, reason: str):
+    """Снять рассылку с расписания после исчерпания попыток и уведомить автора"""
+    if not db.fail_scheduled_broadcast(broadcast['id'], SCHEDULER_INSTANCE_ID, progress):
+        return
+    if broadcast.get('snapshot_path'):
+        remove_snapshot(broadcast['snapshot_path'])
     
-    # Создаем клавиатуру
-    keyboard = None
-    if content.get('buttons'):
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text=btn['text'], url=btn['url'])]
-            for btn in content['buttons']
-        ])
+    logger.error(f"Рассылка {broadcast['id']} отмечена невыполненной: {reason}")
+    try:
+        await bot.send_message(
+            chat_id=broadcast['admin_id'],
+            text=(
+                f"⚠️ <b>Отложенная рассылка не выполнена</b>\n\n"
+                f"Попыток: {broadcast['attempts']}\n"
+                f"Причина: {html.escape(reason)}\n\n"
+                f"✅ Отправлено до ошибки: {progress['sent']}\n"
+                f"❌ Ошибок: {progress['failed']}\n\n"
+                f"Рассылка снята с расписания."
+            ),
+            parse_mode=ParseMode.HTML
+        )
+    except Exception as e:
+        logger.error(f"Не удалось уведомить о невыполненной рассылке {broadcast['id']}: {e}")
+
+
+async def run_claimed_broadcast(broadcast: dict):
+    """Выполнить захваченную рассылку, удерживая аренду до завершения"""
+    lease_lost = asyncio.Event()
+    # Продолжаем с контрольной точки, если рассылку начал другой экземпляр
+    progress = {
+        'offset': broadcast.get('snapshot_offset') or 0,
+        'last_user_id': broadcast.get('snapshot_last_user_id'),
+        'sent': broadcast.get('sent_count') or 0,
+        'failed': broadcast.get('failed_count') or 0,
+    }
     
-    sent_count = 0
-    failed_count = 0
+    # Предыдущие попытки не дошли до конца, в том числе без обработки ошибки
+    # (экземпляр упал или завис, аренда истекла)
+    if broadcast['attempts'] > SCHEDULER_MAX_ATTEMPTS:
+        await fail_claimed_broadcast(broadcast, progress, "экземпляр бота не завершил отправку")
+        return
     
-    # Отправляем сообщения
-    for user_id in user_ids:
+    heartbeat_task = asyncio.create_task(keep_broadcast_lease(broadcast['id'], lease_lost, progress))
+    
+    try:
+        await send_scheduled_broadcast(broadcast, lease_lost, progress)
+    except asyncio.CancelledError:
+        # Бот останавливается: отдаём рассылку другим экземплярам,
+        # не дожидаясь истечения аренды
         try:
-            if content.get('has_photo') and content.get('photo_file_id'):
-                await user_bot.send_photo(
-                    chat_id=user_id,
-                    photo=content['photo_file_id'],
-                    caption=content.get('text'),
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.HTML if content.get('text') else None
-                )
-            else:
-                await user_bot.send_message(
-                    chat_id=user_id,
-                    text=content.get('text', ''),
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.HTML
-                )
-            sent_count += 1
-            await asyncio.sleep(0.05)
+            db.release_broadcast_lease(broadcast['id'], SCHEDULER_INSTANCE_ID, progress)
         except Exception as e:
-            failed_count += 1
-            logger.error(f"Ошибка при отправке отложенной рассылки пользователю {user_id}: {e}")
-    
-    # Обновляем статистику
-    conn = db.get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        'UPDATE broadcasts SET sent_count = ?, failed_count = ? WHERE id = ?',
-        (sent_count, failed_count, broadcast['id'])
+            logger.error(f"Не удалось освободить аренду рассылки {broadcast['id']}: {e}")
+        raise
+    except Exception as e:
+        heartbeat_task.cancel()
+        if not lease_lost.is_set():
+            # Сохраняем контрольную точку: следующая попытка не повторит уже отправленное
+            try:
+                db.renew_broadcast_lease(
+                    broadcast['id'], SCHEDULER_INSTANCE_ID, SCHEDULER_LEASE_SECONDS, progress
+                )
+            except Exception as save_error:
+                logger.error(f"Не удалось сохранить контрольную точку рассылки {broadcast['id']}: {save_error}")
+        if broadcast['attempts'] >= SCHEDULER_MAX_ATTEMPTS and not lease_lost.is_set():
+            await fail_claimed_broadcast(broadcast, progress, str(e) or type(e).__name__)
+            return
+        # Аренда истечет сама, и рассылка будет продолжена с последней контрольной точки
+        logger.error(
+            f"Ошибка при отправке отложенной рассылки {broadcast['id']} "
+            f"(попытка {broadcast['attempts']} из {SCHEDULER_MAX_ATTEMPTS}): {e}"
+        )
+        return
+    finally:
+        heartbeat_task.cancel()
+    
+    if lease_lost.is_set():
+        return
+    
+    sent_count = progress['sent']
+    failed_count = progress['failed']
+    
+    # Для повторяющейся рассылки сразу вычисляем следующий запуск
+    next_fire_at = None
+    if broadcast.get('recurrence'):
+        try:
+            next_fire_at = next_fire(
+                broadcast['recurrence'],
+                datetime.fromisoformat(broadcast['next_fire_at'])
+            ).isoformat()
+        except ValueError as e:
+            logger.error(f"Неверное расписание рассылки {broadcast['id']}, повтор отключен: {e}")
+    
+    completed = db.complete_scheduled_broadcast(
+        broadcast['id'], SCHEDULER_INSTANCE_ID, sent_count, failed_count,
+        next_fire_at=next_fire_at
     )
-    conn.commit()
-    conn.close()
+    if not completed:
+        logger.error(f"Рассылка {broadcast['id']} отправлена, но аренда уже принадлежит другому экземпляру")
+        return
+    
+    if broadcast.get('snapshot_path'):
+        remove_snapshot(broadcast['snapshot_path'])
+    
+    logger.info(f"Отложенная рассылка {broadcast['id']} отправлена")
+    
+    notify_text = (
+        f"⏰ <b>Отложенная рассылка отправлена!</b>\n\n"
+        f"✅ Отправлено: {sent_count}\n"
+        f"❌ Ошибок: {failed_count}"
+    )
+    if next_fire_at:
+        next_dt = datetime.fromisoformat(next_fire_at)
+        notify_text += f"\n\n🔁 Следующая отправка: {next_dt.strftime('%d.%m.%Y %H:%M')}"
     
     # Уведомляем админа
     try:
         await bot.send_message(
             chat_id=broadcast['admin_id'],
-            text=(
-                f"⏰ <b>Отложенная рассылка отправлена!</b>\n\n"
-                f"✅ Отправлено: {sent_count}\n"
-                f"❌ Ошибок: {failed_count}",
-            ),
+            text=notify_text,
             parse_mode=ParseMode.HTML
         )
     except:
         pass
 
 
-async def main():
-    """Главная функция для запуска бота"""
+async def send_scheduled_broadcast(broadcast: dict, lease_lost: asyncio.Event, progress: dict):
+    """
+    Отправить отложенную рассылку
+    
+    Получатели читаются из снимка аудитории, progress обновляется после
+    каждого получателя и сохраняется в базу каждые SCHEDULER_CHECKPOINT_RECIPIENTS
+    получателей или SCHEDULER_CHECKPOINT_SECONDS секунд. Экземпляр, подхвативший
+    рассылку после падения, повторит не больше отправленного с последнего сохранения.
+    """
+    if not user_bot:
+        return
+    
+    content = json.loads(broadcast['message_text'])
+    
+    # Снимок аудитории обычно готов заранее; если нет - создаем его сейчас
+    path = broadcast.get('snapshot_path')
+    rebuilt = False
+    if not path or not os.path.exists(path):
+        if broadcast.get('snapshot_at'):
+            # Снимок создан другим экземпляром (на его диске): воссоздаем с тем же
+            # моментом среза и продолжаем после последнего обработанного получателя
+            logger.warning(
+                f"Снимок аудитории рассылки {broadcast['id']} не найден, воссоздаем на {broadcast['snapshot_at']}"
+            )
+            path, _ = await create_audience_snapshot(broadcast, broadcast['snapshot_at'])
+            rebuilt = True
+        else:
+            path, snapshot_at = await create_audience_snapshot(broadcast)
+            db.set_broadcast_snapshot(broadcast['id'], SCHEDULER_INSTANCE_ID, path, snapshot_at,
+                                      release_lease=False)
+            broadcast['snapshot_at'] = snapshot_at
+            progress.update(offset=0, last_user_id=None)
+        broadcast['snapshot_path'] = path
+    
+    # Ссылки кнопок для учета переходов: одни и те же при каждой отправке рассылки
+    buttons = content.get('buttons')
+    link_ids = None
+    if buttons and click_tracking_enabled():
+        link_ids = db.create_broadcast_links(buttons, broadcast_id=broadcast['id'])
+    
+    # Отправляем сообщения
+    with AudienceSnapshot(path) as snapshot:
+        user_ids = snapshot.ids
+        if rebuilt:
+            progress['offset'] = snapshot.position_after(progress['last_user_id'])
+        saved_offset = progress['offset']
+        saved_at = time.monotonic()
+        for offset in range(progress['offset'], len(snapshot)):
+            # Рассылку подхватил другой экземпляр - прекращаем отправку
+            if lease_lost.is_set():
+                logger.warning(f"Отправка рассылки {broadcast['id']} прервана: аренда потеряна")
+                break
+            
+            user_id = user_ids[offset]
+            keyboard = broadcast_keyboard(buttons, link_ids, user_id)
+            try:
+                if content.get('has_photo') and content.get('photo_file_id'):
+                    await user_bot.send_photo(
+                        chat_id=user_id,
+                        photo=content['photo_file_id'],
+                        caption=content.get('text'),
+                        reply_markup=keyboard,
+                        parse_mode=ParseMode.HTML if content.get('text') else None
+                    )
+                else:
+                    await user_bot.send_message(
+                        chat_id=user_id,
+                        text=content.get('text', ''),
+                        reply_markup=keyboard,
+                        parse_mode=ParseMode.HTML
+                    )
+                progress['sent'] += 1
+                await asyncio.sleep(0.05)
+            except Exception as e:
+                progress['failed'] += 1
+                logger.error(f"Ошибка при отправке отложенной рассылки пользователю {user_id}: {e}")
+            
+            progress['offset'] = offset + 1
+            progress['last_user_id'] = user_id
+            
+            if (progress['offset'] - saved_offset >= SCHEDULER_CHECKPOINT_RECIPIENTS
+                    or time.monotonic() - saved_at >= SCHEDULER_CHECKPOINT_SECONDS):
+                try:
+                    saved = db.save_broadcast_progress(broadcast['id'], SCHEDULER_INSTANCE_ID, progress)
+                except Exception as e:
+                    # Временная ошибка БД: точку сохранит следующая попытка или heartbeat
+                    logger.warning(f"Не удалось сохранить контрольную точку рассылки {broadcast['id']}: {e}")
+                else:
+                    if not saved:
+                        logger.warning(f"Отправка рассылки {broadcast['id']} прервана: аренда потеряна")
+                        lease_lost.set()
+                        break
+                    saved_offset = progress['offset']
+                saved_at = time.monotonic()
+
+
+async def main(handle_signals: bool = True):
+    """
+    Главная функция для запуска бота
+    
+    Args:
+        handle_signals: Останавливаться по SIGINT/SIGTERM (run_all.py обрабатывает их сам)
+    """
     logger.info("Запуск Admin Bot...")
     
     # Проверяем подключение к базе данных
@@ -1940,15 +2804,31 @@ async def main():
         logger.warning("Список администраторов пуст!")
     
     # Запускаем планировщик отложенных рассылок
+    logger.info(f"Экземпляр планировщика: {SCHEDULER_INSTANCE_ID}")
     scheduler_task = asyncio.create_task(check_scheduled_broadcasts())
+    cleanup_task = asyncio.create_task(cleanup_abandoned_drafts())
+    
+    # Зеркало аналитики: полная синхронизация при запуске, затем инкрементальная
+    mirror_task = None
+    if analytics_mirror is not None:
+        try:
+            await asyncio.to_thread(analytics_mirror.refresh)
+        except Exception as e:
+            logger.error(f"Ошибка при синхронизации зеркала аналитики: {e}")
+        mirror_task = asyncio.create_task(refresh_analytics_mirror())
     
     # Запускаем бота
     try:
-        await dp.start_polling(bot)
+        await dp.start_polling(bot, handle_signals=handle_signals)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
         scheduler_task.cancel()
+        cleanup_task.cancel()
+        if mirror_task:
+            mirror_task.cancel()
+        await report_runner.shutdown()
+        await storage.close()
         await bot.session.close()
         if user_bot:
             await user_bot.session.close()
@@ -0,0 +1,273 @@
+"""
+Зеркало аналитики
+
+Отчеты admin_bot (статистика, аналитика, графики, когорты, выгрузки,
+детальная история рассылок) читают не основную базу, в которую user_bot
+пишет на каждое сообщение, а отдельный файл-зеркало с копиями таблиц
+users, broadcasts, broadcast_links и link_clickers (переходы по кнопкам).
+Тяжелые чтения не конкурируют с записью и не мешают контрольным точкам
+WAL основной базы.
+
+Зеркало обновляется инкрементально: триггеры основной базы записывают
+ID измененных строк в журнал analytics_changes с возрастающим номером seq,
+а AnalyticsMirror.refresh копирует строки, изменившиеся после последнего
+перенесенного номера (и удаляет из зеркала удаленные). При запуске
+и при изменении схемы таблиц зеркало строится заново целиком.
+
+Основная база при копировании только читается: в режиме WAL чтение идет
+из снимка и не мешает user_bot писать, даже если копируется вся таблица
+users. Блокировка записи берется лишь на короткую очистку журнала.
+Журнал общий для всех экземпляров admin_bot: каждое зеркало отмечает
+свой номер в analytics_mirrors, и удаляются только записи, которые
+перенесли все зеркала. Зеркало, не синхронизировавшееся дольше
+retention_seconds, перестает удерживать журнал и при следующей
+синхронизации копируется заново целиком.
+
+Время последней синхронизации хранится в зеркале и показывается
+в отчетах, чтобы было видно, насколько данные отстают.
+"""
+import logging
+import re
+import socket
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Optional
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Начало CREATE TABLE/INDEX из sqlite_master - перед именем ставится схема зеркала
+SCHEMA_NAME_RE = re.compile(r'^(CREATE\s+(?:UNIQUE\s+)?(?:TABLE|INDEX)\s+)', re.IGNORECASE)
+
+# Зеркалируемые таблицы: имя -> первичный ключ
+MIRROR_TABLES = {
+    'users': 'user_id',
+    'broadcasts': 'id',
+    'broadcast_links': 'id',
+    'link_clickers': 'id',
+}
+
+
+class AnalyticsDatabase(Database):
+    """
+    Database только для чтения поверх зеркала аналитики
+    
+    Таблицы зеркала повторяют схему основной базы, поэтому работают
+    все методы чтения users, broadcasts и ссылок рассылок (статистика,
+    сегменты, выгрузки, переходы).
+    Счетчики, кампании и прочие таблицы в зеркале отсутствуют.
+    """
+    
+    def init_database(self):
+        # Схему зеркала создает AnalyticsMirror, здесь только чтение
+        pass
+    
+    def get_connection(self):
+        conn = sqlite3.connect(f"file:{self.db_file}?mode=ro", uri=True, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def get_synced_at(self) -> Optional[float]:
+        """Время последней синхронизации зеркала (Unix-время) или None"""
+        try:
+            conn = self.get_connection()
+        except sqlite3.OperationalError:
+            return None
+        try:
+            row = conn.execute("SELECT value FROM mirror_meta WHERE key = 'synced_at'").fetchone()
+        except sqlite3.OperationalError:
+            return None
+        finally:
+            conn.close()
+        return float(row[0]) if row else None
+
+
+class AnalyticsMirror:
+    """Синхронизация зеркала аналитики с основной базой"""
+    
+    def __init__(self, db: Database, mirror_file: str, retention_seconds: float = 24 * 3600):
+        """
+        Args:
+            db: Основная база данных
+            mirror_file: Файл зеркала
+            retention_seconds: Сколько журнал изменений ждет зеркало, которое не синхронизируется
+        """
+        self.db = db
+        self.mirror_file = mirror_file
+        self.retention_seconds = retention_seconds
+        # Имя зеркала в analytics_mirrors (несколько экземпляров admin_bot - несколько зеркал)
+        self.mirror_id = f"{socket.gethostname()}:{Path(mirror_file).resolve()}"
+        # Первая синхронизация после запуска - полная
+        self._full_sync_needed = True
+    
+    def _connect(self) -> sqlite3.Connection:
+        Path(self.mirror_file).parent.mkdir(parents=True, exist_ok=True)
+        conn = self.db.get_connection()
+        conn.isolation_level = None
+        conn.execute("ATTACH DATABASE ? AS mirror", (self.mirror_file,))
+        # WAL в зеркале: чтение отчетов не блокируется синхронизацией
+        conn.execute("PRAGMA mirror.journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS mirror.mirror_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        return conn
+    
+    @staticmethod
+    def _schema_matches(conn: sqlite3.Connection, table: str) -> bool:
+        main_columns = conn.execute(f"PRAGMA main.table_info({table})").fetchall()
+        mirror_columns = conn.execute(f"PRAGMA mirror.table_info({table})").fetchall()
+        return [tuple(column) for column in main_columns] == [tuple(column) for column in mirror_columns]
+    
+    @staticmethod
+    def _rebuild_table(conn: sqlite3.Connection, table: str) -> int:
+        """Пересоздать таблицу зеркала по схеме основной базы и скопировать все строки"""
+        conn.execute(f"DROP TABLE IF EXISTS mirror.{table}")
+        schema = conn.execute(
+            "SELECT type, name, sql FROM main.sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL",
+            (table,)
+        ).fetchall()
+        
+        # Таблица, затем ее индексы (те же, что в основной базе - их используют запросы сегментов)
+        for object_type, name, sql in sorted(schema, key=lambda item: item[0] != 'table'):
+            if object_type in ('table', 'index'):
+                conn.execute(SCHEMA_NAME_RE.sub(r'\1mirror.', sql, count=1))
+        
+        conn.execute(f"INSERT INTO mirror.{table} SELECT * FROM main.{table}")
+        return conn.execute(f"SELECT COUNT(*) FROM mirror.{table}").fetchone()[0]
+    
+    @staticmethod
+    def _apply_changes(conn: sqlite3.Connection, table: str, key: str, last_seq: int) -> int:
+        """Перенести в зеркало строки таблицы, измененные после last_seq"""
+        changes = "SELECT row_id FROM main.analytics_changes WHERE table_name = ? AND seq > ?"
+        changed = conn.execute(f"SELECT COUNT(*) FROM ({changes})", (table, last_seq)).fetchone()[0]
+        if not changed:
+            return 0
+        
+        conn.execute(f'''
+            INSERT OR REPLACE INTO mirror.{table}
+            SELECT * FROM main.{table} WHERE {key} IN ({changes})
+        ''', (table, last_seq))
+        conn.execute(f'''
+            DELETE FROM mirror.{table}
+            WHERE {key} IN ({changes})
+                AND NOT EXISTS (SELECT 1 FROM main.{table} t WHERE t.{key} = mirror.{table}.{key})
+        ''', (table, last_seq))
+        return changed
+    
+    def _last_seq(self, conn: sqlite3.Connection) -> Optional[int]:
+        """Номер журнала, до которого изменения перенесены в зеркало (None - нужно полное копирование)"""
+        row = conn.execute("SELECT value FROM mirror.mirror_meta WHERE key = 'last_seq'").fetchone()
+        registered = conn.execute(
+            "SELECT 1 FROM main.analytics_mirrors WHERE mirror_id = ?", (self.mirror_id,)
+        ).fetchone()
+        # Без отметки в analytics_mirrors журнал могли очистить без учета этого зеркала
+        if row is None or registered is None:
+            return None
+        return int(row[0])
+    
+    def _register(self, conn: sqlite3.Connection):
+        """Отметить зеркало в журнале до полного копирования"""
+        # Записи после этого номера не удалятся, пока зеркало не перенесет их
+        conn.execute('''
+            INSERT INTO main.analytics_mirrors (mirror_id, last_seq, synced_at)
+            VALUES (?, (SELECT COALESCE(MAX(seq), 0) FROM main.analytics_changes), ?)
+            ON CONFLICT (mirror_id) DO UPDATE SET last_seq = excluded.last_seq, synced_at = excluded.synced_at
+        ''', (self.mirror_id, time.time()))
+    
+    def _prune(self, conn: sqlite3.Connection, last_seq: int):
+        """Отметить перенесенный номер и удалить записи журнала, перенесенные всеми зеркалами"""
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            updated = conn.execute(
+                "UPDATE main.analytics_mirrors SET last_seq = ?, synced_at = ? WHERE mirror_id = ?",
+                (last_seq, now, self.mirror_id)
+            ).rowcount
+            if not updated:
+                # Зеркало долго не синхронизировалось и перестало удерживать журнал
+                self._full_sync_needed = True
+            conn.execute(
+                "DELETE FROM main.analytics_mirrors WHERE synced_at < ?",
+                (now - self.retention_seconds,)
+            )
+            conn.execute('''
+                DELETE FROM main.analytics_changes
+                WHERE seq <= (SELECT MIN(last_seq) FROM main.analytics_mirrors)
+            ''')
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def refresh(self) -> Dict[str, int]:
+        """
+        Синхронизировать зеркало (блокирующий вызов, выполнять вне цикла событий)
+        
+        Returns:
+            Количество перенесенных строк по таблицам
+        """
+        started = time.perf_counter()
+        result = {}
+        conn = self._connect()
+        
+        try:
+            last_seq = None if self._full_sync_needed else self._last_seq(conn)
+            if last_seq is None:
+                self._register(conn)
+            
+            # Обычная (отложенная) транзакция: основная база только читается из одного
+            # снимка WAL, блокировку записи берет только файл зеркала
+            conn.execute("BEGIN")
+            try:
+                head = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM main.analytics_changes").fetchone()[0]
+                for table, key in MIRROR_TABLES.items():
+                    if last_seq is None or not self._schema_matches(conn, table):
+                        result[table] = self._rebuild_table(conn, table)
+                        logger.info(f"Зеркало аналитики: таблица {table} скопирована целиком ({result[table]} строк)")
+                    else:
+                        result[table] = self._apply_changes(conn, table, key, last_seq)
+                conn.executemany(
+                    "INSERT OR REPLACE INTO mirror.mirror_meta (key, value) VALUES (?, ?)",
+                    (('synced_at', str(time.time())), ('last_seq', str(head)))
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            self._full_sync_needed = False
+            
+            try:
+                self._prune(conn, head)
+            except sqlite3.OperationalError as e:
+                # Не страшно: журнал очистится при следующей синхронизации
+                logger.warning(f"Не удалось очистить журнал изменений зеркала: {e}")
+        finally:
+            conn.close()
+        
+        if any(result.values()):
+            logger.info(
+                f"Зеркало аналитики обновлено за {time.perf_counter() - started:.2f} сек.: {result}"
+            )
+        return result
+
+
+def describe_staleness(synced_at: Optional[float]) -> str:
+    """Подпись о свежести данных для отчетов (parse_mode=HTML)"""
+    if synced_at is None:
+        return "🕐 <i>Зеркало аналитики еще не синхронизировано</i>"
+    
+    lag = max(0, int(time.time() - synced_at))
+    moment = datetime.fromtimestamp(synced_at).strftime("%H:%M:%S")
+    if lag < 60:
+        ago = f"{lag} сек. назад"
+    elif lag < 3600:
+        ago = f"{lag // 60} мин. назад"
+    else:
+        ago = f"{lag // 3600} ч. {lag % 3600 // 60} мин. назад"
+    return f"🕐 <i>Данные на {moment} (обновлены {ago})</i>"
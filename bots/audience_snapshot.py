@@ -0,0 +1,127 @@
+"""
+Снимки аудитории отложенных рассылок
+
+Снимок - это бинарный файл с упакованными ID получателей (int64 в порядке
+байт хоста, по возрастанию). Планировщик создает его заранее, до времени
+отправки, чтобы в момент запуска рассылки не нагружать таблицу users.
+При отправке файл отображается в память (mmap), а позиция в нем служит
+контрольной точкой для продолжения рассылки после перезапуска.
+
+Файл лежит на диске экземпляра, который его создал. Экземпляр, перехвативший
+рассылку на другом сервере, воссоздает снимок с тем же моментом среза
+(в снимок попадают только пользователи, зарегистрированные до него) и
+продолжает после последнего обработанного получателя: ID упорядочены,
+поэтому уже получившие рассылку пользователи пропускаются.
+"""
+import logging
+from bisect import bisect_right
+import mmap
+import os
+from array import array
+from pathlib import Path
+from typing import Optional
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Размер одного ID в файле снимка
+ITEM_SIZE = array('q').itemsize
+
+
+def snapshot_path(snapshot_dir: str, broadcast_id: int, fire_at: str) -> str:
+    """Путь к файлу снимка для конкретного запуска рассылки"""
+    fire_tag = fire_at.replace(':', '').replace('-', '')
+    return str(Path(snapshot_dir) / f"broadcast_{broadcast_id}_{fire_tag}.bin")
+
+
+def write_snapshot(db: Database, segment_type: str, path: str, snapshot_at: str) -> int:
+    """
+    Записать ID пользователей сегмента в файл снимка
+    
+    В снимок попадают пользователи, зарегистрированные не позже snapshot_at
+    (UTC), по возрастанию ID - повторный вызов с тем же snapshot_at дает
+    тот же порядок. Пользователи читаются из базы пачками и сразу пишутся в файл,
+    поэтому память не зависит от размера сегмента. Файл сначала
+    пишется во временный, а затем атомарно переименовывается.
+    
+    Returns:
+        Количество пользователей в снимке
+    """
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    count = 0
+    
+    with open(tmp_path, 'wb') as f:
+        for batch in db.iter_user_id_batches(segment_type, registered_before=snapshot_at):
+            array('q', batch).tofile(f)
+            count += len(batch)
+        f.flush()
+        os.fsync(f.fileno())
+    
+    os.replace(tmp_path, path)
+    logger.info(f"Снимок аудитории сохранен: {path} ({count} пользователей)")
+    return count
+
+
+def remove_snapshot(path: str):
+    """Удалить файл снимка"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.warning(f"Не удалось удалить снимок {path}: {e}")
+
+
+class AudienceSnapshot:
+    """
+    Снимок аудитории, отображенный в память
+    
+    ``ids`` - memoryview над mmap: индексация читает int64 прямо из
+    страниц файла, без списков и промежуточных объектов на каждого получателя.
+    
+    Использование:
+        with AudienceSnapshot(path) as snapshot:
+            for offset in range(start, len(snapshot)):
+                user_id = snapshot.ids[offset]
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        
+        if size % ITEM_SIZE:
+            self._file.close()
+            raise ValueError(f"Поврежденный снимок аудитории: {path}")
+        
+        if size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.ids = memoryview(self._mmap).cast('q')
+        else:
+            # Пустой файл нельзя отобразить в память
+            self._mmap = None
+            self.ids = memoryview(b'').cast('q')
+    
+    def __len__(self) -> int:
+        return len(self.ids)
+    
+    def position_after(self, user_id: Optional[int]) -> int:
+        """Позиция первого получателя с ID больше user_id (None - начало снимка)"""
+        if user_id is None:
+            return 0
+        return bisect_right(self.ids, user_id)
+    
+    def close(self):
+        """Освободить отображение и закрыть файл"""
+        self.ids.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,172 @@
+"""
+PNG графики аналитики для admin_bot
+
+Графики строятся matplotlib (бэкенд Agg, без pyplot и глобального
+состояния) вне цикла событий: в пуле процессов отчетов (reports.py) или,
+если он не передан, в отдельном потоке.
+
+ChartCache кеширует график по версии данных: пока данные не изменились,
+повторное открытие не перестраивает картинку, а после первой отправки
+вместо файла передается file_id, который вернул Telegram, - фото
+не загружается заново.
+"""
+import asyncio
+import io
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+from aiogram import types
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile
+
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+except ImportError:  # matplotlib нужен только для графиков
+    Figure = None
+
+from reports import run_in_thread
+
+logger = logging.getLogger(__name__)
+
+# Размер графика в дюймах и разрешение (1200x675 пикселей)
+FIGURE_SIZE = (8, 4.5)
+FIGURE_DPI = 150
+
+SENT_COLOR = '#4caf50'
+FAILED_COLOR = '#f44336'
+GROWTH_COLOR = '#2196f3'
+
+
+def is_available() -> bool:
+    """Установлен ли matplotlib"""
+    return Figure is not None
+
+
+def _to_png(figure) -> bytes:
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', dpi=FIGURE_DPI, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def render_growth(date_stats: List[Dict]) -> bytes:
+    """Регистрации по дням (date_stats из Database.get_user_stats_by_date)"""
+    rows = sorted(date_stats, key=lambda row: row['date'])
+    labels = [f"{row['date'][8:10]}.{row['date'][5:7]}" for row in rows]
+    counts = [row['count'] for row in rows]
+    
+    figure = Figure(figsize=FIGURE_SIZE)
+    axes = figure.subplots()
+    axes.bar(range(len(counts)), counts, color=GROWTH_COLOR)
+    axes.set_xticks(range(len(labels)), labels, rotation=60, fontsize=7)
+    axes.set_title(f"Регистрации по дням (всего за период: {sum(counts)})")
+    axes.set_ylabel("Новых пользователей")
+    axes.grid(axis='y', alpha=0.3)
+    return _to_png(figure)
+
+
+def render_broadcasts(broadcasts: List[Dict]) -> bytes:
+    """Отправлено и ошибки по последним рассылкам (от старых к новым)"""
+    rows = sorted(broadcasts, key=lambda row: row['id'])
+    labels = [row['created_at'][8:10] + '.' + row['created_at'][5:7] for row in rows]
+    sent = [row['sent_count'] for row in rows]
+    failed = [row['failed_count'] for row in rows]
+    positions = range(len(rows))
+    
+    figure = Figure(figsize=FIGURE_SIZE)
+    axes = figure.subplots()
+    axes.bar(positions, sent, color=SENT_COLOR, label="Отправлено")
+    axes.bar(positions, failed, bottom=sent, color=FAILED_COLOR, label="Ошибки")
+    axes.set_xticks(positions, labels, rotation=60, fontsize=7)
+    axes.set_title("Последние рассылки")
+    axes.set_ylabel("Сообщений")
+    axes.legend()
+    axes.grid(axis='y', alpha=0.3)
+    return _to_png(figure)
+
+
+def render_cohorts(report) -> bytes:
+    """Тепловая карта удержания (report - cohorts.CohortReport)"""
+    weeks = len(report.cohort_starts)
+    values = [[float('nan') if value is None else value * 100 for value in row] for row in report.retention]
+    labels = [
+        datetime.fromtimestamp(start, tz=timezone.utc).strftime("%d.%m") + f" ({size})"
+        for start, size in zip(report.cohort_starts, report.cohort_sizes)
+    ]
+    
+    figure = Figure(figsize=FIGURE_SIZE)
+    axes = figure.subplots()
+    image = axes.imshow(values, cmap='YlGn', vmin=0, vmax=100, aspect='auto')
+    for row, row_values in enumerate(report.retention):
+        for column, value in enumerate(row_values):
+            if value is not None:
+                axes.text(column, row, f"{value * 100:.0f}", ha='center', va='center', fontsize=7)
+    axes.set_xticks(range(weeks), [f"N{k}" for k in range(weeks)])
+    axes.set_yticks(range(weeks), labels, fontsize=7)
+    axes.set_title("Удержание по неделям регистрации, %")
+    figure.colorbar(image, ax=axes)
+    return _to_png(figure)
+
+
+class ChartCache:
+    """Кеш графиков: PNG и file_id по имени графика и версии данных"""
+    
+    def __init__(self, runner: Optional[Callable[..., Awaitable[bytes]]] = None):
+        """
+        Args:
+            runner: Выполнение построения: runner(ключ, функция, *аргументы),
+                например ReportRunner.run; по умолчанию - в отдельном потоке
+        """
+        self.runner = runner or run_in_thread
+        # имя -> [версия данных, PNG или None, file_id или None]
+        self._entries: Dict[str, list] = {}
+        self._lock = asyncio.Lock()
+    
+    async def _photo(self, name: str, version: Hashable, render: Callable[..., bytes], *args):
+        """file_id неизменившегося графика или файл (при необходимости перестраивается)"""
+        async with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[0] != version:
+                png = await self.runner(('chart', name, version), render, *args)
+                entry = [version, png, None]
+                self._entries[name] = entry
+            elif entry[2]:
+                return entry[2]
+            return BufferedInputFile(entry[1], filename=f"{name}.png")
+    
+    def _remember(self, name: str, version: Hashable, sent: types.Message):
+        """Запомнить file_id отправленного графика; PNG больше не нужен"""
+        entry = self._entries.get(name)
+        if entry is not None and entry[0] == version and sent.photo:
+            entry[2] = sent.photo[-1].file_id
+            entry[1] = None
+    
+    async def send(self, message: types.Message, name: str, version: Hashable,
+                   render: Callable[..., bytes], *args, caption: Optional[str] = None) -> types.Message:
+        """
+        Отправить график в чат сообщения
+        
+        Args:
+            name: Имя графика (ключ кеша)
+            version: Версия данных - при изменении график перестраивается
+            render: Функция построения PNG уровня модуля (выполняется вне цикла событий)
+            *args: Аргументы render
+            caption: Подпись (parse_mode=HTML)
+        """
+        photo = await self._photo(name, version, render, *args)
+        try:
+            sent = await message.answer_photo(photo=photo, caption=caption, parse_mode=ParseMode.HTML)
+        except TelegramBadRequest:
+            if not isinstance(photo, str):
+                raise
+            # file_id недействителен (например, сменился токен бота) - строим заново
+            logger.warning(f"file_id графика {name} отклонен, график будет отправлен заново")
+            self._entries.pop(name, None)
+            photo = await self._photo(name, version, render, *args)
+            sent = await message.answer_photo(photo=photo, caption=caption, parse_mode=ParseMode.HTML)
+        
+        self._remember(name, version, sent)
+        return sent
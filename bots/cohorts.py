@@ -0,0 +1,222 @@
+"""
+Когортная аналитика пользователей (команда /cohorts в admin_bot)
+
+Время регистрации и последней активности всех пользователей загружается
+колоночным снимком (Database.get_user_timestamp_columns) в массивы NumPy,
+и все показатели считаются векторными операциями, без цикла по пользователям:
+
+- удержание по недельным когортам: доля пользователей когорты, которые были
+  активны не раньше чем через k недель после регистрации;
+- кривая оттока: доля пользователей, переставших появляться к k-й неделе
+  после регистрации (по всем пользователям, прожившим не меньше k недель);
+- распределение давности последней активности.
+
+База хранит только последнюю активность пользователя, поэтому удержание
+"неограниченное" (активен на неделе k или позже), а не по каждой неделе.
+
+Отчет пересчитывается не чаще одного раза за период обновления
+(COHORT_REFRESH_MINUTES) в пуле процессов отчетов (reports.py), между
+пересчетами берется из кеша.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # numpy нужен только для /cohorts
+    np = None
+
+from database import Database
+from reports import run_in_thread
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 60 * 60
+WEEK = 7 * DAY
+# 1970-01-01 - четверг: сдвиг, чтобы недели начинались с понедельника
+WEEK_OFFSET = 4 * DAY
+
+# Границы корзин давности последней активности (дни) и их подписи
+ACTIVITY_BINS = [0, 1, 7, 30, 90]
+ACTIVITY_LABELS = ['< 1 дня', '1-7 дней', '7-30 дней', '30-90 дней', '90+ дней']
+
+
+class CohortReport(NamedTuple):
+    """Результат когортного анализа"""
+    generated_at: float
+    total_users: int
+    cohort_starts: List[int]      # Начало недели каждой когорты (Unix-время)
+    cohort_sizes: List[int]
+    retention: List[List[Optional[float]]]  # [когорта][неделя], None - неделя еще не наступила
+    churn: List[Optional[float]]  # Доля ушедших к неделе k
+    activity: List[Tuple[str, int]]  # (давность последней активности, пользователей)
+    median_lifetime_days: float
+
+
+def is_available() -> bool:
+    """Установлен ли numpy"""
+    return np is not None
+
+
+def week_start(timestamp):
+    """Начало недели (понедельник 00:00 UTC) для Unix-времени или массива"""
+    return (timestamp - WEEK_OFFSET) // WEEK * WEEK + WEEK_OFFSET
+
+
+def compute_cohorts(registered, last_activity, now: float, weeks: int) -> CohortReport:
+    """
+    Посчитать когортный отчет по колонкам времени
+    
+    Args:
+        registered: Время регистрации (Unix-время, массив int64)
+        last_activity: Время последней активности (Unix-время, массив int64)
+        now: Текущее время
+        weeks: Количество недельных когорт
+    
+    Пользователи с регистрацией позже now (например, из импорта с неверным
+    часовым поясом) не учитываются, активность позже now считается равной now.
+    """
+    now = int(now)
+    registered = np.asarray(registered, dtype=np.int64)
+    last_activity = np.asarray(last_activity, dtype=np.int64)
+    valid = registered <= now
+    registered = registered[valid]
+    last_activity = np.clip(last_activity[valid], registered, now)
+    
+    age_weeks = (now - registered) // WEEK
+    lifetime_weeks = (last_activity - registered) // WEEK
+    
+    # Удержание по когортам: считаем пользователей по (когорта, прожитые недели),
+    # затем обратная кумулятивная сумма дает "активен на неделе k или позже"
+    first_week = week_start(now) - (weeks - 1) * WEEK
+    in_range = registered >= first_week
+    cohort = (registered[in_range] - first_week) // WEEK
+    lived = np.minimum(lifetime_weeks[in_range], weeks - 1)
+    
+    counts = np.zeros((weeks, weeks), dtype=np.int64)
+    np.add.at(counts, (cohort, lived), 1)
+    survived = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1]
+    sizes = survived[:, 0]
+    
+    cohort_starts = first_week + np.arange(weeks) * WEEK
+    # Неделя k показывается, когда ее достигли все пользователи когорты
+    # (с конца недели регистрации прошло k недель), иначе доля занижена
+    reached = np.arange(weeks)[None, :] <= ((now - cohort_starts - WEEK) // WEEK)[:, None]
+    reached[:, 0] = True
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retention = np.where(reached & (sizes[:, None] > 0), survived / sizes[:, None], np.nan)
+    
+    # Кривая оттока: пользователь с возрастом a недель и сроком жизни l недель
+    # считается ушедшим для всех k из (l, a]; разностный массив + cumsum
+    horizon = weeks
+    eligible = np.bincount(np.minimum(age_weeks, horizon), minlength=horizon + 1)
+    eligible = np.cumsum(eligible[::-1])[::-1]
+    churn_delta = (
+        np.bincount(np.minimum(lifetime_weeks + 1, horizon + 1), minlength=horizon + 2)
+        - np.bincount(np.minimum(age_weeks + 1, horizon + 1), minlength=horizon + 2)
+    )
+    churned = np.cumsum(churn_delta)[:horizon + 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        churn = np.where(eligible > 0, churned / eligible, np.nan)
+    
+    # Давность последней активности
+    idle_days = (now - last_activity) / DAY
+    histogram, _ = np.histogram(idle_days, bins=ACTIVITY_BINS + [np.inf])
+    
+    lifetime_days = (last_activity - registered) / DAY
+    
+    return CohortReport(
+        generated_at=now,
+        total_users=int(registered.size),
+        cohort_starts=cohort_starts.tolist(),
+        cohort_sizes=sizes.tolist(),
+        retention=[[None if np.isnan(value) else float(value) for value in row] for row in retention],
+        churn=[None if np.isnan(value) else float(value) for value in churn],
+        activity=list(zip(ACTIVITY_LABELS, histogram.tolist())),
+        median_lifetime_days=float(np.median(lifetime_days)) if lifetime_days.size else 0.0,
+    )
+
+
+def build_report(db: Database, weeks: int) -> CohortReport:
+    """Загрузить колоночный снимок пользователей и посчитать отчет"""
+    started = time.perf_counter()
+    registered, last_activity, _ = db.get_user_timestamp_columns()
+    report = compute_cohorts(
+        np.frombuffer(registered, dtype=np.int64) if registered else np.zeros(0, dtype=np.int64),
+        np.frombuffer(last_activity, dtype=np.int64) if last_activity else np.zeros(0, dtype=np.int64),
+        time.time(),
+        weeks
+    )
+    logger.info(
+        f"Когортный отчет пересчитан: {report.total_users} пользователей "
+        f"за {time.perf_counter() - started:.2f} сек."
+    )
+    return report
+
+
+class CohortEngine:
+    """Когортный отчет с кешированием до следующего периода обновления"""
+    
+    def __init__(self, db: Database, weeks: int = 8, refresh_minutes: int = 60,
+                 runner: Optional[Callable[..., Awaitable[CohortReport]]] = None):
+        """
+        Args:
+            runner: Выполнение расчета: runner(ключ, функция, *аргументы),
+                например ReportRunner.run; по умолчанию - в отдельном потоке
+        """
+        self.db = db
+        self.runner = runner or run_in_thread
+        self.weeks = weeks
+        self.refresh_seconds = refresh_minutes * 60
+        self._report: Optional[CohortReport] = None
+        self._period: Optional[int] = None
+        self._lock = asyncio.Lock()
+    
+    async def get_report(self) -> CohortReport:
+        """Отчет из кеша или пересчитанный"""
+        period = int(time.time() // self.refresh_seconds)
+        # Блокировка: одновременные /cohorts не запускают несколько пересчетов
+        async with self._lock:
+            if self._report is None or self._period != period:
+                self._report = await self.runner(('cohorts', period), build_report, self.db, self.weeks)
+                self._period = period
+            return self._report
+
+
+def _percent(value: Optional[float]) -> str:
+    return "  · " if value is None else f"{value * 100:3.0f}%"
+
+
+def render_report(report: CohortReport) -> str:
+    """Отчет в виде сообщения (parse_mode=HTML)"""
+    generated = datetime.fromtimestamp(report.generated_at, tz=timezone.utc).strftime("%d.%m.%Y %H:%M")
+    text = (
+        "📊 <b>Когортный анализ</b>\n\n"
+        f"👥 Пользователей: <b>{report.total_users}</b>\n"
+        f"⏳ Медианное время жизни: <b>{report.median_lifetime_days:.1f} дн.</b>\n\n"
+        "📅 <b>Удержание по неделям регистрации</b>\n"
+        "(доля активных на неделе N или позже)\n"
+    )
+    
+    header = "Неделя  Польз. " + " ".join(f"{f'N{k}':>4}" for k in range(len(report.cohort_starts)))
+    lines = [header]
+    for start, size, row in zip(report.cohort_starts, report.cohort_sizes, report.retention):
+        label = datetime.fromtimestamp(start, tz=timezone.utc).strftime("%d.%m")
+        lines.append(f"{label:<7} {size:>6} " + " ".join(_percent(value) for value in row))
+    text += "<pre>" + "\n".join(lines) + "</pre>\n\n"
+    
+    text += "📉 <b>Отток (ушли к неделе N)</b>\n"
+    churn = [f"N{k}: {_percent(value).strip()}" for k, value in enumerate(report.churn) if k > 0]
+    text += "<pre>" + "\n".join(" | ".join(churn[i:i + 4]) for i in range(0, len(churn), 4)) + "</pre>\n\n"
+    
+    text += "🕐 <b>Последняя активность</b>\n"
+    total = report.total_users or 1
+    for label, count in report.activity:
+        bar = "█" * int(count / total * 20)
+        text += f"{label}: {bar} {count} ({count / total * 100:.0f}%)\n"
+    
+    text += f"\n<i>Обновлено {generated} UTC</i>"
+    return text
@@ -2,6 +2,7 @@
 Конфигурационный файл для Telegram ботов
 """
 import os
+import socket
 from pathlib import Path
 
 # Путь к файлу .env (в папке bots)
@@ -33,6 +34,131 @@ WEB_APP_URL = os.getenv('WEB_APP_URL', 'https://annaivaschenko.ru')
 # База данных
 DATABASE_FILE = os.getenv('DATABASE_FILE', 'bots/database.db')
 
+# Режим получения обновлений User Bot: 'polling' (по умолчанию) или 'webhook'
+USER_BOT_MODE = os.getenv('USER_BOT_MODE', 'polling')
+
+# Webhook (используется при USER_BOT_MODE=webhook)
+# Публичный адрес сайта, на который Telegram будет присылать обновления
+WEBHOOK_BASE_URL = os.getenv('WEBHOOK_BASE_URL', WEB_APP_URL)
+# Путь webhook User Bot (должен совпадать с location в deploy/nginx.conf)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/tg/user-bot')
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+# Локальный адрес aiohttp сервера (за nginx)
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8081'))
+# Количество процессов-воркеров
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '1'))
+# Максимум одновременно обрабатываемых обновлений в одном воркере
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', '100'))
+
+# Уведомления о новых пользователях: окно накопления сводки (секунды).
+# При наплыве пользователей окно растет до максимума, в тишине - сокращается.
+NOTIFY_MIN_WINDOW_SECONDS = float(os.getenv('NOTIFY_MIN_WINDOW_SECONDS', '2'))
+NOTIFY_MAX_WINDOW_SECONDS = float(os.getenv('NOTIFY_MAX_WINDOW_SECONDS', '60'))
+
+# Планировщик отложенных рассылок
+# Идентификатор экземпляра admin_bot (по умолчанию hostname:pid)
+SCHEDULER_INSTANCE_ID = os.getenv('SCHEDULER_INSTANCE_ID', f'{socket.gethostname()}:{os.getpid()}')
+# Длительность аренды рассылки: если экземпляр не продлил аренду за это время,
+# рассылку подхватывает другой экземпляр
+SCHEDULER_LEASE_SECONDS = int(os.getenv('SCHEDULER_LEASE_SECONDS', '60'))
+# Как часто проверять наступившие рассылки
+SCHEDULER_POLL_SECONDS = int(os.getenv('SCHEDULER_POLL_SECONDS', '15'))
+# После скольких неудачных попыток отправки рассылка отмечается невыполненной
+SCHEDULER_MAX_ATTEMPTS = int(os.getenv('SCHEDULER_MAX_ATTEMPTS', '3'))
+# Контрольная точка отправки сохраняется каждые N получателей или каждые
+# столько секунд: после падения экземпляра повторно отправится не больше этого
+SCHEDULER_CHECKPOINT_RECIPIENTS = int(os.getenv('SCHEDULER_CHECKPOINT_RECIPIENTS', '20'))
+SCHEDULER_CHECKPOINT_SECONDS = float(os.getenv('SCHEDULER_CHECKPOINT_SECONDS', '2'))
+# За сколько минут до отправки сохранять снимок аудитории рассылки
+AUDIENCE_SNAPSHOT_LEAD_MINUTES = int(os.getenv('AUDIENCE_SNAPSHOT_LEAD_MINUTES', '10'))
+# Папка для файлов снимков аудитории
+AUDIENCE_SNAPSHOT_DIR = os.getenv('AUDIENCE_SNAPSHOT_DIR', str(Path(__file__).parent / 'data' / 'snapshots'))
+
+# Антифлуд User Bot: сколько сообщений подряд можно отправить (THROTTLE_BURST)
+# и с какой скоростью восстанавливается лимит (сообщений в секунду).
+# В режиме webhook лимит делится между WEBHOOK_WORKERS воркерами (middlewares.py)
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', '1'))
+THROTTLE_BURST = int(os.getenv('THROTTLE_BURST', '5'))
+# Максимум одновременно отслеживаемых пользователей (ограничивает память)
+THROTTLE_MAX_USERS = int(os.getenv('THROTTLE_MAX_USERS', '100000'))
+
+# Хранилище FSM admin_bot (черновики рассылок в базе данных)
+# Через сколько часов неактивности черновик считается брошенным и удаляется
+FSM_STORAGE_TTL_HOURS = int(os.getenv('FSM_STORAGE_TTL_HOURS', '24'))
+# Интервал пакетной записи изменений состояний в базу (секунды)
+FSM_FLUSH_INTERVAL_SECONDS = float(os.getenv('FSM_FLUSH_INTERVAL_SECONDS', '1'))
+# Папка для фото черновиков рассылок
+BROADCAST_PHOTOS_DIR = os.getenv('BROADCAST_PHOTOS_DIR', str(Path(__file__).parent / 'data' / 'broadcast_photos'))
+
+# Когортная аналитика (/cohorts в admin_bot)
+# Сколько недельных когорт показывать
+COHORT_WEEKS = int(os.getenv('COHORT_WEEKS', '8'))
+# Как часто пересчитывать когорты (минуты); между пересчетами отчет берется из кеша
+COHORT_REFRESH_MINUTES = int(os.getenv('COHORT_REFRESH_MINUTES', '60'))
+
+# Пул процессов для тяжелых отчетов admin_bot (выгрузки, графики, когорты)
+REPORT_WORKERS = int(os.getenv('REPORT_WORKERS', '2'))
+# Максимальное время расчета одного отчета (секунды)
+REPORT_TIMEOUT_SECONDS = int(os.getenv('REPORT_TIMEOUT_SECONDS', '300'))
+
+# Зеркало аналитики: отчеты admin_bot читают отдельный файл, а не основную базу
+# (пустое значение - читать основную базу)
+ANALYTICS_MIRROR_FILE = os.getenv('ANALYTICS_MIRROR_FILE', str(Path(__file__).parent / 'data' / 'analytics.db'))
+# Интервал синхронизации зеркала с основной базой (секунды)
+ANALYTICS_REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', '60'))
+# Сколько часов журнал изменений ждет зеркало, которое не синхронизируется
+# (остановленный экземпляр admin_bot); после этого оно копируется заново целиком
+ANALYTICS_CHANGES_RETENTION_HOURS = float(os.getenv('ANALYTICS_CHANGES_RETENTION_HOURS', '24'))
+
+# Учет DAU/WAU/MAU (HyperLogLog скетчи, /activity в admin_bot)
+# Как часто user_bot сохраняет накопленные скетчи в базу (секунды)
+ACTIVITY_FLUSH_SECONDS = float(os.getenv('ACTIVITY_FLUSH_SECONDS', '60'))
+
+# События воронки (/funnel в admin_bot)
+# Максимум несохраненных событий в памяти процесса (старые вытесняются)
+EVENTS_BUFFER_SIZE = int(os.getenv('EVENTS_BUFFER_SIZE', '10000'))
+# Как часто сохранять события в базу (секунды)
+EVENTS_FLUSH_SECONDS = float(os.getenv('EVENTS_FLUSH_SECONDS', '5'))
+
+# Учет переходов по кнопкам рассылок (redirect_server.py)
+# Публичный адрес сервиса переходов, например https://annaivaschenko.ru/c
+# (пустое значение - кнопки ведут прямо на ссылки, переходы не учитываются)
+CLICK_BASE_URL = os.getenv('CLICK_BASE_URL', '')
+# Ключ подписи токенов переходов
+CLICK_SECRET = os.getenv('CLICK_SECRET', '')
+# Локальный адрес сервиса (за nginx)
+CLICK_HOST = os.getenv('CLICK_HOST', '127.0.0.1')
+CLICK_PORT = int(os.getenv('CLICK_PORT', '8082'))
+# Как часто сохранять счетчики переходов в базу (секунды)
+CLICK_FLUSH_SECONDS = float(os.getenv('CLICK_FLUSH_SECONDS', '5'))
+
+# API мини-приложения (webapp_server.py): учет открытий
+# Локальный адрес сервиса (за nginx, location /api/webapp/)
+WEBAPP_API_HOST = os.getenv('WEBAPP_API_HOST', '127.0.0.1')
+WEBAPP_API_PORT = int(os.getenv('WEBAPP_API_PORT', '8083'))
+# Максимальный возраст initData (секунды): более старые данные отклоняются
+WEBAPP_AUTH_MAX_AGE = int(os.getenv('WEBAPP_AUTH_MAX_AGE', '86400'))
+# Сколько помнить уже проверенные initData (секунды)
+WEBAPP_VERIFY_CACHE_SECONDS = int(os.getenv('WEBAPP_VERIFY_CACHE_SECONDS', '300'))
+
+# Свой сервер Bot API (telegram-bot-api) вместо api.telegram.org,
+# например http://127.0.0.1:8090 (пустое значение - api.telegram.org)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', '')
+# Сервер запущен с --local: файлы скачиваются и отправляются по путям на диске
+TELEGRAM_API_LOCAL = os.getenv('TELEGRAM_API_LOCAL', 'false').lower() in ('1', 'true', 'yes')
+
+# Пул HTTP соединений с Bot API, общий для ботов процесса (sessions.py)
+# Максимум соединений (0 - WEBHOOK_MAX_CONCURRENCY + запас на рассылки)
+BOT_HTTP_POOL_SIZE = int(os.getenv('BOT_HTTP_POOL_SIZE', '0'))
+# Сколько держать простаивающее соединение открытым (секунды)
+BOT_HTTP_KEEPALIVE_SECONDS = float(os.getenv('BOT_HTTP_KEEPALIVE_SECONDS', '30'))
+# Время жизни кеша DNS (секунды)
+BOT_HTTP_DNS_CACHE_SECONDS = int(os.getenv('BOT_HTTP_DNS_CACHE_SECONDS', '3600'))
+# Таймаут запроса к Bot API (секунды)
+BOT_HTTP_TIMEOUT_SECONDS = float(os.getenv('BOT_HTTP_TIMEOUT_SECONDS', '60'))
+
 # Проверка обязательных параметров (только при импорте модулей ботов)
 # Раскомментируйте эти проверки после настройки .env файла
 # if not USER_BOT_TOKEN:
@@ -3,13 +3,92 @@
 """
 import sqlite3
 import json
+from array import array
+import re
 import logging
-from datetime import datetime
-from typing import Optional, List, Dict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Iterable, Iterator, Tuple, Callable
 from pathlib import Path
 
+from segments import compile_segment, is_expression, plan_uses_index, EXPR_PREFIX
+from hll import HyperLogLog
+
 logger = logging.getLogger(__name__)
 
+# Допустимый start параметр кампании (ограничения Telegram для deep link)
+CAMPAIGN_PARAM_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+# Наборы данных для выгрузки (exporter.py): имя -> запрос
+EXPORT_QUERIES = {
+    'users': '''
+        SELECT user_id, username, first_name, last_name, start_param, first_start_param,
+               registered_at, last_activity, is_active
+        FROM users ORDER BY user_id
+    ''',
+    'broadcasts': 'SELECT * FROM broadcasts ORDER BY id',
+    'registrations': '''
+        SELECT DATE(registered_at) AS date, COUNT(*) AS users
+        FROM users GROUP BY DATE(registered_at) ORDER BY date
+    ''',
+    'campaigns': 'SELECT * FROM campaigns ORDER BY start_param',
+    'campaign_days': 'SELECT * FROM campaign_activity_days ORDER BY start_param, day',
+}
+
+
+def _split_page(rows: List[Dict], limit: int, key: str) -> Tuple[List[Dict], Optional[int]]:
+    """
+    Разделить результат запроса с LIMIT limit + 1 на страницу и курсор
+    
+    Лишняя строка означает, что есть следующая страница; курсор - ключ
+    последней строки текущей страницы.
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, rows[-1][key]
+    return rows, None
+
+
+def normalize_timestamp(value) -> Optional[str]:
+    """
+    Привести время из импорта к формату базы ('YYYY-MM-DD HH:MM:SS', UTC)
+    
+    Принимаются ISO 8601 (с T, Z, смещением, долями секунды), дата без времени,
+    ДД.ММ.ГГГГ [ЧЧ:ММ[:СС]] и Unix-время в секундах или миллисекундах.
+    Время без часового пояса считается UTC, как CURRENT_TIMESTAMP.
+    
+    Raises:
+        ValueError: если значение не распознано
+    """
+    if value is None or value == '':
+        return None
+    
+    text = str(value).strip()
+    if re.fullmatch(r'\d+(\.\d+)?', text):
+        seconds = float(text)
+        # 13 цифр - миллисекунды (JavaScript Date.now())
+        if seconds >= 1e11:
+            seconds /= 1000
+        moment = datetime.fromtimestamp(seconds, tz=timezone.utc)
+    else:
+        if text.endswith(('Z', 'z')):
+            text = text[:-1] + '+00:00'
+        try:
+            moment = datetime.fromisoformat(text)
+        except ValueError:
+            for pattern in ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y'):
+                try:
+                    moment = datetime.strptime(text, pattern)
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(f"Неизвестный формат времени: {value}")
+    
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
 class Database:
     def __init__(self, db_file: str = 'bots/database.db'):
         """
@@ -22,11 +101,13 @@ class Database:
         Path(db_file).parent.mkdir(parents=True, exist_ok=True)
         
         self.db_file = db_file
+        # Кеш планов запросов сегментов: SQL -> результат explain_segment
+        self._segment_plans: Dict[str, Dict] = {}
         self.init_database()
     
     def get_connection(self):
         """Получить соединение с базой данных"""
-        conn = sqlite3.connect(self.db_file)
+        conn = sqlite3.connect(self.db_file, timeout=30)
         conn.row_factory = sqlite3.Row
         return conn
     
@@ -35,6 +116,10 @@ class Database:
         conn = self.get_connection()
         cursor = conn.cursor()
         
+        # WAL позволяет читать базу во время записи и снижает конфликты блокировок,
+        # когда в базу пишут несколько процессов (воркеры webhook, экземпляры admin_bot)
+        cursor.execute('PRAGMA journal_mode=WAL')
+        
         # Таблица пользователей
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS users (
@@ -49,6 +134,21 @@ class Database:
             )
         ''')
         
+        # Миграция users: кампания первого касания (start параметр при регистрации).
+        # Колонка start_param хранит последнее касание.
+        cursor.execute("PRAGMA table_info(users)")
+        user_columns = [row[1] for row in cursor.fetchall()]
+        backfill_campaigns = 'first_start_param' not in user_columns
+        if backfill_campaigns:
+            cursor.execute('ALTER TABLE users ADD COLUMN first_start_param TEXT')
+            # Для существующих пользователей лучшее, что известно, - текущий start_param
+            cursor.execute('''
+                UPDATE users SET first_start_param = start_param
+                WHERE start_param IS NOT NULL AND length(start_param) <= 64
+                    AND start_param NOT GLOB '*[^A-Za-z0-9_-]*'
+            ''')
+            logger.info("Добавлена колонка first_start_param в таблицу users")
+        
         # Таблица рассылок (создаем сначала базовую версию)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS broadcasts (
@@ -66,26 +166,46 @@ class Database:
         cursor.execute("PRAGMA table_info(broadcasts)")
         existing_columns = [row[1] for row in cursor.fetchall()]
         
-        if 'scheduled_at' not in existing_columns:
-            try:
-                cursor.execute('ALTER TABLE broadcasts ADD COLUMN scheduled_at TIMESTAMP')
-                logger.info("Добавлена колонка scheduled_at в таблицу broadcasts")
-            except sqlite3.OperationalError as e:
-                logger.warning(f"Не удалось добавить колонку scheduled_at: {e}")
-        
-        if 'is_scheduled' not in existing_columns:
-            try:
-                cursor.execute('ALTER TABLE broadcasts ADD COLUMN is_scheduled INTEGER DEFAULT 0')
-                logger.info("Добавлена колонка is_scheduled в таблицу broadcasts")
-            except sqlite3.OperationalError as e:
-                logger.warning(f"Не удалось добавить колонку is_scheduled: {e}")
-        
-        if 'segment_type' not in existing_columns:
-            try:
-                cursor.execute('ALTER TABLE broadcasts ADD COLUMN segment_type TEXT')
-                logger.info("Добавлена колонка segment_type в таблицу broadcasts")
-            except sqlite3.OperationalError as e:
-                logger.warning(f"Не удалось добавить колонку segment_type: {e}")
+        broadcast_columns = [
+            ('scheduled_at', 'TIMESTAMP'),
+            ('is_scheduled', 'INTEGER DEFAULT 0'),
+            ('segment_type', 'TEXT'),
+            # Аренда (lease) отложенной рассылки: какой экземпляр admin_bot
+            # её выполняет и до какого момента аренда действительна
+            ('lease_owner', 'TEXT'),
+            ('lease_expires_at', 'TIMESTAMP'),
+            # Сколько раз рассылку захватывали для отправки (сбрасывается после
+            # успешного запуска) и когда она отмечена невыполненной
+            ('attempts', 'INTEGER DEFAULT 0'),
+            ('failed_at', 'TIMESTAMP'),
+            # Повторяющиеся рассылки: расписание и заранее вычисленное
+            # время следующего запуска
+            ('recurrence', 'TEXT'),
+            ('next_fire_at', 'TIMESTAMP'),
+            # Снимок аудитории (файл с ID получателей) и позиция в нем,
+            # до которой рассылка уже отправлена (контрольная точка)
+            ('snapshot_path', 'TEXT'),
+            ('snapshot_offset', 'INTEGER DEFAULT 0'),
+            # Момент среза снимка (UTC, как registered_at) и последний
+            # обработанный получатель: по ним экземпляр без файла снимка
+            # воссоздает его и продолжает с того же места
+            ('snapshot_at', 'TIMESTAMP'),
+            ('snapshot_last_user_id', 'INTEGER'),
+        ]
+        
+        for column_name, column_type in broadcast_columns:
+            if column_name not in existing_columns:
+                try:
+                    cursor.execute(f'ALTER TABLE broadcasts ADD COLUMN {column_name} {column_type}')
+                    logger.info(f"Добавлена колонка {column_name} в таблицу broadcasts")
+                except sqlite3.OperationalError as e:
+                    logger.warning(f"Не удалось добавить колонку {column_name}: {e}")
+        
+        # Для ранее созданных отложенных рассылок время запуска = scheduled_at
+        cursor.execute('''
+            UPDATE broadcasts SET next_fire_at = scheduled_at
+            WHERE is_scheduled = 1 AND next_fire_at IS NULL
+        ''')
         
         # Таблица шаблонов рассылок
         cursor.execute('''
@@ -111,11 +231,300 @@ class Database:
             )
         ''')
         
+        # Атрибуция по start параметрам (кампаниям).
+        # campaign_touches - журнал касаний (только добавление), campaigns - счетчики
+        # по кампаниям, campaign_activity_days - сколько пользователей кампании (по первому
+        # касанию) были последний раз активны в каждый день. Все счетчики поддерживаются
+        # триггерами, поэтому /campaigns не сканирует таблицу users.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS campaigns (
+                start_param TEXT PRIMARY KEY,
+                first_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                touches INTEGER NOT NULL DEFAULT 0,
+                signups INTEGER NOT NULL DEFAULT 0,
+                returning_users INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS campaign_touches (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                start_param TEXT NOT NULL,
+                touched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                is_signup INTEGER NOT NULL DEFAULT 0,
+                is_return INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS campaign_activity_days (
+                start_param TEXT NOT NULL,
+                day DATE NOT NULL,
+                users INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (start_param, day)
+            )
+        ''')
+        
+        if backfill_campaigns:
+            cursor.execute('''
+                INSERT OR IGNORE INTO campaigns (start_param, first_seen_at, touches, signups)
+                SELECT first_start_param, MIN(registered_at), COUNT(*), COUNT(*)
+                FROM users WHERE first_start_param IS NOT NULL
+                GROUP BY first_start_param
+            ''')
+            cursor.execute('''
+                INSERT OR IGNORE INTO campaign_activity_days (start_param, day, users)
+                SELECT first_start_param, date(last_activity), COUNT(*)
+                FROM users
+                WHERE first_start_param IS NOT NULL
+                    AND last_activity >= datetime('now', '-30 days')
+                GROUP BY first_start_param, date(last_activity)
+            ''')
+        
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_campaign_touch_insert
+            AFTER INSERT ON campaign_touches
+            BEGIN
+                INSERT INTO campaigns (start_param, first_seen_at, touches, signups, returning_users)
+                VALUES (NEW.start_param, NEW.touched_at, 1, NEW.is_signup, NEW.is_return)
+                ON CONFLICT(start_param) DO UPDATE SET
+                    touches = touches + 1,
+                    signups = signups + excluded.signups,
+                    returning_users = returning_users + excluded.returning_users;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_campaign_activity_insert
+            AFTER INSERT ON users WHEN NEW.first_start_param IS NOT NULL
+            BEGIN
+                INSERT INTO campaign_activity_days (start_param, day, users)
+                VALUES (NEW.first_start_param, date(NEW.last_activity), 1)
+                ON CONFLICT(start_param, day) DO UPDATE SET users = users + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_campaign_activity_update
+            AFTER UPDATE OF last_activity ON users
+            WHEN NEW.first_start_param IS NOT NULL
+                AND date(OLD.last_activity) IS NOT date(NEW.last_activity)
+            BEGIN
+                UPDATE campaign_activity_days SET users = users - 1
+                WHERE start_param = NEW.first_start_param AND day = date(OLD.last_activity);
+                INSERT INTO campaign_activity_days (start_param, day, users)
+                VALUES (NEW.first_start_param, date(NEW.last_activity), 1)
+                ON CONFLICT(start_param, day) DO UPDATE SET users = users + 1;
+                -- Дни старше 30 дней больше не нужны ни одному отчету
+                DELETE FROM campaign_activity_days
+                WHERE start_param = NEW.first_start_param
+                    AND (users <= 0 OR day < date('now', '-30 days'));
+            END
+        ''')
+        
+        # Счетчики, поддерживаемые триггерами (чтобы не делать COUNT по всей таблице)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+        cursor.execute('''
+            INSERT OR IGNORE INTO counters (name, value)
+            SELECT 'active_users', COUNT(*) FROM users WHERE is_active = 1
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_count_insert
+            AFTER INSERT ON users WHEN NEW.is_active = 1
+            BEGIN
+                UPDATE counters SET value = value + 1 WHERE name = 'active_users';
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_count_update
+            AFTER UPDATE OF is_active ON users
+            WHEN (OLD.is_active = 1) != (NEW.is_active = 1)
+            BEGIN
+                UPDATE counters
+                SET value = value + (CASE WHEN NEW.is_active = 1 THEN 1 ELSE -1 END)
+                WHERE name = 'active_users';
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_users_count_delete
+            AFTER DELETE ON users WHEN OLD.is_active = 1
+            BEGIN
+                UPDATE counters SET value = value - 1 WHERE name = 'active_users';
+            END
+        ''')
+        
+        # Ссылки кнопок рассылок для учета переходов (redirect_server.py).
+        # broadcast_id у мгновенной рассылки заполняется после ее сохранения.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS broadcast_links (
+                id INTEGER PRIMARY KEY,
+                broadcast_id INTEGER,
+                button INTEGER NOT NULL,
+                text TEXT,
+                url TEXT NOT NULL,
+                clicks INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        
+        # Пользователи, переходившие по ссылкам (по одной строке на ссылку и пользователя):
+        # clicks в broadcast_links учитывает повторные переходы, здесь - уникальные
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS link_clickers (
+                id INTEGER PRIMARY KEY,
+                link_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                UNIQUE (link_id, user_id)
+            )
+        ''')
+        
+        # Журнал изменений для зеркала аналитики (analytics_mirror.py): ID строк
+        # users, broadcasts, broadcast_links и link_clickers с возрастающим номером seq.
+        # У строки в журнале одна запись: повторное изменение переносит ее в конец.
+        # Зеркал может быть несколько (по одному на экземпляр admin_bot), каждое
+        # помнит, до какого seq перенесены изменения, и отмечает это в analytics_mirrors;
+        # записи удаляются, только когда их перенесли все зеркала.
+        cursor.execute("PRAGMA table_info(analytics_changes)")
+        change_columns = [column[1] for column in cursor.fetchall()]
+        if change_columns and 'seq' not in change_columns:
+            # Журнал прежнего формата (без seq): зеркала при запуске копируются заново
+            cursor.execute('DROP TABLE analytics_changes')
+            for table in ('users', 'broadcasts', 'broadcast_links', 'link_clickers'):
+                for event in ('insert', 'update', 'delete'):
+                    cursor.execute(f'DROP TRIGGER IF EXISTS trg_analytics_{table}_{event}')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                table_name TEXT NOT NULL,
+                row_id INTEGER NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS analytics_mirrors (
+                mirror_id TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL,
+                synced_at REAL NOT NULL
+            )
+        ''')
+        for table, key in (('users', 'user_id'), ('broadcasts', 'id'),
+                           ('broadcast_links', 'id'), ('link_clickers', 'id')):
+            for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+                # DELETE + INSERT, а не INSERT OR REPLACE: конфликт-клауза триггера
+                # подменяется клаузой внешнего запроса (INSERT OR IGNORE INTO users ...)
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS trg_analytics_{table}_{event.lower()}
+                    AFTER {event} ON {table}
+                    BEGIN
+                        DELETE FROM analytics_changes
+                        WHERE table_name = '{table}' AND row_id = {row}.{key};
+                        INSERT INTO analytics_changes (table_name, row_id)
+                        VALUES ('{table}', {row}.{key});
+                    END
+                ''')
+        
+        # События воронки (events.py): журнал только на добавление
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS events (
+                id INTEGER PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                event TEXT NOT NULL,
+                start_param TEXT,
+                payload TEXT,
+                created_at TIMESTAMP NOT NULL
+            )
+        ''')
+        # Воронка считается триггерами при добавлении событий, отчеты читают только
+        # счетчики. funnel_users - первое достижение шага пользователем, funnel_daily -
+        # пользователи по дню регистрации и кампании первого касания (когорта), дошедшие
+        # до шага, и общее число событий шага.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS funnel_users (
+                user_id INTEGER NOT NULL,
+                step TEXT NOT NULL,
+                day DATE NOT NULL,
+                start_param TEXT NOT NULL,
+                PRIMARY KEY (user_id, step)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS funnel_daily (
+                day DATE NOT NULL,
+                start_param TEXT NOT NULL,
+                step TEXT NOT NULL,
+                users INTEGER NOT NULL DEFAULT 0,
+                events INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, start_param, step)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_events_funnel
+            AFTER INSERT ON events
+            BEGIN
+                INSERT INTO funnel_users (user_id, step, day, start_param)
+                SELECT NEW.user_id, NEW.event,
+                    COALESCE(date(u.registered_at), date(NEW.created_at)),
+                    COALESCE(u.first_start_param, '')
+                FROM (SELECT 1) LEFT JOIN users u ON u.user_id = NEW.user_id
+                WHERE true
+                ON CONFLICT DO NOTHING;
+                -- Событие засчитывается в когорту пользователя (день регистрации, кампания)
+                INSERT INTO funnel_daily (day, start_param, step, events)
+                SELECT day, start_param, step, 1 FROM funnel_users
+                WHERE user_id = NEW.user_id AND step = NEW.event
+                ON CONFLICT(day, start_param, step) DO UPDATE SET events = events + 1;
+            END
+        ''')
+        cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS trg_funnel_users_insert
+            AFTER INSERT ON funnel_users
+            BEGIN
+                INSERT INTO funnel_daily (day, start_param, step, users)
+                VALUES (NEW.day, NEW.start_param, NEW.step, 1)
+                ON CONFLICT(day, start_param, step) DO UPDATE SET users = users + 1;
+            END
+        ''')
+        
+        # Дневные HyperLogLog скетчи активных пользователей (activity.py):
+        # день (YYYY-MM-DD, UTC) -> сжатые регистры скетча
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS activity_sketches (
+                day TEXT PRIMARY KEY,
+                sketch BLOB NOT NULL
+            ) WITHOUT ROWID
+        ''')
+        
+        # Состояния FSM admin_bot (черновики рассылок, шаблонов и т.п.)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS fsm_storage (
+                storage_key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT,
+                updated_at REAL NOT NULL
+            )
+        ''')
+        
         # Создаем индексы для оптимизации запросов
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_active ON users(is_active)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_registered ON users(registered_at)')
+        # Составные индексы для сегментов: почти все условия начинаются с is_active = 1
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_active_registered ON users(is_active, registered_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_active_last_activity ON users(is_active, last_activity)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_active_start_param ON users(is_active, start_param)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_active_campaign ON users(is_active, first_start_param)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_created ON broadcasts(created_at)')
+        # Индексы для постраничного просмотра истории и шаблонов
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_history ON broadcasts(is_scheduled, id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_templates_admin ON broadcast_templates(admin_id, id)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_activity_date ON user_activity(activity_date)')
+        cursor.execute('DROP INDEX IF EXISTS idx_broadcasts_scheduled')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcasts_next_fire ON broadcasts(is_scheduled, next_fire_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_fsm_storage_updated ON fsm_storage(updated_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_campaign_touches_param_user ON campaign_touches(start_param, user_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_events_created ON events(created_at)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_links_broadcast ON broadcast_links(broadcast_id, button)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_analytics_changes_row ON analytics_changes(table_name, row_id)')
         
         conn.commit()
         conn.close()
@@ -126,6 +535,11 @@ class Database:
         """
         Добавить нового пользователя
         
+        Если передан start_param, касание записывается в журнал кампаний:
+        для нового пользователя это первое касание (регистрация), для
+        существующего - возврат по ссылке кампании. В users.start_param
+        хранится последний полученный start параметр.
+        
         Returns:
             True если пользователь новый, False если уже существует
         """
@@ -136,33 +550,388 @@ class Database:
         cursor.execute('SELECT user_id FROM users WHERE user_id = ?', (user_id,))
         exists = cursor.fetchone()
         
+        # В кампании учитываются только корректные start параметры (как их принимает Telegram)
+        campaign = start_param if start_param and CAMPAIGN_PARAM_RE.fullmatch(start_param) else None
+        
         if exists:
-            # Обновляем информацию о пользователе
+            # Обновляем информацию о пользователе (последнее касание не затираем пустым)
             cursor.execute('''
                 UPDATE users 
                 SET username = ?, first_name = ?, last_name = ?, 
-                    start_param = ?, last_activity = CURRENT_TIMESTAMP
+                    start_param = COALESCE(?, start_param), last_activity = CURRENT_TIMESTAMP
                 WHERE user_id = ?
             ''', (username, first_name, last_name, start_param, user_id))
+            
+            if campaign:
+                # Возвратом считается первое касание кампании уже зарегистрированным пользователем
+                cursor.execute('''
+                    SELECT 1 FROM campaign_touches WHERE start_param = ? AND user_id = ? LIMIT 1
+                ''', (campaign, user_id))
+                is_return = 0 if cursor.fetchone() else 1
+                cursor.execute('''
+                    INSERT INTO campaign_touches (user_id, start_param, is_signup, is_return)
+                    VALUES (?, ?, 0, ?)
+                ''', (user_id, campaign, is_return))
+            
             conn.commit()
             conn.close()
             return False
         else:
             # Добавляем нового пользователя
             cursor.execute('''
-                INSERT INTO users (user_id, username, first_name, last_name, start_param)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, username, first_name, last_name, start_param))
+                INSERT INTO users (user_id, username, first_name, last_name, start_param, first_start_param)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (user_id, username, first_name, last_name, start_param, campaign))
+            
+            if campaign:
+                cursor.execute('''
+                    INSERT INTO campaign_touches (user_id, start_param, is_signup, is_return)
+                    VALUES (?, ?, 1, 0)
+                ''', (user_id, campaign))
+            
             conn.commit()
             conn.close()
             return True
     
+    @staticmethod
+    def _import_record(row: Dict) -> Optional[Tuple]:
+        """Строка импорта -> запись временной таблицы import_users (None, если строка некорректна)"""
+        try:
+            user_id = int(row.get('user_id'))
+            # Время - в формате базы, иначе не сработают сравнения в сегментах и отчетах
+            registered_at = normalize_timestamp(row.get('registered_at'))
+            last_activity = normalize_timestamp(row.get('last_activity'))
+        except (TypeError, ValueError):
+            return None
+        
+        def text(name: str) -> Optional[str]:
+            value = row.get(name)
+            return str(value) if value not in (None, '') else None
+        
+        start_param = text('start_param')
+        # Кампания первого касания: из выгрузки (first_start_param) или по start параметру
+        campaign = text('first_start_param') or start_param
+        if campaign and not CAMPAIGN_PARAM_RE.fullmatch(campaign):
+            campaign = None
+        
+        is_active = row.get('is_active')
+        if is_active in (None, ''):
+            is_active = 1
+        else:
+            is_active = 1 if str(is_active).strip().lower() in ('1', 'true', 'yes') else 0
+        
+        return (
+            user_id, text('username'), text('first_name'), text('last_name'), start_param,
+            campaign, registered_at, last_activity, is_active
+        )
+    
+    def _flush_import_batch(self, conn: sqlite3.Connection, records: List[Tuple],
+                            update_existing: bool, stats: Dict[str, int]):
+        """Записать пачку импорта одной транзакцией"""
+        with conn:
+            conn.execute('DELETE FROM import_users')
+            conn.executemany(
+                'INSERT INTO import_users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', records
+            )
+            existing = conn.execute(
+                'SELECT COUNT(*) FROM import_users JOIN users USING (user_id)'
+            ).fetchone()[0]
+            
+            # Регистрация по кампании - касание, как в add_user (счетчики campaigns
+            # обновит триггер). Записываем до вставки, пока новые ID отличимы от старых.
+            conn.execute('''
+                INSERT INTO campaign_touches (user_id, start_param, touched_at, is_signup, is_return)
+                SELECT i.user_id, i.campaign, COALESCE(i.registered_at, CURRENT_TIMESTAMP), 1, 0
+                FROM import_users i
+                WHERE i.campaign IS NOT NULL
+                    AND NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = i.user_id)
+                ORDER BY i.user_id
+            ''')
+            
+            if update_existing:
+                # Данные текущего бота свежее: заполняем только пустые поля,
+                # дату регистрации берем более раннюю
+                on_conflict = '''DO UPDATE SET
+                    username = COALESCE(users.username, excluded.username),
+                    first_name = COALESCE(users.first_name, excluded.first_name),
+                    last_name = COALESCE(users.last_name, excluded.last_name),
+                    start_param = COALESCE(users.start_param, excluded.start_param),
+                    registered_at = MIN(users.registered_at, excluded.registered_at)'''
+            else:
+                on_conflict = 'DO NOTHING'
+            
+            # WHERE true нужен SQLite, чтобы отличить ON CONFLICT от условия JOIN
+            conn.execute(f'''
+                INSERT INTO users (user_id, username, first_name, last_name, start_param,
+                                   first_start_param, registered_at, last_activity, is_active)
+                SELECT user_id, username, first_name, last_name, start_param, campaign,
+                    COALESCE(registered_at, CURRENT_TIMESTAMP),
+                    COALESCE(last_activity, registered_at, CURRENT_TIMESTAMP),
+                    is_active
+                FROM import_users WHERE true
+                ORDER BY user_id
+                ON CONFLICT(user_id) {on_conflict}
+            ''')
+        
+        stats['inserted'] += len(records) - existing
+        stats['updated' if update_existing else 'skipped'] += existing
+    
+    def bulk_upsert_users(self, rows: Iterable[Dict], batch_size: int = 20000,
+                          update_existing: bool = False,
+                          progress: Optional[Callable[[Dict[str, int]], None]] = None) -> Dict[str, int]:
+        """
+        Массовый импорт пользователей (например, из выгрузки старого бота)
+        
+        Строки читаются из итератора потоково и записываются пачками по
+        batch_size в одной транзакции на пачку: пачка загружается через
+        executemany во временную таблицу, отсортированной по user_id, и
+        переносится в users одним INSERT ... ON CONFLICT. Триггеры счетчиков
+        остаются включенными - на строку они делают одно обновление по ключу.
+        
+        Args:
+            rows: Словари с ключами user_id (обязательно), username, first_name,
+                last_name, start_param, first_start_param, registered_at,
+                last_activity, is_active. Время приводится к формату базы
+                (normalize_timestamp); строки с нераспознанным временем или
+                без user_id считаются некорректными (invalid)
+            batch_size: Строк в одной транзакции
+            update_existing: Дополнить существующих пользователей (иначе пропустить)
+            progress: Вызывается со статистикой после каждой пачки
+        
+        Returns:
+            {'rows', 'inserted', 'updated', 'skipped', 'duplicates', 'invalid'}
+        """
+        stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'skipped': 0, 'duplicates': 0, 'invalid': 0}
+        conn = self.get_connection()
+        
+        try:
+            conn.execute('PRAGMA temp_store = MEMORY')
+            # Больше кеш страниц - меньше чтений при обновлении индексов users
+            conn.execute('PRAGMA cache_size = -65536')
+            conn.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS import_users (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT,
+                    first_name TEXT,
+                    last_name TEXT,
+                    start_param TEXT,
+                    campaign TEXT,
+                    registered_at TIMESTAMP,
+                    last_activity TIMESTAMP,
+                    is_active INTEGER
+                )
+            ''')
+            
+            batch: Dict[int, Tuple] = {}
+            for row in rows:
+                stats['rows'] += 1
+                record = self._import_record(row)
+                if record is None:
+                    stats['invalid'] += 1
+                    continue
+                if record[0] in batch:
+                    stats['duplicates'] += 1
+                batch[record[0]] = record
+                
+                if len(batch) >= batch_size:
+                    self._flush_import_batch(conn, sorted(batch.values()), update_existing, stats)
+                    batch = {}
+                    if progress:
+                        progress(stats)
+            
+            if batch:
+                self._flush_import_batch(conn, sorted(batch.values()), update_existing, stats)
+                if progress:
+                    progress(stats)
+        finally:
+            conn.close()
+        
+        logger.info(f"Импорт пользователей завершен: {stats}")
+        return stats
+    
+    def get_campaign_stats(self, limit: int = 20) -> List[Dict]:
+        """
+        Статистика кампаний по предварительно посчитанным счетчикам
+        
+        Активность (7/30 дней) считается по кампании первого касания
+        пользователя и по дате его последней активности.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT c.start_param, c.first_seen_at, c.touches, c.signups, c.returning_users,
+                COALESCE((
+                    SELECT SUM(d.users) FROM campaign_activity_days d
+                    WHERE d.start_param = c.start_param AND d.day >= date('now', '-6 days')
+                ), 0) AS active_7d,
+                COALESCE((
+                    SELECT SUM(d.users) FROM campaign_activity_days d
+                    WHERE d.start_param = c.start_param AND d.day >= date('now', '-29 days')
+                ), 0) AS active_30d
+            FROM campaigns c
+            ORDER BY c.signups DESC, c.touches DESC
+            LIMIT ?
+        ''', (limit,))
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+    
+    def increment_counters(self, deltas: Dict[str, int]):
+        """Увеличить счетчики в таблице counters (создаются при первом обращении)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO counters (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = value + excluded.value
+        ''', list(deltas.items()))
+        conn.commit()
+        conn.close()
+    
+    def get_counter(self, name: str) -> int:
+        """Получить значение счетчика (0, если счетчика нет)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT value FROM counters WHERE name = ?', (name,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else 0
+    
+    def insert_events(self, events: List[Tuple]):
+        """
+        Добавить пачку событий одной транзакцией
+        
+        Args:
+            events: Кортежи (user_id, event, start_param, payload, created_at)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            INSERT INTO events (user_id, event, start_param, payload, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', events)
+        conn.commit()
+        conn.close()
+    
+    def get_funnel(self, steps: Iterable[str], days: int = 30, limit: int = 10) -> Tuple[Dict[str, Dict], List[Dict]]:
+        """
+        Воронка по счетчикам funnel_daily для пользователей, зарегистрированных за days дней
+        
+        Returns:
+            (итог: шаг -> {'users', 'events'},
+             кампании: [{'start_param', шаг: пользователей, ...}] по убыванию первого шага)
+        """
+        steps = list(steps)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        since = f'-{days - 1} days'
+        
+        cursor.execute('''
+            SELECT step, SUM(users) AS users, SUM(events) AS events
+            FROM funnel_daily WHERE day >= date('now', ?)
+            GROUP BY step
+        ''', (since,))
+        totals = {step: {'users': 0, 'events': 0} for step in steps}
+        for row in cursor.fetchall():
+            if row['step'] in totals:
+                totals[row['step']] = {'users': row['users'], 'events': row['events']}
+        
+        columns = ', '.join(
+            f"SUM(CASE WHEN step = ? THEN users ELSE 0 END) AS step_{index}" for index in range(len(steps))
+        )
+        cursor.execute(f'''
+            SELECT start_param, {columns}
+            FROM funnel_daily WHERE day >= date('now', ?) AND start_param != ''
+            GROUP BY start_param
+            ORDER BY step_0 DESC
+            LIMIT ?
+        ''', (*steps, since, limit))
+        campaigns = [
+            {'start_param': row['start_param'], **{step: row[f'step_{index}'] for index, step in enumerate(steps)}}
+            for row in cursor.fetchall()
+        ]
+        conn.close()
+        return totals, campaigns
+    
+    def touch_users(self, activity: Dict[int, str]):
+        """
+        Обновить last_activity пачкой (ID пользователя -> время 'YYYY-MM-DD HH:MM:SS', UTC)
+        
+        Время только увеличивается: более старая отметка не затирает новую.
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany('''
+            UPDATE users SET last_activity = ?
+            WHERE user_id = ? AND (last_activity IS NULL OR last_activity < ?)
+        ''', [(moment, user_id, moment) for user_id, moment in activity.items()])
+        conn.commit()
+        conn.close()
+    
+    def merge_activity_sketches(self, sketches: Dict[str, HyperLogLog]):
+        """
+        Объединить дневные скетчи активности с сохраненными
+        
+        Объединение идемпотентно, поэтому несколько процессов (воркеры
+        webhook) могут сохранять свои скетчи за один и тот же день.
+        """
+        conn = self.get_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            # IMMEDIATE: чтение и запись скетча без гонки с другими процессами
+            cursor.execute('BEGIN IMMEDIATE')
+            for day, sketch in sketches.items():
+                cursor.execute('SELECT sketch FROM activity_sketches WHERE day = ?', (day,))
+                row = cursor.fetchone()
+                if row:
+                    stored = HyperLogLog.from_bytes(row[0])
+                    stored.merge(sketch)
+                    sketch = stored
+                cursor.execute('''
+                    INSERT INTO activity_sketches (day, sketch) VALUES (?, ?)
+                    ON CONFLICT(day) DO UPDATE SET sketch = excluded.sketch
+                ''', (day, sketch.to_bytes()))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    
+    def iter_activity_sketches(self, first_day: str, last_day: str) -> Iterator[Tuple[str, HyperLogLog]]:
+        """
+        Дневные скетчи активности за период (включительно), по одному
+        
+        Args:
+            first_day: Первый день (YYYY-MM-DD)
+            last_day: Последний день (YYYY-MM-DD)
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.execute(
+                'SELECT day, sketch FROM activity_sketches WHERE day BETWEEN ? AND ? ORDER BY day',
+                (first_day, last_day)
+            )
+            for day, data in cursor:
+                yield day, HyperLogLog.from_bytes(data)
+        finally:
+            conn.close()
+    
     def get_user_count(self) -> int:
-        """Получить общее количество пользователей"""
+        """
+        Получить общее количество пользователей
+        
+        Читает счетчик, который поддерживается триггерами на таблице users.
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-        cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1')
-        count = cursor.fetchone()[0]
+        cursor.execute("SELECT value FROM counters WHERE name = 'active_users'")
+        row = cursor.fetchone()
+        if row:
+            count = row[0]
+        else:
+            cursor.execute('SELECT COUNT(*) FROM users WHERE is_active = 1')
+            count = cursor.fetchone()[0]
         conn.close()
         return count
     
@@ -188,16 +957,127 @@ class Database:
         return None
     
     def save_broadcast(self, admin_id: int, message_text: str, 
-                      sent_count: int, failed_count: int):
-        """Сохранить информацию о рассылке"""
+                      sent_count: int, failed_count: int) -> int:
+        """Сохранить информацию о рассылке и вернуть ее ID"""
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
             INSERT INTO broadcasts (admin_id, message_text, sent_count, failed_count)
             VALUES (?, ?, ?, ?)
         ''', (admin_id, message_text, sent_count, failed_count))
+        broadcast_id = cursor.lastrowid
         conn.commit()
         conn.close()
+        return broadcast_id
+    
+    def create_broadcast_links(self, buttons: List[Dict], broadcast_id: Optional[int] = None) -> List[int]:
+        """
+        Зарегистрировать ссылки кнопок рассылки для учета переходов
+        
+        Для сохраненной рассылки (broadcast_id) ссылки создаются один раз
+        на запуск: продолжение после сбоя или передачи аренды получает те же ID.
+        Ссылки повторяющейся рассылки после запуска переходят к его записи
+        в истории (complete_scheduled_broadcast), поэтому следующий запуск
+        создает свои и переходы разных запусков не смешиваются.
+        
+        Returns:
+            ID ссылок в порядке кнопок
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if broadcast_id is not None:
+            cursor.execute(
+                'SELECT id, url FROM broadcast_links WHERE broadcast_id = ? ORDER BY button',
+                (broadcast_id,)
+            )
+            existing = cursor.fetchall()
+            if [row['url'] for row in existing] == [button['url'] for button in buttons]:
+                conn.close()
+                return [row['id'] for row in existing]
+        
+        link_ids = []
+        for index, button in enumerate(buttons):
+            cursor.execute('''
+                INSERT INTO broadcast_links (broadcast_id, button, text, url)
+                VALUES (?, ?, ?, ?)
+            ''', (broadcast_id, index, button['text'], button['url']))
+            link_ids.append(cursor.lastrowid)
+        conn.commit()
+        conn.close()
+        return link_ids
+    
+    def attach_broadcast_links(self, link_ids: List[int], broadcast_id: int):
+        """Привязать ссылки мгновенной рассылки к сохраненной рассылке"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            'UPDATE broadcast_links SET broadcast_id = ? WHERE id = ?',
+            [(broadcast_id, link_id) for link_id in link_ids]
+        )
+        conn.commit()
+        conn.close()
+    
+    def get_broadcast_link_url(self, link_id: int) -> Optional[str]:
+        """Адрес ссылки кнопки (None, если ссылки нет)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('SELECT url FROM broadcast_links WHERE id = ?', (link_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return row[0] if row else None
+    
+    def add_link_clicks(self, clicks: Dict[int, int], clickers: Iterable[Tuple[int, int]] = ()):
+        """
+        Прибавить переходы к счетчикам ссылок
+        
+        Args:
+            clicks: ID ссылки -> переходов
+            clickers: Пары (ID ссылки, ID пользователя); уже учтенные пропускаются
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.executemany(
+            'UPDATE broadcast_links SET clicks = clicks + ? WHERE id = ?',
+            [(count, link_id) for link_id, count in clicks.items()]
+        )
+        cursor.executemany(
+            'INSERT OR IGNORE INTO link_clickers (link_id, user_id) VALUES (?, ?)',
+            list(clickers)
+        )
+        conn.commit()
+        conn.close()
+    
+    def get_broadcast_clicks(self, broadcast_ids: List[int]) -> Dict[int, Dict]:
+        """
+        Переходы по кнопкам рассылок (только рассылки с кнопками)
+        
+        Returns:
+            ID рассылки -> {'clicks': всего переходов, 'clickers': перешедших пользователей}
+        """
+        if not broadcast_ids:
+            return {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ', '.join('?' * len(broadcast_ids))
+        cursor.execute(f'''
+            SELECT broadcast_id, SUM(clicks) FROM broadcast_links
+            WHERE broadcast_id IN ({placeholders})
+            GROUP BY broadcast_id
+        ''', broadcast_ids)
+        clicks = {broadcast_id: {'clicks': total, 'clickers': 0}
+                  for broadcast_id, total in cursor.fetchall()}
+        cursor.execute(f'''
+            SELECT l.broadcast_id, COUNT(DISTINCT c.user_id)
+            FROM broadcast_links l
+            JOIN link_clickers c ON c.link_id = l.id
+            WHERE l.broadcast_id IN ({placeholders})
+            GROUP BY l.broadcast_id
+        ''', broadcast_ids)
+        for broadcast_id, clickers in cursor.fetchall():
+            clicks[broadcast_id]['clickers'] = clickers
+        conn.close()
+        return clicks
     
     def get_broadcast_stats(self, limit: int = 10) -> List[Dict]:
         """Получить статистику рассылок"""
@@ -213,6 +1093,30 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
     
+    def get_broadcast_history_page(self, before_id: Optional[int] = None,
+                                   limit: int = 10) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Страница истории рассылок (keyset-пагинация по id, от новых к старым)
+        
+        Args:
+            before_id: Курсор - id последней рассылки предыдущей страницы
+            limit: Размер страницы
+        
+        Returns:
+            (рассылки страницы, курсор следующей страницы или None)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM broadcasts
+            WHERE is_scheduled = 0 AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (before_id if before_id is not None else 2 ** 63 - 1, limit + 1))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return _split_page(rows, limit, 'id')
+    
     def get_user_stats_by_date(self, days: int = 30) -> List[Dict]:
         """Получить статистику регистраций по датам"""
         conn = self.get_connection()
@@ -228,41 +1132,187 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
     
-    def get_active_users_by_segment(self, segment_type: str) -> List[int]:
+    def _segment_query(self, segment_type: str) -> Tuple[str, tuple]:
         """
-        Получить пользователей по сегменту
+        SQL-запрос ID активных пользователей сегмента и его параметры
         
-        Args:
-            segment_type: Тип сегмента ('new' - новые за 7 дней, 'active' - активные за 30 дней, 'all' - все)
+        Сегмент - встроенный ('all', 'new', 'active', 'inactive') или
+        выражение с префиксом 'expr:' (см. segments.py).
         """
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        if is_expression(segment_type):
+            compiled = compile_segment(segment_type[len(EXPR_PREFIX):])
+            return compiled.sql, compiled.params
         
         if segment_type == 'new':
-            cursor.execute('''
+            return '''
                 SELECT user_id FROM users 
                 WHERE is_active = 1 
                 AND registered_at >= datetime('now', '-7 days')
-            ''')
+            ''', ()
         elif segment_type == 'active':
-            cursor.execute('''
+            return '''
                 SELECT user_id FROM users 
                 WHERE is_active = 1 
                 AND last_activity >= datetime('now', '-30 days')
-            ''')
+            ''', ()
         elif segment_type == 'inactive':
-            cursor.execute('''
+            return '''
                 SELECT user_id FROM users 
                 WHERE is_active = 1 
                 AND last_activity < datetime('now', '-30 days')
-            ''')
+            ''', ()
         else:  # 'all'
-            cursor.execute('SELECT user_id FROM users WHERE is_active = 1')
+            return 'SELECT user_id FROM users WHERE is_active = 1', ()
+    
+    def get_active_users_by_segment(self, segment_type: str) -> List[int]:
+        """
+        Получить пользователей по сегменту
         
+        Args:
+            segment_type: Тип сегмента ('new' - новые за 7 дней, 'active' - активные за 30 дней,
+                'all' - все, 'expr:...' - по выражению)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(*self._segment_query(segment_type))
         users = [row[0] for row in cursor.fetchall()]
         conn.close()
         return users
     
+    def iter_user_id_batches(self, segment_type: str, batch_size: int = 10000,
+                             registered_before: Optional[str] = None) -> Iterator[List[int]]:
+        """
+        Потоково получить ID пользователей сегмента пачками
+        
+        В отличие от get_active_users_by_segment не загружает весь сегмент в память.
+        
+        Args:
+            registered_before: Только пользователи, зарегистрированные не позже
+                этого момента (UTC, 'YYYY-MM-DD HH:MM:SS'); ID отдаются по возрастанию
+        """
+        sql, params = self._segment_query(segment_type)
+        if registered_before is not None:
+            sql = f'''
+                SELECT s.user_id FROM ({sql}) s
+                JOIN users u ON u.user_id = s.user_id
+                WHERE u.registered_at <= ?
+                ORDER BY s.user_id
+            '''
+            params = (*params, registered_before)
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+        finally:
+            conn.close()
+    
+    def iter_export_batches(self, dataset: str, batch_size: int = 5000) -> Iterator[Tuple[List[str], List[Tuple]]]:
+        """
+        Потоково прочитать набор данных для выгрузки пачками
+        
+        SQLite отдает строки по мере продвижения курсора, поэтому в памяти
+        одновременно находится не больше batch_size строк.
+        
+        Yields:
+            (названия колонок, строки пачки)
+        """
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(EXPORT_QUERIES[dataset])
+            columns = [column[0] for column in cursor.description]
+            rows = cursor.fetchmany(batch_size)
+            # Первая пачка отдается всегда, чтобы и пустая выгрузка получила заголовок
+            yield columns, [tuple(row) for row in rows]
+            while rows:
+                rows = cursor.fetchmany(batch_size)
+                if rows:
+                    yield columns, [tuple(row) for row in rows]
+        finally:
+            conn.close()
+    
+    def get_user_timestamp_columns(self, batch_size: int = 10000) -> Tuple[array, array, array]:
+        """
+        Колоночный снимок пользователей для аналитики (cohorts.py)
+        
+        Время регистрации и последней активности (Unix-время в секундах) и
+        флаг is_active в компактных массивах, без словаря на каждую строку.
+        Пользователи с нераспознаваемым временем регистрации пропускаются,
+        нераспознаваемая последняя активность заменяется временем регистрации.
+        
+        Returns:
+            (registered_at, last_activity, is_active)
+        """
+        registered = array('q')
+        last_activity = array('q')
+        is_active = array('b')
+        
+        conn = self.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT CAST(strftime('%s', registered_at) AS INTEGER),
+                       CAST(COALESCE(strftime('%s', last_activity), strftime('%s', registered_at)) AS INTEGER),
+                       is_active
+                FROM users
+                WHERE strftime('%s', registered_at) IS NOT NULL
+            ''')
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    registered.append(row[0])
+                    last_activity.append(row[1])
+                    is_active.append(1 if row[2] else 0)
+        finally:
+            conn.close()
+        
+        return registered, last_activity, is_active
+    
+    def count_segment(self, segment_type: str) -> int:
+        """Количество пользователей в сегменте"""
+        sql, params = self._segment_query(segment_type)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM ({sql})', params)
+        count = cursor.fetchone()[0]
+        conn.close()
+        return count
+    
+    def explain_segment(self, segment_type: str) -> Dict:
+        """
+        Проверить план выполнения запроса сегмента
+        
+        Результат кешируется по тексту запроса (план зависит только от
+        запроса и индексов, а не от значений параметров).
+        
+        Returns:
+            {'uses_index': bool, 'plan': [строки EXPLAIN QUERY PLAN]}
+        """
+        sql, params = self._segment_query(segment_type)
+        cached = self._segment_plans.get(sql)
+        if cached:
+            return cached
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        plan = [row['detail'] for row in cursor.fetchall()]
+        conn.close()
+        
+        result = {'uses_index': plan_uses_index(plan), 'plan': plan}
+        self._segment_plans[sql] = result
+        if not result['uses_index']:
+            logger.warning(f"Сегмент {segment_type} требует полного просмотра таблицы: {plan}")
+        return result
+    
     def search_users(self, query: str) -> List[Dict]:
         """Поиск пользователей по имени, username или ID"""
         conn = self.get_connection()
@@ -292,6 +1342,56 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
     
+    def search_users_page(self, query: str, after_user_id: Optional[int] = None,
+                          limit: int = 10) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Страница результатов поиска пользователей (от новых к старым)
+        
+        Курсор - ID последнего пользователя предыдущей страницы; позиция
+        (registered_at, user_id) восстанавливается по нему, поэтому курсор
+        помещается в callback_data.
+        
+        Returns:
+            (пользователи страницы, курсор следующей страницы или None)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        # Точное совпадение по ID показываем единственным результатом
+        if after_user_id is None and query.isdigit():
+            cursor.execute('SELECT * FROM users WHERE user_id = ?', (int(query),))
+            result = cursor.fetchone()
+            if result:
+                conn.close()
+                return [dict(result)], None
+        
+        search_pattern = f'%{query}%'
+        position = None
+        if after_user_id is not None:
+            cursor.execute('SELECT registered_at, user_id FROM users WHERE user_id = ?', (after_user_id,))
+            position = cursor.fetchone()
+        
+        if position:
+            cursor.execute('''
+                SELECT * FROM users
+                WHERE (first_name LIKE ? OR last_name LIKE ? OR username LIKE ?)
+                    AND (registered_at, user_id) < (?, ?)
+                ORDER BY registered_at DESC, user_id DESC
+                LIMIT ?
+            ''', (search_pattern, search_pattern, search_pattern,
+                  position['registered_at'], position['user_id'], limit + 1))
+        else:
+            cursor.execute('''
+                SELECT * FROM users
+                WHERE first_name LIKE ? OR last_name LIKE ? OR username LIKE ?
+                ORDER BY registered_at DESC, user_id DESC
+                LIMIT ?
+            ''', (search_pattern, search_pattern, search_pattern, limit + 1))
+        
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return _split_page(rows, limit, 'user_id')
+    
     def toggle_user_active(self, user_id: int) -> bool:
         """Переключить статус активности пользователя"""
         conn = self.get_connection()
@@ -344,6 +1444,26 @@ class Database:
         conn.close()
         return [dict(row) for row in rows]
     
+    def get_templates_page(self, admin_id: int, before_id: Optional[int] = None,
+                           limit: int = 10) -> Tuple[List[Dict], Optional[int]]:
+        """
+        Страница шаблонов администратора (keyset-пагинация по id, от новых к старым)
+        
+        Returns:
+            (шаблоны страницы, курсор следующей страницы или None)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT * FROM broadcast_templates
+            WHERE admin_id = ? AND id < ?
+            ORDER BY id DESC
+            LIMIT ?
+        ''', (admin_id, before_id if before_id is not None else 2 ** 63 - 1, limit + 1))
+        rows = [dict(row) for row in cursor.fetchall()]
+        conn.close()
+        return _split_page(rows, limit, 'id')
+    
     def get_template(self, template_id: int) -> Optional[Dict]:
         """Получить шаблон по ID"""
         conn = self.get_connection()
@@ -372,14 +1492,22 @@ class Database:
     def save_scheduled_broadcast(self, admin_id: int, message_text: str, 
                                  scheduled_at: str, segment_type: str = 'all',
                                  photo_file_id: Optional[str] = None, 
-                                 buttons_data: Optional[str] = None) -> int:
-        """Сохранить отложенную рассылку"""
+                                 buttons_data: Optional[str] = None,
+                                 recurrence: Optional[str] = None) -> int:
+        """
+        Сохранить отложенную рассылку
+        
+        Args:
+            scheduled_at: Время первого запуска (ISO формат)
+            recurrence: Расписание повторяющейся рассылки (см. recurrence.py)
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute('''
-            INSERT INTO broadcasts (admin_id, message_text, scheduled_at, is_scheduled, segment_type)
-            VALUES (?, ?, ?, 1, ?)
-        ''', (admin_id, message_text, scheduled_at, segment_type))
+            INSERT INTO broadcasts (admin_id, message_text, scheduled_at, is_scheduled,
+                                    segment_type, recurrence, next_fire_at)
+            VALUES (?, ?, ?, 1, ?, ?, ?)
+        ''', (admin_id, message_text, scheduled_at, segment_type, recurrence, scheduled_at))
         conn.commit()
         broadcast_id = cursor.lastrowid
         conn.close()
@@ -391,13 +1519,377 @@ class Database:
         cursor = conn.cursor()
         cursor.execute('''
             SELECT * FROM broadcasts 
-            WHERE is_scheduled = 1 AND scheduled_at > datetime('now')
-            ORDER BY scheduled_at ASC
+            WHERE is_scheduled = 1
+            ORDER BY next_fire_at ASC
         ''')
         rows = cursor.fetchall()
         conn.close()
         return [dict(row) for row in rows]
     
+    def claim_due_broadcast(self, owner_id: str, lease_seconds: int) -> Optional[Dict]:
+        """
+        Атомарно захватить одну наступившую отложенную рассылку
+        
+        Рассылка доступна для захвата, если у неё нет владельца или аренда
+        предыдущего владельца истекла (экземпляр упал или завис).
+        BEGIN IMMEDIATE берет блокировку записи сразу, поэтому два экземпляра
+        admin_bot не могут захватить одну и ту же рассылку.
+        
+        Args:
+            owner_id: Идентификатор экземпляра планировщика
+            lease_seconds: Длительность аренды в секундах
+        
+        Returns:
+            Данные захваченной рассылки или None, если захватывать нечего
+        """
+        now = datetime.now()
+        now_str = now.isoformat(timespec='seconds')
+        expires_str = (now + timedelta(seconds=lease_seconds)).isoformat(timespec='seconds')
+        
+        conn = self.get_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT * FROM broadcasts
+                WHERE is_scheduled = 1 AND next_fire_at <= ?
+                AND (lease_owner IS NULL OR lease_expires_at < ?)
+                ORDER BY next_fire_at ASC
+                LIMIT 1
+            ''', (now_str, now_str))
+            row = cursor.fetchone()
+            
+            if not row:
+                cursor.execute('COMMIT')
+                return None
+            
+            cursor.execute('''
+                UPDATE broadcasts
+                SET lease_owner = ?, lease_expires_at = ?, attempts = COALESCE(attempts, 0) + 1
+                WHERE id = ?
+            ''', (owner_id, expires_str, row['id']))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        
+        broadcast = dict(row)
+        if broadcast['lease_owner']:
+            logger.warning(
+                f"Рассылка {broadcast['id']} перехвачена у {broadcast['lease_owner']} "
+                f"(аренда истекла {broadcast['lease_expires_at']})"
+            )
+        broadcast['lease_owner'] = owner_id
+        broadcast['lease_expires_at'] = expires_str
+        broadcast['attempts'] = (broadcast['attempts'] or 0) + 1
+        return broadcast
+    
+    def claim_broadcast_for_snapshot(self, owner_id: str, lease_seconds: int,
+                                     horizon: str) -> Optional[Dict]:
+        """
+        Захватить рассылку, для которой пора подготовить снимок аудитории
+        
+        Args:
+            owner_id: Идентификатор экземпляра планировщика
+            lease_seconds: Длительность аренды в секундах
+            horizon: Готовим снимки для рассылок, запуск которых не позже этого времени (ISO)
+        """
+        now_str = datetime.now().isoformat(timespec='seconds')
+        expires_str = (datetime.now() + timedelta(seconds=lease_seconds)).isoformat(timespec='seconds')
+        
+        conn = self.get_connection()
+        conn.isolation_level = None
+        cursor = conn.cursor()
+        try:
+            cursor.execute('BEGIN IMMEDIATE')
+            cursor.execute('''
+                SELECT * FROM broadcasts
+                WHERE is_scheduled = 1 AND next_fire_at <= ?
+                AND snapshot_path IS NULL
+                AND (lease_owner IS NULL OR lease_expires_at < ?)
+                ORDER BY next_fire_at ASC
+                LIMIT 1
+            ''', (horizon, now_str))
+            row = cursor.fetchone()
+            
+            if row:
+                cursor.execute('''
+                    UPDATE broadcasts SET lease_owner = ?, lease_expires_at = ?
+                    WHERE id = ?
+                ''', (owner_id, expires_str, row['id']))
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        
+        return dict(row) if row else None
+    
+    def set_broadcast_snapshot(self, broadcast_id: int, owner_id: str,
+                               snapshot_path: Optional[str], snapshot_at: Optional[str],
+                               release_lease: bool = True) -> bool:
+        """
+        Сохранить снимок аудитории рассылки и сбросить контрольную точку
+        
+        Args:
+            snapshot_at: Момент среза снимка (UTC, 'YYYY-MM-DD HH:MM:SS')
+            release_lease: Освободить аренду (снимок подготовлен заранее)
+                или сохранить её (снимок создан перед самой отправкой)
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if release_lease:
+            cursor.execute('''
+                UPDATE broadcasts
+                SET snapshot_path = ?, snapshot_at = ?, snapshot_offset = 0,
+                    snapshot_last_user_id = NULL,
+                    lease_owner = NULL, lease_expires_at = NULL
+                WHERE id = ? AND lease_owner = ?
+            ''', (snapshot_path, snapshot_at, broadcast_id, owner_id))
+        else:
+            cursor.execute('''
+                UPDATE broadcasts
+                SET snapshot_path = ?, snapshot_at = ?, snapshot_offset = 0,
+                    snapshot_last_user_id = NULL
+                WHERE id = ? AND lease_owner = ?
+            ''', (snapshot_path, snapshot_at, broadcast_id, owner_id))
+        updated = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return updated
+    
+    def renew_broadcast_lease(self, broadcast_id: int, owner_id: str, lease_seconds: int,
+                              progress: Optional[Dict] = None) -> bool:
+        """
+        Продлить аренду рассылки (heartbeat)
+        
+        Args:
+            progress: Контрольная точка отправки ({'offset', 'last_user_id', 'sent', 'failed'}),
+                сохраняется вместе с продлением аренды
+        
+        Returns:
+            True если аренда продлена, False если рассылка уже принадлежит другому экземпляру
+        """
+        expires_str = (datetime.now() + timedelta(seconds=lease_seconds)).isoformat(timespec='seconds')
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if progress:
+            cursor.execute('''
+                UPDATE broadcasts
+                SET lease_expires_at = ?, snapshot_offset = ?, snapshot_last_user_id = ?,
+                    sent_count = ?, failed_count = ?
+                WHERE id = ? AND lease_owner = ? AND is_scheduled = 1
+            ''', (expires_str, progress['offset'], progress['last_user_id'],
+                  progress['sent'], progress['failed'], broadcast_id, owner_id))
+        else:
+            cursor.execute('''
+                UPDATE broadcasts SET lease_expires_at = ?
+                WHERE id = ? AND lease_owner = ? AND is_scheduled = 1
+            ''', (expires_str, broadcast_id, owner_id))
+        renewed = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return renewed
+    
+    def complete_scheduled_broadcast(self, broadcast_id: int, owner_id: str,
+                                     sent_count: int, failed_count: int,
+                                     next_fire_at: Optional[str] = None) -> bool:
+        """
+        Отметить запуск отложенной рассылки выполненным и освободить аренду
+        
+        Для повторяющейся рассылки (передан next_fire_at) результат запуска
+        сохраняется отдельной записью в истории (scheduled_at - время этого
+        запуска, в том же формате, что у однократных рассылок), а сама рассылка
+        остается запланированной со сдвинутым временем следующего запуска.
+        Ссылки кнопок запуска переходят к записи в истории вместе с переходами.
+        
+        Returns:
+            True если рассылка завершена этим экземпляром
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        
+        if next_fire_at:
+            cursor.execute('''
+                INSERT INTO broadcasts (admin_id, message_text, sent_count, failed_count,
+                                        scheduled_at, is_scheduled, segment_type)
+                SELECT admin_id, message_text, ?, ?, next_fire_at, 0, segment_type
+                FROM broadcasts WHERE id = ? AND lease_owner = ?
+            ''', (sent_count, failed_count, broadcast_id, owner_id))
+            completed = cursor.rowcount > 0
+            if completed:
+                cursor.execute(
+                    'UPDATE broadcast_links SET broadcast_id = ? WHERE broadcast_id = ?',
+                    (cursor.lastrowid, broadcast_id)
+                )
+                cursor.execute('''
+                    UPDATE broadcasts
+                    SET next_fire_at = ?, lease_owner = NULL, lease_expires_at = NULL,
+                        sent_count = 0, failed_count = 0, attempts = 0,
+                        snapshot_path = NULL, snapshot_offset = 0,
+                        snapshot_at = NULL, snapshot_last_user_id = NULL
+                    WHERE id = ?
+                ''', (next_fire_at, broadcast_id))
+        else:
+            cursor.execute('''
+                UPDATE broadcasts
+                SET is_scheduled = 0, sent_count = ?, failed_count = ?,
+                    lease_owner = NULL, lease_expires_at = NULL,
+                    snapshot_path = NULL, attempts = 0
+                WHERE id = ? AND lease_owner = ?
+            ''', (sent_count, failed_count, broadcast_id, owner_id))
+            completed = cursor.rowcount > 0
+        
+        conn.commit()
+        conn.close()
+        return completed
+    
+    def fail_scheduled_broadcast(self, broadcast_id: int, owner_id: str, progress: Dict) -> bool:
+        """
+        Отметить отложенную рассылку невыполненной: она снимается с расписания
+        и попадает в историю с тем, что успело отправиться
+        
+        Args:
+            progress: Контрольная точка отправки ({'offset', 'sent', 'failed'})
+        
+        Returns:
+            True если рассылка отмечена этим экземпляром
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE broadcasts
+            SET is_scheduled = 0, failed_at = CURRENT_TIMESTAMP,
+                sent_count = ?, failed_count = ?,
+                lease_owner = NULL, lease_expires_at = NULL,
+                snapshot_path = NULL
+            WHERE id = ? AND lease_owner = ?
+        ''', (progress['sent'], progress['failed'], broadcast_id, owner_id))
+        failed = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return failed
+    
+    def save_broadcast_progress(self, broadcast_id: int, owner_id: str, progress: Dict) -> bool:
+        """
+        Сохранить контрольную точку отправки, не продлевая аренду
+        
+        Args:
+            progress: Контрольная точка отправки ({'offset', 'last_user_id', 'sent', 'failed'})
+        
+        Returns:
+            True если сохранено, False если рассылка уже принадлежит другому экземпляру
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE broadcasts
+            SET snapshot_offset = ?, snapshot_last_user_id = ?, sent_count = ?, failed_count = ?
+            WHERE id = ? AND lease_owner = ? AND is_scheduled = 1
+        ''', (progress['offset'], progress['last_user_id'], progress['sent'], progress['failed'],
+              broadcast_id, owner_id))
+        saved = cursor.rowcount > 0
+        conn.commit()
+        conn.close()
+        return saved
+    
+    def release_broadcast_lease(self, broadcast_id: int, owner_id: str,
+                                progress: Optional[Dict] = None):
+        """
+        Освободить аренду рассылки, не завершая её (например, при остановке бота)
+        
+        Остановка бота не считается неудачной попыткой отправки.
+        
+        Args:
+            progress: Контрольная точка отправки, с которой продолжит другой экземпляр
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if progress:
+            cursor.execute('''
+                UPDATE broadcasts
+                SET lease_owner = NULL, lease_expires_at = NULL,
+                    attempts = MAX(COALESCE(attempts, 0) - 1, 0),
+                    snapshot_offset = ?, snapshot_last_user_id = ?,
+                    sent_count = ?, failed_count = ?
+                WHERE id = ? AND lease_owner = ?
+            ''', (progress['offset'], progress['last_user_id'], progress['sent'], progress['failed'],
+                  broadcast_id, owner_id))
+        else:
+            cursor.execute('''
+                UPDATE broadcasts
+                SET lease_owner = NULL, lease_expires_at = NULL,
+                    attempts = MAX(COALESCE(attempts, 0) - 1, 0)
+                WHERE id = ? AND lease_owner = ?
+            ''', (broadcast_id, owner_id))
+        conn.commit()
+        conn.close()
+    
+    def get_fsm_record(self, storage_key: str, min_updated_at: float) -> Optional[Dict]:
+        """
+        Получить состояние и данные FSM
+        
+        Args:
+            storage_key: Ключ хранилища
+            min_updated_at: Записи, обновленные раньше (unix time), считаются истекшими
+        
+        Returns:
+            Словарь с ключами 'state' и 'data' (данные в JSON) или None
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT state, data FROM fsm_storage
+            WHERE storage_key = ? AND updated_at >= ?
+        ''', (storage_key, min_updated_at))
+        row = cursor.fetchone()
+        conn.close()
+        
+        if not row:
+            return None
+        return {'state': row['state'], 'data': row['data']}
+    
+    def save_fsm_records(self, records: List[tuple]):
+        """
+        Сохранить пачку записей FSM одной транзакцией
+        
+        Args:
+            records: Список (storage_key, state, data_json, updated_at).
+                Записи без состояния и данных удаляются.
+        """
+        to_save = [record for record in records if record[1] is not None or record[2] is not None]
+        to_delete = [(record[0],) for record in records if record[1] is None and record[2] is None]
+        
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if to_save:
+            cursor.executemany('''
+                INSERT INTO fsm_storage (storage_key, state, data, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(storage_key) DO UPDATE SET
+                    state = excluded.state,
+                    data = excluded.data,
+                    updated_at = excluded.updated_at
+            ''', to_save)
+        if to_delete:
+            cursor.executemany('DELETE FROM fsm_storage WHERE storage_key = ?', to_delete)
+        conn.commit()
+        conn.close()
+    
+    def purge_fsm_records(self, older_than: float) -> int:
+        """Удалить записи FSM, не обновлявшиеся с момента older_than (unix time)"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM fsm_storage WHERE updated_at < ?', (older_than,))
+        deleted = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return deleted
+    
     def get_detailed_stats(self) -> Dict:
         """Получить детальную статистику"""
         conn = self.get_connection()
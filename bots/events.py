@@ -0,0 +1,157 @@
+"""
+События воронки: /start -> открытие мини-приложения -> переход по ссылке
+
+Обработчики не пишут событие в базу сами: EventLog складывает его
+в кольцевой буфер в памяти, а фоновая задача сохраняет накопленное
+пачками (одна транзакция на пачку) в таблицу events. Запись идет в отдельном
+потоке, чтобы занятая база не задерживала цикл событий. Если база недоступна
+и буфер переполнился, вытесняются самые старые события - память
+ограничена размером буфера, обработчики никогда не ждут запись.
+
+Счетчики воронки (funnel_users, funnel_daily) обновляются триггерами
+при добавлении событий, поэтому /funnel в admin_bot читает готовые
+суммы по дням и кампаниям, а не сырые события.
+"""
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Шаги воронки по порядку: событие -> название
+FUNNEL_STEPS = {
+    'start': '🚀 /start',
+    'webapp_open': '📱 Открыли мини-приложение',
+    'link_click': '🔗 Перешли по ссылке',
+}
+
+
+class EventLog:
+    """Кольцевой буфер событий с пакетным сохранением в базу"""
+    
+    def __init__(self, db: Database, capacity: int = 10000,
+                 batch_size: int = 500, flush_interval: float = 5.0):
+        """
+        Args:
+            db: База данных
+            capacity: Максимум событий в буфере (старые вытесняются)
+            batch_size: Сохранять сразу, как только накопилось столько событий
+            flush_interval: Интервал сохранения остальных событий (секунды)
+        """
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._buffer: Deque[Tuple] = deque(maxlen=capacity)
+        self.dropped = 0
+        # Счетчик потерянных событий меняют и цикл событий (record),
+        # и поток сохранения (_flush) - только под этой блокировкой
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    def record(self, user_id: int, event: str, start_param: Optional[str] = None,
+               payload: Optional[Dict[str, Any]] = None):
+        """Добавить событие в буфер (не обращается к базе)"""
+        if len(self._buffer) == self._buffer.maxlen:
+            with self._lock:
+                self.dropped += 1
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        self._buffer.append((
+            user_id, event, start_param,
+            json.dumps(payload, ensure_ascii=False) if payload else None,
+            created_at
+        ))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+    
+    def start(self):
+        """Запустить фоновое сохранение событий"""
+        self._task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        """Остановить сохранение и сохранить накопленное"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+    
+    async def run(self):
+        while True:
+            # asyncio.wait, а не wait_for: wait_for может потерять отмену задачи,
+            # если буфер заполнился в тот же момент (тогда stop зависнет)
+            waiter = asyncio.ensure_future(self._wakeup.wait())
+            try:
+                await asyncio.wait((waiter,), timeout=self.flush_interval)
+            finally:
+                waiter.cancel()
+            self._wakeup.clear()
+            await asyncio.to_thread(self.flush)
+    
+    def flush(self):
+        """Сохранить события из буфера пачками (блокирующий вызов)"""
+        # Блокировка: сохранение из потока run и из stop не делят одну пачку
+        with self._flush_lock:
+            self._flush()
+    
+    def _flush(self):
+        # Забираем счетчик целиком: потерянные во время записи попадут в следующий раз
+        with self._lock:
+            dropped, self.dropped = self.dropped, 0
+        if dropped:
+            logger.warning(f"Буфер событий переполнен, потеряно событий: {dropped}")
+            try:
+                self.db.increment_counters({'events_dropped': dropped})
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении счетчика потерянных событий: {e}")
+                with self._lock:
+                    self.dropped += dropped
+        
+        while self._buffer:
+            batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+            try:
+                self.db.insert_events(batch)
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении событий: {e}")
+                # Возвращаем пачку в начало буфера (при переполнении вытеснятся самые новые)
+                self._buffer.extendleft(reversed(batch))
+                return
+
+
+def render_funnel(totals: Dict[str, Dict], campaigns: list, days: int) -> str:
+    """Воронка в виде сообщения (parse_mode=HTML)"""
+    steps = list(FUNNEL_STEPS)
+    first = totals[steps[0]]['users']
+    text = (
+        f"🔻 <b>Воронка за {days} дн.</b>\n"
+        "<i>Пользователи, зарегистрированные за период, дошедшие до шага</i>\n\n"
+    )
+    
+    previous = None
+    for step, title in FUNNEL_STEPS.items():
+        users = totals[step]['users']
+        line = f"{title}: <b>{users}</b>"
+        if first and step != steps[0]:
+            line += f" ({users / first * 100:.1f}% от старта"
+            if previous:
+                line += f", {users / previous * 100:.1f}% от прошлого шага"
+            line += ")"
+        text += line + f"\n   событий: {totals[step]['events']}\n"
+        previous = users
+    
+    if campaigns:
+        text += "\n🔑 <b>По кампаниям:</b>\n"
+        for campaign in campaigns:
+            counts = " → ".join(str(campaign[step]) for step in steps)
+            text += f"• <code>{campaign['start_param']}</code>: {counts}\n"
+    return text
@@ -0,0 +1,132 @@
+"""
+Потоковая выгрузка данных в файл (CSV или JSON Lines, сжатые gzip)
+
+Строки читаются из базы пачками (Database.iter_export_batches) и сразу
+пишутся через gzip во временный файл на диске. При отправке в Telegram
+файл читается кусками (ExportFile), поэтому память не зависит от
+количества пользователей. Файл готовится в пуле процессов отчетов
+(reports.py) - между процессами передается только путь к нему.
+"""
+import csv
+import gzip
+import io
+import json
+import logging
+import os
+import tempfile
+from datetime import datetime
+from typing import AsyncGenerator, Tuple
+
+from aiogram.types import InputFile
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+# Названия наборов данных для выгрузки
+EXPORT_DATASETS = {
+    'users': '👥 Пользователи',
+    'broadcasts': '📢 Рассылки',
+    'registrations': '📅 Регистрации по дням',
+    'campaigns': '🔗 Кампании',
+    'campaign_days': '📈 Активность кампаний по дням',
+}
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Строк в одной пачке чтения из базы
+EXPORT_BATCH_SIZE = 5000
+
+
+class ExportFile(InputFile):
+    """
+    Файл выгрузки для отправки в Telegram
+    
+    Файл открывается сразу при создании: если одну выгрузку ждут несколько
+    администраторов, каждый читает свою открытую копию, и удаление файла
+    (close) одним из них не мешает отправке у других.
+    """
+    
+    def __init__(self, path: str, filename: str, **kwargs):
+        super().__init__(filename=filename, **kwargs)
+        self.path = path
+        self.file = open(path, 'rb')
+    
+    async def read(self, bot) -> AsyncGenerator[bytes, None]:
+        self.file.seek(0)
+        while chunk := self.file.read(self.chunk_size):
+            yield chunk
+    
+    def close(self):
+        """Закрыть и удалить файл выгрузки"""
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def write_export(db: Database, dataset: str, export_format: str, buffer) -> int:
+    """
+    Записать набор данных в buffer в виде gzip-сжатого CSV или JSON Lines
+    
+    Returns:
+        Количество выгруженных строк
+    """
+    count = 0
+    # mtime=0 - одинаковые данные дают одинаковый архив
+    with gzip.GzipFile(fileobj=buffer, mode='wb', compresslevel=6, mtime=0) as gz:
+        # utf-8-sig: Excel открывает CSV с кириллицей без ручного выбора кодировки
+        encoding = 'utf-8-sig' if export_format == 'csv' else 'utf-8'
+        with io.TextIOWrapper(gz, encoding=encoding, newline='') as text:
+            writer = csv.writer(text) if export_format == 'csv' else None
+            
+            for columns, rows in db.iter_export_batches(dataset, EXPORT_BATCH_SIZE):
+                if writer is not None:
+                    if count == 0:
+                        writer.writerow(columns)
+                    writer.writerows(rows)
+                else:
+                    text.writelines(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False, separators=(',', ':')) + '\n'
+                        for row in rows
+                    )
+                count += len(rows)
+    
+    return count
+
+
+def build_export(db: Database, dataset: str, export_format: str) -> Tuple[str, str, int]:
+    """
+    Записать выгрузку во временный файл (выполняется в пуле процессов)
+    
+    Returns:
+        (путь к файлу, имя файла для отправки, количество строк)
+    
+    Raises:
+        ValueError: неизвестный набор данных или формат
+    """
+    if dataset not in EXPORT_DATASETS:
+        raise ValueError(f"Неизвестный набор данных: {dataset}")
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат: {export_format}")
+    
+    fd, path = tempfile.mkstemp(prefix=f"export_{dataset}_", suffix='.gz')
+    try:
+        with os.fdopen(fd, 'wb') as buffer:
+            count = write_export(db, dataset, export_format, buffer)
+    except BaseException:
+        os.remove(path)
+        raise
+    
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M')}.{export_format}.gz"
+    logger.info(f"Подготовлена выгрузка {filename}: {count} строк, {os.path.getsize(path)} байт")
+    return path, filename, count
+
+
+def discard_export(result: Tuple[str, str, int]):
+    """Удалить файл выгрузки, которую уже не ждут (ReportRunner.run(discard=...))"""
+    try:
+        os.remove(result[0])
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,297 @@
+"""
+Имитация Telegram для локальной проверки ботов
+
+1. Генератор синтетических обновлений для режима webhook: отправляет
+   на webhook User Bot POST-запросы с обновлениями /start от случайных
+   пользователей (так же, как это делает Telegram) и измеряет время
+   подтверждения (ack) и пропускную способность. Дополнительно проверяет,
+   что запрос с неверным секретом отклоняется.
+
+       python fake_telegram.py --url http://127.0.0.1:8081/tg/user-bot --count 5000
+
+   Внимание: бот будет обрабатывать обновления по-настоящему (запись в базу,
+   ответы пользователям через Bot API), поэтому запускайте его с тестовой
+   базой (DATABASE_FILE) и тестовым токеном.
+
+2. Заглушка сервера Bot API (--stub-api) для проверки работы через свой
+   сервер (TELEGRAM_API_URL): отвечает на методы Bot API без обращения
+   к Telegram, принимает фото (загрузкой или по пути file:// в режиме --local)
+   и отдает файлы (по HTTP или путем на диске в режиме --local). Боты
+   запускаются с TELEGRAM_API_URL=http://127.0.0.1:8090; при остановке
+   заглушка печатает, сколько вызовов каждого метода и загрузок получила.
+   
+       python fake_telegram.py --stub-api --port 8090 [--local]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List
+from urllib.parse import unquote, urlparse
+
+import aiohttp
+from aiohttp import web
+
+from config import WEBHOOK_SECRET
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+# Диапазон ID синтетических пользователей (не пересекается с реальными)
+FAKE_USER_ID_START = 9_000_000_000
+
+
+def make_start_update(update_id: int, user_id: int, start_param: str = None) -> Dict:
+    """Сформировать обновление с командой /start"""
+    text = f"/start {start_param}" if start_param else "/start"
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': f'Load{user_id}'},
+            'from': {
+                'id': user_id,
+                'is_bot': False,
+                'first_name': f'Load{user_id}',
+                'username': f'load_{user_id}',
+                'language_code': 'ru',
+            },
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+        },
+    }
+
+
+def percentile(values: List[float], percent: float) -> float:
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return 0.0
+    index = min(int(len(values) * percent / 100), len(values) - 1)
+    return values[index]
+
+
+async def check_bad_secret(session: aiohttp.ClientSession, url: str) -> int:
+    """Отправить обновление с неверным секретом и вернуть статус ответа"""
+    update = make_start_update(0, FAKE_USER_ID_START)
+    async with session.post(url, json=update, headers={SECRET_HEADER: 'wrong-secret'}) as response:
+        return response.status
+
+
+async def run_load(url: str, secret: str, count: int, concurrency: int, params: List[str]):
+    """Отправить count обновлений, не более concurrency одновременно"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    
+    for index in range(count):
+        user_id = FAKE_USER_ID_START + random.randint(1, count * 10)
+        queue.put_nowait(make_start_update(index + 1, user_id, random.choice(params)))
+    
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        status = await check_bad_secret(session, url)
+        if status == 401:
+            print("✅ Запрос с неверным секретом отклонен (401)")
+        else:
+            print(f"❌ Запрос с неверным секретом вернул {status}, ожидался 401")
+        
+        async def worker():
+            while True:
+                try:
+                    update = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.perf_counter()
+                try:
+                    async with session.post(url, json=update, headers={SECRET_HEADER: secret}) as response:
+                        await response.read()
+                        if response.status != 200:
+                            errors[str(response.status)] = errors.get(str(response.status), 0) + 1
+                            continue
+                except aiohttp.ClientError as e:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+        
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    
+    latencies.sort()
+    print(f"Отправлено: {count}, успешно: {len(latencies)}, за {elapsed:.2f} сек.")
+    print(f"Пропускная способность: {len(latencies) / elapsed:.0f} обновлений/сек.")
+    if latencies:
+        print(
+            "Время подтверждения (мс): "
+            f"p50={percentile(latencies, 50) * 1000:.1f} "
+            f"p95={percentile(latencies, 95) * 1000:.1f} "
+            f"p99={percentile(latencies, 99) * 1000:.1f} "
+            f"среднее={statistics.mean(latencies) * 1000:.1f}"
+        )
+    if errors:
+        print(f"Ошибки: {errors}")
+
+
+class StubBotAPI:
+    """Заглушка сервера Bot API: отвечает на методы и хранит полученные файлы"""
+    
+    # Минимальный JPEG (1x1), которым заглушка отвечает на неизвестные file_id
+    PLACEHOLDER_JPEG = bytes.fromhex(
+        'ffd8ffe000104a46494600010100000100010000ffdb004300080606070605080707070909080a0c140d0c0b0b0c19'
+        '12130f141d1a1f1e1d1a1c1c20242e2720222c231c1c2837292c30313434341f27393d38323c2e333432ffc0000b08'
+        '0001000101011100ffc4001f0000010501010101010100000000000000000102030405060708090a0bffc400b51000'
+        '02010303020403050504040000017d01020300041105122131410613516107227114328191a1082342b1c11552d1f0'
+        '2433627282090a161718191a25262728292a3435363738393a434445464748494a535455565758595a636465666768'
+        '696a737475767778797a838485868788898a92939495969798999aa2a3a4a5a6a7a8a9aab2b3b4b5b6b7b8b9bac2c3'
+        'c4c5c6c7c8c9cad2d3d4d5d6d7d8d9dae1e2e3e4e5e6e7e8e9eaf1f2f3f4f5f6f7f8f9faffda0008010100003f00fb'
+        'd3ffd9'
+    )
+    
+    def __init__(self, files_dir: str, local: bool = False):
+        """
+        Args:
+            files_dir: Каталог, где заглушка хранит файлы
+            local: Режим --local (пути на диске вместо скачивания по HTTP)
+        """
+        self.files_dir = Path(files_dir)
+        self.files_dir.mkdir(parents=True, exist_ok=True)
+        self.local = local
+        self.calls: Counter = Counter()
+        self.uploads = 0
+        self.uploaded_bytes = 0
+        self.local_files = 0
+        self._ids = itertools.count(1)
+    
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle_method)
+        app.router.add_get('/file/bot{token}/{path:.+}', self.handle_file)
+        return app
+    
+    def _file_path(self, file_id: str) -> Path:
+        return self.files_dir / f"{file_id}.jpg"
+    
+    def _message(self, chat_id: Any, **fields) -> Dict:
+        return {
+            'message_id': next(self._ids),
+            'date': int(time.time()),
+            'chat': {'id': int(chat_id), 'type': 'private'},
+            **fields,
+        }
+    
+    async def _store_photo(self, photo: Any, params: Dict) -> str:
+        """Сохранить фото из запроса и вернуть его file_id"""
+        if isinstance(photo, str) and photo.startswith('attach://'):
+            photo = params[photo[len('attach://'):]]
+        if isinstance(photo, web.FileField):
+            data = photo.file.read()
+            self.uploads += 1
+            self.uploaded_bytes += len(data)
+        elif str(photo).startswith('file://'):
+            # Режим --local: файл читается с диска, а не передается в запросе
+            data = Path(unquote(urlparse(str(photo)).path)).read_bytes()
+            self.local_files += 1
+        else:
+            return str(photo)
+        
+        file_id = f"stub-photo-{next(self._ids)}"
+        self._file_path(file_id).write_bytes(data)
+        return file_id
+    
+    async def handle_method(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        result = await self.call(method, params)
+        return web.json_response({'ok': True, 'result': result})
+    
+    async def call(self, method: str, params: Dict) -> Any:
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+        if method == 'getUpdates':
+            await asyncio.sleep(min(float(params.get('timeout') or 0), 1))
+            return []
+        if method == 'getFile':
+            file_id = params['file_id']
+            path = self._file_path(file_id)
+            if not path.exists():
+                path.write_bytes(self.PLACEHOLDER_JPEG)
+            file_path = str(path.resolve()) if self.local else path.name
+            return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': path.stat().st_size,
+                    'file_path': file_path}
+        if method == 'sendPhoto':
+            file_id = await self._store_photo(params['photo'], params)
+            return self._message(params['chat_id'], caption=params.get('caption'), photo=[
+                {'file_id': file_id, 'file_unique_id': file_id, 'width': 1, 'height': 1}
+            ])
+        if method.startswith(('send', 'edit', 'copy')):
+            return self._message(params.get('chat_id', 0), text=params.get('text', ''))
+        if method == 'getWebhookInfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        return True
+    
+    async def handle_file(self, request: web.Request) -> web.StreamResponse:
+        self.calls['file download'] += 1
+        path = self.files_dir / Path(request.match_info['path']).name
+        if not path.exists():
+            raise web.HTTPNotFound()
+        return web.FileResponse(path)
+    
+    def summary(self) -> str:
+        lines = [f"{method}: {count}" for method, count in self.calls.most_common()]
+        lines.append(f"Загружено фото по HTTP: {self.uploads} ({self.uploaded_bytes} байт)")
+        lines.append(f"Фото по пути file://: {self.local_files}")
+        return "\n".join(lines)
+
+
+async def serve_stub_api(host: str, port: int, files_dir: str, local: bool):
+    """Запустить заглушку Bot API и работать до Ctrl+C"""
+    stub = StubBotAPI(files_dir, local=local)
+    runner = web.AppRunner(stub.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    mode = " (--local)" if local else ""
+    print(f"Заглушка Bot API{mode}: http://{host}:{port}, файлы в {files_dir}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        print(stub.summary())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетическая нагрузка на webhook User Bot и заглушка Bot API")
+    parser.add_argument('--url', default='http://127.0.0.1:8081/tg/user-bot', help="Адрес webhook")
+    parser.add_argument('--secret', default=WEBHOOK_SECRET, help="Секрет (по умолчанию WEBHOOK_SECRET)")
+    parser.add_argument('--count', type=int, default=1000, help="Количество обновлений")
+    parser.add_argument('--concurrency', type=int, default=100, help="Одновременных запросов")
+    parser.add_argument('--params', default=',instagram,vk,site',
+                        help="Start параметры через запятую (пустой - без параметра)")
+    parser.add_argument('--stub-api', action='store_true', help="Запустить заглушку сервера Bot API")
+    parser.add_argument('--host', default='127.0.0.1', help="Адрес заглушки Bot API")
+    parser.add_argument('--port', type=int, default=8090, help="Порт заглушки Bot API")
+    parser.add_argument('--local', action='store_true', help="Заглушка в режиме --local")
+    parser.add_argument('--files-dir', default=os.path.join(tempfile.gettempdir(), 'stub-bot-api'),
+                        help="Каталог файлов заглушки")
+    args = parser.parse_args()
+    
+    if args.stub_api:
+        try:
+            asyncio.run(serve_stub_api(args.host, args.port, args.files_dir, args.local))
+        except KeyboardInterrupt:
+            pass
+        return
+    
+    params = [param or None for param in args.params.split(',')]
+    asyncio.run(run_load(args.url, args.secret, args.count, args.concurrency, params))
+
+
+if __name__ == "__main__":
+    main()
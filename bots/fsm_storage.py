@@ -0,0 +1,139 @@
+"""
+Хранилище FSM в SQLite
+
+Заменяет MemoryStorage в admin_bot: черновики рассылок, шаблонов и
+отложенных рассылок переживают перезапуск бота и доступны другим
+экземплярам, работающим с той же базой.
+
+Запись отложенная: изменения копятся в памяти и сбрасываются в базу
+одной транзакцией раз в flush_interval секунд, поэтому цепочка
+update_data/set_state в одном обработчике дает одну запись, а не несколько.
+Несохраненные изменения своего процесса читаются из памяти, остальные -
+из базы. Записи, не обновлявшиеся дольше ttl, считаются брошенными:
+они не читаются и периодически удаляются (purge_expired).
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM хранилище в таблице fsm_storage с пакетной записью"""
+    
+    def __init__(self, db: Database, ttl_seconds: float, flush_interval: float = 1.0,
+                 key_builder: Optional[KeyBuilder] = None):
+        """
+        Args:
+            db: База данных
+            ttl_seconds: Время жизни неактивной записи (брошенного черновика)
+            flush_interval: Интервал сброса накопленных изменений в базу (секунды)
+            key_builder: Построитель ключей (по умолчанию с ID бота и destiny)
+        """
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.flush_interval = flush_interval
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        
+        # Несохраненные записи: ключ -> (состояние, данные в JSON, время изменения)
+        self._pending: Dict[str, Tuple[Optional[str], Optional[str], float]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    async def _get_record(self, key: str) -> Tuple[Optional[str], Optional[str]]:
+        """Текущее состояние и данные (JSON) по ключу"""
+        if key in self._pending:
+            state, data, _ = self._pending[key]
+            return state, data
+        
+        record = self.db.get_fsm_record(key, time.time() - self.ttl_seconds)
+        if not record:
+            return None, None
+        return record['state'], record['data']
+    
+    def _put(self, key: str, state: Optional[str], data: Optional[str]):
+        """Запомнить изменение и запланировать сброс в базу"""
+        self._pending[key] = (state, data, time.time())
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.run())
+        self._wakeup.set()
+    
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data = await self._get_record(storage_key)
+        state_name = state.state if isinstance(state, State) else state
+        self._put(storage_key, state_name, data)
+    
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get_record(self.key_builder.build(key))
+        return state
+    
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _ = await self._get_record(storage_key)
+        # Сериализуем сразу: ошибка несериализуемых данных всплывет в обработчике,
+        # а изменение исходного словаря не затронет сохраненную копию
+        data_json = json.dumps(data, ensure_ascii=False) if data else None
+        self._put(storage_key, state, data_json)
+    
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get_record(self.key_builder.build(key))
+        return json.loads(data) if data else {}
+    
+    async def run(self):
+        """Фоновый сброс изменений: ждем первое изменение, копим flush_interval, пишем"""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """Записать накопленные изменения одной транзакцией"""
+        self._wakeup.clear()
+        if not self._pending:
+            return
+        
+        pending = self._pending
+        self._pending = {}
+        records = [
+            (key, state, data, updated_at)
+            for key, (state, data, updated_at) in pending.items()
+        ]
+        
+        try:
+            self.db.save_fsm_records(records)
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении состояний FSM: {e}")
+            # Возвращаем несохраненное, не затирая более свежие изменения
+            for key, record in pending.items():
+                self._pending.setdefault(key, record)
+            self._wakeup.set()
+            return
+        
+        logger.debug(f"Сохранено состояний FSM: {len(records)}")
+    
+    def purge_expired(self) -> int:
+        """Удалить брошенные записи (старше ttl)"""
+        deleted = self.db.purge_fsm_records(time.time() - self.ttl_seconds)
+        if deleted:
+            logger.info(f"Удалено брошенных черновиков FSM: {deleted}")
+        return deleted
+    
+    async def close(self) -> None:
+        """Остановить фоновую запись и сохранить накопленное"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
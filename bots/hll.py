@@ -0,0 +1,91 @@
+"""
+HyperLogLog - приближенный подсчет уникальных значений
+
+Скетч хранит 2^PRECISION регистров по одному байту (16 КБ при PRECISION=14)
+независимо от количества добавленных пользователей; стандартная ошибка
+оценки 1.04 / sqrt(2^PRECISION) ~ 0.8%. Скетчи объединяются поэлементным
+максимумом регистров: объединение дневных скетчей дает число уникальных
+пользователей за любой период (неделя, месяц) без хранения самих ID.
+Объединение идемпотентно - повторное слияние того же скетча ничего
+не меняет.
+
+В базе скетч хранится сжатым zlib (to_bytes/from_bytes): в дни с небольшим
+числом пользователей большинство регистров нулевые и сжимаются почти полностью.
+"""
+import hashlib
+import math
+import zlib
+from typing import Optional
+
+# Количество бит хеша на номер регистра; менять нельзя - сохраненные
+# скетчи с другой точностью не объединяются
+PRECISION = 14
+REGISTERS = 1 << PRECISION
+HASH_BITS = 64
+
+# Поправочный коэффициент оценки (Flajolet et al., 2007)
+ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+# 2^-r для всех возможных значений регистра
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(HASH_BITS - PRECISION + 2)]
+
+
+def _hash(value: int) -> int:
+    """64-битный хеш ID пользователя"""
+    digest = hashlib.blake2b(value.to_bytes(8, 'little', signed=True), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class HyperLogLog:
+    """Скетч для подсчета уникальных ID"""
+    
+    __slots__ = ('registers',)
+    
+    def __init__(self, registers: Optional[bytearray] = None):
+        self.registers = registers if registers is not None else bytearray(REGISTERS)
+    
+    def add(self, value: int):
+        """Добавить ID"""
+        hashed = _hash(value)
+        index = hashed >> (HASH_BITS - PRECISION)
+        rest = hashed & ((1 << (HASH_BITS - PRECISION)) - 1)
+        # Позиция первой единицы в оставшихся битах
+        rank = HASH_BITS - PRECISION - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+    
+    def merge(self, other: 'HyperLogLog'):
+        """Объединить со скетчем other (результат - в self)"""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+    
+    def count(self) -> int:
+        """Оценка количества уникальных ID"""
+        registers = self.registers
+        estimate = ALPHA * REGISTERS * REGISTERS / sum(_INVERSE_POWERS[rank] for rank in registers)
+        
+        # Малые значения: линейный подсчет по пустым регистрам точнее
+        if estimate <= 2.5 * REGISTERS:
+            zeros = registers.count(0)
+            if zeros:
+                estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+    
+    def to_bytes(self) -> bytes:
+        """Сжатые регистры для хранения в базе"""
+        return zlib.compress(bytes(self.registers), 6)
+    
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'HyperLogLog':
+        """
+        Восстановить скетч из to_bytes
+        
+        Raises:
+            ValueError: данные повреждены или другой точности
+        """
+        try:
+            registers = bytearray(zlib.decompress(data))
+        except zlib.error as e:
+            raise ValueError(f"Поврежденный скетч: {e}")
+        if len(registers) != REGISTERS:
+            raise ValueError(f"Скетч другой точности: {len(registers)} регистров вместо {REGISTERS}")
+        return cls(registers)
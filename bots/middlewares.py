@@ -0,0 +1,166 @@
+"""
+Middleware для User Bot
+
+ThrottlingMiddleware - защита от флуда: для каждого пользователя хранится
+корзина токенов (token bucket). Каждое обновление тратит один токен,
+токены восстанавливаются со скоростью rate в секунду до burst. Если
+токенов нет, обновление отбрасывается до обработчиков и базы данных;
+пользователь получает одно предупреждение на серию отброшенных сообщений.
+
+Корзины хранятся в OrderedDict с вытеснением давно неактивных
+пользователей (LRU), поэтому память ограничена max_users записями.
+
+Корзины свои у каждого процесса. В режиме webhook с несколькими воркерами
+(WEBHOOK_WORKERS) обновления одного пользователя расходятся по всем
+воркерам (SO_REUSEPORT), и без поправки лимит вырос бы во столько же раз.
+Поэтому воркер делит rate и burst на число воркеров (split_between_workers).
+Лимит получается приблизительным: если обновления пользователя приходят
+в один воркер, он строже заданного, а по всем воркерам скорость равна
+заданной (burst округляется вверх, чтобы в каждом был хотя бы один токен).
+Счетчики пропущенных и отброшенных обновлений периодически добавляются
+в таблицу counters (их видно в /stats admin_bot).
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_WARNING_TEXT = "⏳ Слишком много сообщений. Подождите немного и попробуйте снова."
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Ограничение частоты обновлений от одного пользователя"""
+    
+    def __init__(self, db: Database, rate: float = 1.0, burst: int = 5,
+                 max_users: int = 100000, flush_interval: float = 60.0):
+        """
+        Args:
+            db: База данных (для сохранения счетчиков)
+            rate: Скорость восстановления токенов (обновлений в секунду)
+            burst: Максимум токенов (сколько сообщений подряд можно отправить)
+            max_users: Максимум отслеживаемых пользователей
+            flush_interval: Интервал сохранения счетчиков в базу (секунды)
+        """
+        self.db = db
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.flush_interval = flush_interval
+        
+        # user_id -> [токены, время последнего обновления, предупрежден ли]
+        self._buckets: OrderedDict = OrderedDict()
+        # Счетчики с момента запуска и еще не сохраненные в базу
+        self.stats: Counter = Counter()
+        self._unflushed: Counter = Counter()
+        self._task: Optional[asyncio.Task] = None
+    
+    def split_between_workers(self, workers: int):
+        """Разделить лимит между процессами webhook (вызывать один раз при запуске воркера)"""
+        if workers > 1:
+            self.rate /= workers
+            self.burst = max(1, math.ceil(self.burst / workers))
+    
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+        
+        if self._take_token(user.id):
+            self._count('throttle_passed')
+            return await handler(event, data)
+        
+        self._count('throttle_dropped')
+        bucket = self._buckets[user.id]
+        if not bucket[2]:
+            bucket[2] = True
+            self._count('throttle_warned')
+            await self._warn(event)
+        return None
+    
+    def _take_token(self, user_id: int) -> bool:
+        """Потратить токен пользователя; False, если токенов нет"""
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        
+        if bucket is None:
+            bucket = [float(self.burst), now, False]
+            self._buckets[user_id] = bucket
+            if len(self._buckets) > self.max_users:
+                self._buckets.popitem(last=False)
+                self._count('throttle_evicted')
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket[0] = min(float(self.burst), bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True
+        return False
+    
+    async def _warn(self, event: TelegramObject):
+        """Одно предупреждение на серию отброшенных обновлений"""
+        if not isinstance(event, Update):
+            return
+        
+        try:
+            if event.message:
+                await event.message.answer(THROTTLE_WARNING_TEXT)
+            elif event.callback_query:
+                await event.callback_query.answer(THROTTLE_WARNING_TEXT)
+        except Exception as e:
+            logger.debug(f"Не удалось отправить предупреждение о флуде: {e}")
+    
+    def _count(self, name: str):
+        self.stats[name] += 1
+        self._unflushed[name] += 1
+    
+    def start(self):
+        """Запустить периодическое сохранение счетчиков"""
+        self._task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        """Остановить сохранение счетчиков и сохранить накопленное"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.flush()
+    
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            self.flush()
+    
+    def flush(self):
+        """Добавить накопленные счетчики в таблицу counters"""
+        if not self._unflushed:
+            return
+        
+        deltas, self._unflushed = self._unflushed, Counter()
+        try:
+            self.db.increment_counters(dict(deltas))
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении счетчиков антифлуда: {e}")
+            self._unflushed.update(deltas)
+            return
+        
+        if deltas.get('throttle_dropped'):
+            logger.info(
+                f"Антифлуд: отброшено {deltas['throttle_dropped']} обновлений "
+                f"(отслеживается пользователей: {len(self._buckets)})"
+            )
@@ -2,17 +2,29 @@
 """
 Скрипт для миграции базы данных
 Выполняет обновление схемы БД, добавляя недостающие колонки
+
+Использование:
+    python migrate_db.py                      - обновить схему
+    python migrate_db.py import users.csv     - импортировать пользователей
+                                                (CSV или JSON Lines, можно .gz)
 """
+import argparse
+import csv
+import gzip
+import io
+import json
 import sys
 import os
+import time
 from pathlib import Path
+from typing import Dict, Iterator
 
 # Добавляем путь к модулям
 sys.path.insert(0, str(Path(__file__).parent))
 
 from database import Database
 
-def main():
+def migrate() -> int:
     """Выполнить миграцию базы данных"""
     print("🔄 Запуск миграции базы данных...")
     
@@ -33,7 +45,12 @@ def main():
         
         # Проверяем наличие нужных колонок
         column_names = [col[1] for col in columns]
-        required_columns = ['scheduled_at', 'is_scheduled', 'segment_type']
+        required_columns = [
+            'scheduled_at', 'is_scheduled', 'segment_type',
+            'lease_owner', 'lease_expires_at', 'attempts', 'failed_at',
+            'recurrence', 'next_fire_at', 'snapshot_path', 'snapshot_offset',
+            'snapshot_at', 'snapshot_last_user_id'
+        ]
         
         print("\n✅ Проверка обязательных колонок:")
         for col_name in required_columns:
@@ -53,6 +70,84 @@ def main():
         traceback.print_exc()
         return 1
 
+def iter_import_rows(path: str, file_format: str) -> Iterator[Dict]:
+    """Потоково прочитать строки CSV или JSON Lines (файл может быть сжат gzip)"""
+    raw = gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+    # utf-8-sig: CSV из Excel и из /export начинается с BOM
+    with raw, io.TextIOWrapper(raw, encoding='utf-8-sig', newline='') as text:
+        if file_format == 'csv':
+            yield from csv.DictReader(text)
+        else:
+            for line in text:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def detect_format(path: str) -> str:
+    """Формат по расширению файла (без .gz)"""
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'jsonl' if name.endswith(('.jsonl', '.json')) else 'csv'
+
+
+def import_users(path: str, file_format: str, batch_size: int, update_existing: bool) -> int:
+    """Импортировать пользователей из файла"""
+    file_format = file_format or detect_format(path)
+    print(f"🔄 Импорт пользователей из {path} ({file_format})...")
+    
+    db = Database()
+    started = time.perf_counter()
+    
+    def report(stats: Dict[str, int]):
+        elapsed = time.perf_counter() - started
+        print(
+            f"  ... обработано {stats['rows']} строк, "
+            f"{stats['rows'] / elapsed if elapsed else 0:.0f} строк/сек."
+        )
+    
+    try:
+        stats = db.bulk_upsert_users(
+            iter_import_rows(path, file_format),
+            batch_size=batch_size,
+            update_existing=update_existing,
+            progress=report
+        )
+    except Exception as e:
+        print(f"❌ Ошибка при импорте: {e}")
+        import traceback
+        traceback.print_exc()
+        return 1
+    
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Импорт завершен за {elapsed:.1f} сек. ({stats['rows'] / elapsed if elapsed else 0:.0f} строк/сек.)")
+    print(f"  Строк в файле: {stats['rows']}")
+    print(f"  Добавлено: {stats['inserted']}")
+    if update_existing:
+        print(f"  Дополнено существующих: {stats['updated']}")
+    else:
+        print(f"  Пропущено (уже есть): {stats['skipped']}")
+    print(f"  Повторы в файле: {stats['duplicates']}")
+    print(f"  Некорректных строк (нет user_id или неверное время): {stats['invalid']}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Миграция базы данных ботов")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    import_parser = subparsers.add_parser('import', help="Импорт пользователей из CSV/JSON Lines")
+    import_parser.add_argument('path', help="Файл с пользователями (.csv, .jsonl, можно .gz)")
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'], help="Формат (по умолчанию по расширению)")
+    import_parser.add_argument('--batch-size', type=int, default=20000, help="Строк в одной транзакции")
+    import_parser.add_argument('--update', action='store_true',
+                               help="Дополнить пустые поля существующих пользователей")
+    
+    args = parser.parse_args()
+    
+    if args.command == 'import':
+        return import_users(args.path, args.format, args.batch_size, args.update)
+    return migrate()
+
+
 if __name__ == "__main__":
     sys.exit(main())
 
@@ -0,0 +1,192 @@
+"""
+Уведомления администратору о новых пользователях
+
+Уведомления не отправляются прямо из обработчика /start: они складываются
+в буфер и отправляются фоновой задачей. Если за окно накопления пришел один
+пользователь - отправляется обычное подробное уведомление, если несколько -
+одна сводка ("+137 новых пользователей..."). Окно адаптивное: при наплыве
+пользователей оно растет (до max_window), в спокойное время сокращается
+(до min_window), поэтому админ бот не упирается в лимиты Telegram.
+"""
+import asyncio
+import html
+import logging
+import time
+from collections import Counter
+from typing import Awaitable, Callable, List, Dict, Optional
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Сколько пользователей перечислять в сводке поименно
+DIGEST_SAMPLE_SIZE = 5
+# Сколько start параметров показывать в сводке
+DIGEST_TOP_PARAMS = 5
+# Ограничение числа различных start параметров в одной сводке
+MAX_TRACKED_PARAMS = 1000
+
+
+class NewUserNotifier:
+    """Агрегатор уведомлений о новых пользователях"""
+    
+    def __init__(self, send_text: Callable[[str], Awaitable[None]],
+                 get_total_users: Callable[[], int],
+                 min_window: float = 2.0, max_window: float = 60.0):
+        """
+        Args:
+            send_text: Корутина отправки HTML-сообщения администратору
+            get_total_users: Функция получения общего числа пользователей
+            min_window: Минимальное окно накопления (секунды)
+            max_window: Максимальное окно накопления (секунды)
+        """
+        self.send_text = send_text
+        self.get_total_users = get_total_users
+        self.min_window = min_window
+        self.max_window = max_window
+        self.window = min_window
+        
+        self._count = 0
+        self._samples: List[Dict] = []
+        self._params: Counter = Counter()
+        self._window_started: Optional[float] = None
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+    
+    def notify(self, user_id: int, username: Optional[str],
+               first_name: Optional[str], start_param: Optional[str]):
+        """Добавить нового пользователя в буфер (не блокирует обработчик)"""
+        if self._count == 0:
+            self._window_started = time.monotonic()
+        self._count += 1
+        
+        if len(self._samples) < DIGEST_SAMPLE_SIZE:
+            self._samples.append({
+                'user_id': user_id,
+                'username': username,
+                'first_name': first_name,
+                'start_param': start_param,
+            })
+        
+        param_key = start_param or 'без параметра'
+        if param_key in self._params or len(self._params) < MAX_TRACKED_PARAMS:
+            self._params[param_key] += 1
+        
+        self._wakeup.set()
+    
+    def start(self):
+        """Запустить фоновую отправку уведомлений"""
+        self._task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        """Остановить фоновую задачу и отправить накопленное"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def run(self):
+        """Цикл отправки: ждем первое событие, копим в течение окна, отправляем"""
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.window)
+            batch_size = self._count
+            await self.flush()
+            
+            # Адаптируем окно: при наплыве копим дольше, в тишине - отправляем быстрее
+            if batch_size > 1:
+                self.window = min(self.window * 2, self.max_window)
+            else:
+                self.window = max(self.window / 2, self.min_window)
+    
+    async def flush(self):
+        """Отправить накопленные уведомления одним сообщением"""
+        if self._count == 0:
+            self._wakeup.clear()
+            return
+        
+        count, samples, params = self._count, self._samples, self._params
+        elapsed = time.monotonic() - (self._window_started or time.monotonic())
+        self._count = 0
+        self._samples = []
+        self._params = Counter()
+        self._window_started = None
+        self._wakeup.clear()
+        
+        try:
+            total_users = self.get_total_users()
+        except Exception as e:
+            logger.error(f"Не удалось получить количество пользователей: {e}")
+            total_users = None
+        
+        if count == 1:
+            text = self.format_single(samples[0], total_users)
+        else:
+            text = self.format_digest(count, samples, params, elapsed, total_users)
+        
+        try:
+            await self.send_text(text)
+        except TelegramRetryAfter as e:
+            logger.warning(f"Лимит Telegram, повтор уведомления через {e.retry_after} сек.")
+            await asyncio.sleep(e.retry_after)
+            try:
+                await self.send_text(text)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления админу: {e}")
+                return
+        except Exception as e:
+            logger.error(f"Ошибка при отправке уведомления админу: {e}")
+            return
+        
+        logger.info(f"Уведомление отправлено админу ({count} новых пользователей)")
+    
+    @staticmethod
+    def format_single(user: Dict, total_users: Optional[int]) -> str:
+        """Подробное уведомление об одном пользователе (поля пользователя экранируются для HTML)"""
+        message_text = (
+            "🆕 <b>Новый пользователь!</b>\n\n"
+            f"👤 <b>ID:</b> {user['user_id']}\n"
+            f"📛 <b>Имя:</b> {html.escape(user['first_name'] or 'не указано')}\n"
+        )
+        
+        if user['username']:
+            message_text += f"🔗 <b>Username:</b> @{html.escape(user['username'])}\n"
+        
+        if user['start_param']:
+            message_text += f"🔑 <b>Start параметр:</b> {html.escape(user['start_param'])}\n"
+        
+        if total_users is not None:
+            message_text += f"\n📊 <b>Всего пользователей:</b> {total_users}"
+        return message_text
+    
+    @staticmethod
+    def format_digest(count: int, samples: List[Dict], params: Counter,
+                      elapsed: float, total_users: Optional[int]) -> str:
+        """Сводка о нескольких новых пользователях"""
+        if elapsed >= 60:
+            period = f"{int(elapsed // 60)} мин."
+        else:
+            period = f"{max(int(elapsed), 1)} сек."
+        
+        message_text = f"🆕 <b>+{count} новых пользователей</b> за последние {period}\n\n"
+        
+        if params:
+            message_text += "🔑 <b>Топ start параметров:</b>\n"
+            for param, param_count in params.most_common(DIGEST_TOP_PARAMS):
+                message_text += f"• {html.escape(param)}: {param_count}\n"
+            message_text += "\n"
+        
+        message_text += "👤 <b>Среди них:</b>\n"
+        for user in samples:
+            name = f"@{user['username']}" if user['username'] else (user['first_name'] or 'без имени')
+            message_text += f"• {html.escape(name)} (ID: {user['user_id']})\n"
+        if count > len(samples):
+            message_text += f"• ... и еще {count - len(samples)}\n"
+        
+        if total_users is not None:
+            message_text += f"\n📊 <b>Всего пользователей:</b> {total_users}"
+        return message_text
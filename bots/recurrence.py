@@ -0,0 +1,244 @@
+"""
+Расписания повторяющихся рассылок
+
+Поддерживаются два вида расписаний:
+- интервал: ``every:<секунды>`` (вводится как ``каждые 7d`` / ``every 12h``)
+- cron-выражение из 5 полей: ``cron:<мин> <час> <день> <месяц> <день недели>``
+
+Для каждой рассылки хранится заранее вычисленное время следующего запуска
+(``next_fire_at``), поэтому планировщику достаточно одного поиска по индексу,
+а после запуска время сдвигается функцией ``next_fire``.
+"""
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional, Set, Tuple
+
+# Единицы интервала
+INTERVAL_UNITS = {
+    'm': 60,
+    'h': 3600,
+    'd': 86400,
+    'w': 604800,
+}
+
+# Минимальный интервал, чтобы случайно не устроить рассылку раз в минуту
+MIN_INTERVAL_SECONDS = 3600
+
+# Границы полей cron: (минимум, максимум)
+CRON_FIELDS = [
+    (0, 59),   # минуты
+    (0, 23),   # часы
+    (1, 31),   # день месяца
+    (1, 12),   # месяц
+    (0, 6),    # день недели (0 - воскресенье)
+]
+
+# Максимальный горизонт поиска следующего запуска cron (4 года - покрывает 29 февраля)
+CRON_SEARCH_DAYS = 366 * 4 + 1
+
+
+def parse_interval(text: str) -> int:
+    """
+    Разобрать интервал вида ``7d``, ``12h``, ``2w``, ``90m``
+    
+    Returns:
+        Интервал в секундах
+    """
+    match = re.fullmatch(r'(\d+)\s*([mhdw])', text.strip().lower())
+    if not match:
+        raise ValueError(f"Неверный интервал: {text}")
+    
+    seconds = int(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+    if seconds < MIN_INTERVAL_SECONDS:
+        raise ValueError("Интервал должен быть не меньше 1 часа")
+    return seconds
+
+
+def _cron_number(value: str, field: str) -> int:
+    """Число из поля cron (сообщение об ошибке - для администратора)"""
+    if not value.isdigit():
+        raise ValueError(f"Неверное значение в cron: {field}")
+    return int(value)
+
+
+def _parse_cron_field(field: str, low: int, high: int) -> Set[int]:
+    """Разобрать одно поле cron (поддерживаются *, списки, диапазоны и шаги)"""
+    values = set()
+    # В поле дня недели 7 - тоже воскресенье
+    is_weekday = high == 6
+    top = 7 if is_weekday else high
+    
+    for part in field.split(','):
+        step = 1
+        if '/' in part:
+            part, step_str = part.split('/', 1)
+            step = _cron_number(step_str, field)
+            if step <= 0:
+                raise ValueError(f"Неверный шаг в cron: {field}")
+        
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start_str, end_str = part.split('-', 1)
+            start, end = _cron_number(start_str, field), _cron_number(end_str, field)
+        else:
+            start = _cron_number(part, field)
+            end = top if step > 1 else start
+        
+        if start < low or end > top or start > end:
+            raise ValueError(f"Значение вне диапазона в cron: {field}")
+        
+        values.update(range(start, end + 1, step))
+    
+    if is_weekday and 7 in values:
+        values.discard(7)
+        values.add(0)
+    return values
+
+
+def parse_cron(expression: str) -> Tuple[List[Set[int]], bool, bool]:
+    """
+    Разобрать cron-выражение из 5 полей
+    
+    День месяца и день недели считаются ограниченными, как в классическом
+    cron, только если поле не начинается с ``*``: ``*/2`` задает шаг, но
+    не включает правило "любое из двух полей".
+    
+    Returns:
+        (значения полей, ограничен ли день месяца, ограничен ли день недели)
+    """
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError("Cron-выражение должно состоять из 5 полей")
+    
+    try:
+        parsed = [
+            _parse_cron_field(field, low, high)
+            for field, (low, high) in zip(fields, CRON_FIELDS)
+        ]
+    except ValueError as e:
+        raise ValueError(str(e) or f"Неверное cron-выражение: {expression}")
+    
+    return parsed, not fields[2].startswith('*'), not fields[4].startswith('*')
+
+
+def parse_recurrence(text: str) -> Tuple[str, Optional[datetime]]:
+    """
+    Разобрать расписание, введенное администратором
+    
+    Форматы:
+        ``каждые 7d`` / ``every 7d`` - каждые 7 дней, начиная через 7 дней
+        ``каждые 1w с 25.12.2024 15:30`` - каждую неделю, начиная с указанного времени
+        ``cron 0 10 * * 1`` - по cron-выражению (каждый понедельник в 10:00)
+    
+    Returns:
+        (нормализованное расписание, время первого запуска или None)
+    """
+    text = text.strip()
+    lowered = text.lower()
+    
+    if lowered.startswith('cron '):
+        expression = ' '.join(text[5:].split())
+        parse_cron(expression)
+        return f'cron:{expression}', None
+    
+    match = re.fullmatch(
+        r'(?:каждые|каждый|каждую|every)\s+(\d+\s*[mhdw])'
+        r'(?:\s+(?:с|from)\s+(\d{2}\.\d{2}\.\d{4} \d{2}:\d{2}))?',
+        lowered
+    )
+    if not match:
+        raise ValueError(f"Неверный формат расписания: {text}")
+    
+    seconds = parse_interval(match.group(1))
+    start_at = None
+    if match.group(2):
+        start_at = datetime.strptime(match.group(2), "%d.%m.%Y %H:%M")
+    return f'every:{seconds}', start_at
+
+
+def _next_cron_fire(expression: str, after: datetime) -> datetime:
+    """Найти ближайшее время после ``after``, подходящее под cron-выражение"""
+    (minutes, hours, days, months, weekdays), dom_restricted, dow_restricted = parse_cron(expression)
+    sorted_minutes = sorted(minutes)
+    sorted_hours = sorted(hours)
+    
+    start = after.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.replace(hour=0, minute=0)
+    
+    for day_offset in range(CRON_SEARCH_DAYS):
+        candidate_day = day + timedelta(days=day_offset)
+        if candidate_day.month not in months:
+            continue
+        
+        # Как в классическом cron: если ограничены и день месяца, и день недели,
+        # достаточно совпадения любого из них
+        dom_match = candidate_day.day in days
+        dow_match = (candidate_day.weekday() + 1) % 7 in weekdays
+        if dom_restricted and dow_restricted:
+            if not (dom_match or dow_match):
+                continue
+        elif not (dom_match and dow_match):
+            continue
+        
+        for hour in sorted_hours:
+            for minute in sorted_minutes:
+                candidate = candidate_day.replace(hour=hour, minute=minute)
+                if candidate >= start:
+                    return candidate
+    
+    raise ValueError(f"Cron-выражение никогда не срабатывает: {expression}")
+
+
+def next_fire(recurrence: str, last_fire: datetime, now: Optional[datetime] = None) -> datetime:
+    """
+    Вычислить время следующего запуска
+    
+    Для интервалов пропущенные запуски (например, бот был выключен) не
+    догоняются: время сдвигается сразу на ближайший будущий запуск за O(1).
+    
+    Args:
+        recurrence: Нормализованное расписание (``every:...`` или ``cron:...``)
+        last_fire: Время запуска, который только что выполнен
+        now: Текущее время (по умолчанию datetime.now())
+    """
+    now = now or datetime.now()
+    kind, _, value = recurrence.partition(':')
+    
+    if kind == 'every':
+        interval = int(value)
+        missed = max(int((now - last_fire).total_seconds() // interval), 0)
+        return last_fire + timedelta(seconds=interval * (missed + 1))
+    
+    if kind == 'cron':
+        return _next_cron_fire(value, max(last_fire, now))
+    
+    raise ValueError(f"Неизвестный тип расписания: {recurrence}")
+
+
+def first_fire(recurrence: str, start: Optional[datetime] = None,
+               now: Optional[datetime] = None) -> datetime:
+    """Вычислить время первого запуска нового расписания"""
+    now = now or datetime.now()
+    if start:
+        return start
+    kind, _, value = recurrence.partition(':')
+    if kind == 'every':
+        return now.replace(second=0, microsecond=0) + timedelta(seconds=int(value))
+    return _next_cron_fire(value, now)
+
+
+def describe_recurrence(recurrence: Optional[str]) -> str:
+    """Человекочитаемое описание расписания"""
+    if not recurrence:
+        return 'однократно'
+    
+    kind, _, value = recurrence.partition(':')
+    if kind == 'every':
+        seconds = int(value)
+        for unit, label in (('w', 'нед.'), ('d', 'дн.'), ('h', 'ч.'), ('m', 'мин.')):
+            if seconds % INTERVAL_UNITS[unit] == 0:
+                return f'каждые {seconds // INTERVAL_UNITS[unit]} {label}'
+    if kind == 'cron':
+        return f'cron <code>{value}</code>'
+    return recurrence
@@ -0,0 +1,226 @@
+"""
+Учет переходов по кнопкам рассылок
+
+Кнопки рассылки ведут не прямо на внешнюю ссылку, а на короткий адрес
+CLICK_BASE_URL/<токен>. Токен содержит ID ссылки (broadcast_links) и ID
+пользователя и подписан HMAC, поэтому подделать переход нельзя. Сервис
+проверяет подпись, отвечает редиректом 302 на исходный адрес и учитывает
+переход: общее число переходов по ссылке и перешедшего пользователя
+(в истории рассылок показываются уникальные пользователи, а не клики).
+
+Переход обрабатывается без обращения к базе: адреса ссылок кешируются
+в памяти (при первом переходе читаются из базы один раз, сколько бы
+запросов ни пришло одновременно), переходы считаются в памяти
+и сохраняются пачками в фоновом потоке. Если база занята или недоступна,
+редиректы продолжают работать, а счетчики сохраняются позже.
+Каждый переход также записывается в воронку (событие link_click).
+
+Запуск: python redirect_server.py (за nginx, location /c/ в deploy/nginx.conf).
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import struct
+from collections import Counter, OrderedDict
+from typing import Dict, Optional, Set, Tuple
+
+from aiohttp import web
+
+from config import (
+    CLICK_SECRET, CLICK_HOST, CLICK_PORT, CLICK_FLUSH_SECONDS,
+    EVENTS_BUFFER_SIZE, EVENTS_FLUSH_SECONDS
+)
+from database import Database
+from events import EventLog
+
+logger = logging.getLogger(__name__)
+
+# Токен: ID ссылки (4 байта) + ID пользователя (8 байт) + подпись (8 байт) -> 27 символов
+TOKEN_FORMAT = '>IQ'
+TOKEN_PAYLOAD_SIZE = struct.calcsize(TOKEN_FORMAT)
+SIGNATURE_SIZE = 8
+
+# Путь редиректа (location в nginx)
+CLICK_PATH = '/c/{token}'
+
+# Сколько адресов ссылок держать в памяти
+LINK_CACHE_SIZE = 10000
+
+
+def _sign(secret: str, payload: bytes) -> bytes:
+    return hmac.new(secret.encode(), payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def make_click_token(secret: str, link_id: int, user_id: int) -> str:
+    """Подписанный токен перехода по ссылке для пользователя"""
+    payload = struct.pack(TOKEN_FORMAT, link_id, user_id)
+    return base64.urlsafe_b64encode(payload + _sign(secret, payload)).rstrip(b'=').decode()
+
+
+def make_click_url(base_url: str, secret: str, link_id: int, user_id: int) -> str:
+    """Адрес кнопки рассылки, ведущий через сервис переходов"""
+    return f"{base_url.rstrip('/')}/{make_click_token(secret, link_id, user_id)}"
+
+
+def parse_click_token(secret: str, token: str) -> Optional[Tuple[int, int]]:
+    """(ID ссылки, ID пользователя) или None, если токен поврежден или подделан"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except ValueError:
+        return None
+    if len(raw) != TOKEN_PAYLOAD_SIZE + SIGNATURE_SIZE:
+        return None
+    
+    payload, signature = raw[:TOKEN_PAYLOAD_SIZE], raw[TOKEN_PAYLOAD_SIZE:]
+    if not hmac.compare_digest(signature, _sign(secret, payload)):
+        return None
+    return struct.unpack(TOKEN_FORMAT, payload)
+
+
+class LinkCache:
+    """Адреса ссылок в памяти (LRU) с одним чтением из базы на ссылку"""
+    
+    def __init__(self, db: Database, max_size: int = LINK_CACHE_SIZE):
+        self.db = db
+        self.max_size = max_size
+        self._urls: OrderedDict = OrderedDict()
+        # ID ссылки -> чтение из базы, которое ждут все одновременные запросы
+        self._pending: Dict[int, asyncio.Future] = {}
+    
+    async def get(self, link_id: int) -> Optional[str]:
+        url = self._urls.get(link_id)
+        if url is not None:
+            self._urls.move_to_end(link_id)
+            return url
+        
+        future = self._pending.get(link_id)
+        if future is None:
+            future = asyncio.ensure_future(asyncio.to_thread(self.db.get_broadcast_link_url, link_id))
+            self._pending[link_id] = future
+            future.add_done_callback(lambda _: self._pending.pop(link_id, None))
+        url = await asyncio.shield(future)
+        
+        if url is not None:
+            # Адрес ссылки не меняется, поэтому кешируется без срока действия
+            self._urls[link_id] = url
+            if len(self._urls) > self.max_size:
+                self._urls.popitem(last=False)
+        return url
+
+
+class ClickCounter:
+    """Счетчики переходов в памяти с пакетным сохранением в базу"""
+    
+    def __init__(self, db: Database, flush_interval: float = 5.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self._clicks: Counter = Counter()
+        # Пары (ID ссылки, ID пользователя), еще не сохраненные в базу
+        self._clickers: Set[Tuple[int, int]] = set()
+        self._task: Optional[asyncio.Task] = None
+    
+    def record(self, link_id: int, user_id: int):
+        self._clicks[link_id] += 1
+        self._clickers.add((link_id, user_id))
+    
+    def start(self):
+        """Запустить периодическое сохранение счетчиков"""
+        self._task = asyncio.create_task(self.run())
+    
+    async def stop(self):
+        """Остановить сохранение счетчиков и сохранить накопленное"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+    
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+    
+    async def flush(self):
+        """Прибавить накопленные переходы к счетчикам в базе (в отдельном потоке)"""
+        if not self._clicks:
+            return
+        
+        clicks, self._clicks = self._clicks, Counter()
+        clickers, self._clickers = self._clickers, set()
+        try:
+            # shield: запись, начатая до остановки, доводится до конца
+            await asyncio.shield(asyncio.to_thread(self.db.add_link_clicks, dict(clicks), clickers))
+        except Exception as e:
+            logger.error(f"Ошибка при сохранении переходов: {e}")
+            self._clicks.update(clicks)
+            self._clickers.update(clickers)
+            return
+        logger.info(f"Сохранено переходов: {sum(clicks.values())} по {len(clicks)} ссылкам")
+
+
+def create_redirect_app(secret: str, links: LinkCache, counter: ClickCounter,
+                        event_log: EventLog) -> web.Application:
+    """Создать aiohttp приложение редиректов"""
+    
+    async def handle_click(request: web.Request) -> web.Response:
+        parsed = parse_click_token(secret, request.match_info['token'])
+        if parsed is None:
+            raise web.HTTPNotFound()
+        link_id, user_id = parsed
+        
+        try:
+            url = await links.get(link_id)
+        except Exception as e:
+            logger.error(f"Не удалось получить адрес ссылки {link_id}: {e}")
+            raise web.HTTPServiceUnavailable()
+        if url is None:
+            raise web.HTTPNotFound()
+        
+        counter.record(link_id, user_id)
+        event_log.record(user_id, 'link_click', payload={'link_id': link_id})
+        return web.Response(status=302, headers={'Location': url, 'Cache-Control': 'no-store'})
+    
+    app = web.Application()
+    app.router.add_get(CLICK_PATH, handle_click)
+    return app
+
+
+async def serve_redirects(db: Database, secret: str, host: str, port: int):
+    """Запустить сервис переходов и работать до отмены"""
+    counter = ClickCounter(db, flush_interval=CLICK_FLUSH_SECONDS)
+    event_log = EventLog(db, capacity=EVENTS_BUFFER_SIZE, flush_interval=EVENTS_FLUSH_SECONDS)
+    app = create_redirect_app(secret, LinkCache(db), counter, event_log)
+    
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    counter.start()
+    event_log.start()
+    logger.info(f"Сервис переходов слушает http://{host}:{port}{CLICK_PATH}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await counter.stop()
+        await event_log.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not CLICK_SECRET:
+        raise ValueError("CLICK_SECRET не установлен в переменных окружения. Проверьте файл .env")
+    
+    try:
+        asyncio.run(serve_redirects(Database(), CLICK_SECRET, CLICK_HOST, CLICK_PORT))
+    except KeyboardInterrupt:
+        logger.info("Сервис переходов остановлен")
@@ -0,0 +1,33 @@
+"""
+Главный модуль процессов пула отчетов (reports.py)
+
+При запуске через spawn процесс пула заново импортирует главный модуль
+родителя (как __mp_main__). Для admin_bot.py и run_all.py это означало бы
+повторное выполнение их верхнего уровня в каждом процессе: схема базы,
+боты, сессия, хранилище FSM. Пока ReportRunner запускает процессы, на место
+__main__ подставляется этот модуль, поэтому процессы пула импортируют
+только его, а модули задач (exporter, charts, cohorts) - по мере надобности.
+
+Модуль не должен импортировать модули ботов.
+"""
+import os
+import signal
+import sys
+
+# Приоритет процессов пула (чем больше, тем ниже)
+WORKER_NICE = 10
+
+
+def _exit_on_sigterm(signum, frame):
+    # SystemExit вместо немедленного завершения: срабатывают finally и
+    # except BaseException задач (например, удаление временного файла выгрузки)
+    sys.exit(128 + signum)
+
+
+def init_worker():
+    """Инициализация процесса пула: понижаем приоритет, SIGTERM - через SystemExit"""
+    try:
+        os.nice(WORKER_NICE)
+    except (AttributeError, OSError):
+        pass
+    signal.signal(signal.SIGTERM, _exit_on_sigterm)
@@ -0,0 +1,199 @@
+"""
+Выполнение тяжелых отчетов admin_bot в пуле процессов
+
+Выгрузки, графики и когортный анализ нагружают процессор. В отдельных
+процессах они не занимают цикл событий (опрос обновлений, рассылки,
+ответы на команды) и не держат GIL основного процесса. Процессы пула
+запускаются с пониженным приоритетом (nice), поэтому отчеты не отнимают
+процессор у идущей рассылки.
+
+ReportRunner:
+- объединяет одинаковые задачи: если два администратора одновременно
+  запросили один и тот же отчет (одинаковый ключ), считается он один раз;
+- ограничивает время выполнения (timeout);
+- позволяет отменить задачу (cancel). Задача, еще ожидающая в очереди,
+  просто не запускается; зависшая задача завершается перезапуском пула,
+  если других задач в нем нет. Результат задачи, досчитавшей после отмены
+  или таймаута, передается в discard (например, чтобы удалить файл).
+
+Процессы пула запускаются через spawn с report_worker в роли главного
+модуля, поэтому не повторяют инициализацию admin_bot.py / run_all.py.
+Функции задач и их аргументы передаются в другой процесс, поэтому функции
+должны быть уровня модуля (не из admin_bot), а аргументы - сериализуемыми.
+"""
+import asyncio
+import logging
+import multiprocessing
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import report_worker
+
+logger = logging.getLogger(__name__)
+
+
+class ReportTimeout(Exception):
+    """Отчет не уложился в отведенное время"""
+
+
+class ReportCancelled(Exception):
+    """Отчет отменен (ReportRunner.cancel)"""
+
+
+async def run_in_thread(key: Hashable, fn: Callable[..., Any], *args) -> Any:
+    """Выполнить fn(*args) в отдельном потоке (замена ReportRunner.run без пула процессов)"""
+    return await asyncio.to_thread(fn, *args)
+
+
+@contextmanager
+def _worker_main_module():
+    """
+    Подставить report_worker вместо __main__ на время запуска процессов пула
+    
+    multiprocessing передает новому процессу главный модуль родителя
+    из sys.modules['__main__']; процессы пула запускаются синхронно
+    в submit, поэтому подмена нужна только на время этого вызова.
+    """
+    main_module = sys.modules['__main__']
+    sys.modules['__main__'] = report_worker
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main_module
+
+
+def _discard_late_result(key: Hashable, discard: Callable[[Any], None], future: Future):
+    """Передать в discard результат задачи, которую уже не ждут"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    try:
+        discard(future.result())
+        logger.info(f"Результат отчета {key}, завершившегося после отмены, удален")
+    except Exception as e:
+        logger.warning(f"Не удалось удалить результат отчета {key}: {e}")
+
+
+class ReportRunner:
+    """Пул процессов для отчетов с объединением задач, отменой и таймаутом"""
+    
+    def __init__(self, max_workers: int = 2, timeout: float = 300):
+        """
+        Args:
+            max_workers: Количество процессов пула
+            timeout: Время выполнения задачи по умолчанию (секунды)
+        """
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Ключ задачи -> задача, которую ждут все запросившие
+        self._jobs: Dict[Hashable, asyncio.Task] = {}
+    
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Процессы запускаются при отправке задач (submit), см. _worker_main_module
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=report_worker.init_worker
+            )
+        return self._executor
+    
+    async def run(self, key: Hashable, fn: Callable[..., Any], *args,
+                  timeout: Optional[float] = None,
+                  discard: Optional[Callable[[Any], None]] = None) -> Any:
+        """
+        Выполнить fn(*args) в пуле процессов
+        
+        Если задача с таким ключом уже выполняется, ждем ее результат.
+        Отмена ожидания одним из запросивших не отменяет общую задачу.
+        
+        Args:
+            discard: Вызывается с результатом задачи, которая досчитала уже
+                после таймаута или отмены (например, удалить временный файл)
+        
+        Raises:
+            ReportTimeout: задача не уложилась в timeout
+            ReportCancelled: задача отменена через cancel
+        """
+        job = self._jobs.get(key)
+        if job is None:
+            job = asyncio.create_task(self._execute(key, fn, args, timeout or self.timeout, discard))
+            self._jobs[key] = job
+        else:
+            logger.info(f"Отчет {key} уже считается, ждем его результат")
+        return await asyncio.shield(job)
+    
+    async def _execute(self, key: Hashable, fn: Callable[..., Any], args: tuple, timeout: float,
+                       discard: Optional[Callable[[Any], None]]) -> Any:
+        with _worker_main_module():
+            task_future = self._get_executor().submit(fn, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(task_future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Отчет {key} не уложился в {timeout} сек. и отменен")
+            self._abandon(key, task_future, discard)
+            raise ReportTimeout(f"Отчет не уложился в {timeout:.0f} сек.")
+        except asyncio.CancelledError:
+            logger.info(f"Отчет {key} отменен")
+            self._abandon(key, task_future, discard)
+            # Ожидающие получают ReportCancelled, а не CancelledError,
+            # чтобы отличать отмену отчета от отмены своего обработчика
+            raise ReportCancelled("Отчет отменен")
+        finally:
+            self._jobs.pop(key, None)
+    
+    def _abandon(self, key: Hashable, task_future: Future, discard: Optional[Callable[[Any], None]]):
+        """Бросить задачу: остановить ее процесс или обработать поздний результат"""
+        if discard is not None:
+            task_future.add_done_callback(lambda future: _discard_late_result(key, discard, future))
+        self._stop_running(key)
+    
+    def _stop_running(self, key: Hashable):
+        """
+        Остановить процесс отмененной задачи
+        
+        ProcessPoolExecutor не умеет прерывать начатую задачу, поэтому пул
+        перезапускается - но только если других задач в нем нет, иначе
+        они завершились бы с ошибкой. В этом случае результат задачи
+        будет отброшен (и передан в discard). Процесс, завершенный
+        перезапуском пула, получает SIGTERM как SystemExit (report_worker),
+        поэтому задача успевает удалить свои временные файлы.
+        """
+        if self._executor is None:
+            return
+        if any(job_key != key for job_key in self._jobs):
+            logger.info(f"Пул занят другими отчетами, процесс отчета {key} завершится сам")
+            return
+        
+        executor, self._executor = self._executor, None
+        # _processes - единственный способ добраться до процессов пула
+        processes = list((getattr(executor, '_processes', None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    
+    def cancel(self, key: Hashable) -> bool:
+        """Отменить задачу; False, если такой задачи нет"""
+        job = self._jobs.get(key)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+    
+    def is_running(self, key: Hashable) -> bool:
+        """Выполняется ли задача с ключом"""
+        return key in self._jobs
+    
+    async def shutdown(self):
+        """Отменить задачи и остановить пул"""
+        jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        if jobs:
+            await asyncio.gather(*jobs, return_exceptions=True)
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,78 @@
+"""
+Запуск User Bot и Admin Bot в одном процессе
+
+Вместо двух процессов (user-bot.service и admin-bot.service), каждый со
+своим интерпретатором, копией aiogram, базой и парой ботов, оба диспетчера
+работают в одном цикле событий и используют общие объекты (shared.py):
+одну базу и один Bot на токен. Рассылки admin_bot идут тем же ботом,
+что принимает обновления user_bot, а уведомления о новых пользователях
+передаются боту админов внутри процесса. Памяти нужно примерно вдвое меньше.
+
+Если один из ботов завершился (ошибка при запуске, потеря базы), второй
+тоже останавливается, чтобы systemd перезапустил процесс целиком.
+
+User Bot работает в режиме USER_BOT_MODE: polling или webhook
+(в webhook режиме - один воркер, WEBHOOK_WORKERS не учитывается).
+
+Запуск: python run_all.py (deploy/bots.service)
+"""
+import asyncio
+import logging
+import signal
+
+from config import USER_BOT_MODE, WEBHOOK_SECRET, WEBHOOK_WORKERS
+
+import user_bot
+import admin_bot
+
+logger = logging.getLogger(__name__)
+
+
+async def run_user_bot():
+    """User Bot в режиме USER_BOT_MODE"""
+    if USER_BOT_MODE != 'webhook':
+        await user_bot.main(handle_signals=False)
+        return
+    
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET не установлен в переменных окружения. Проверьте файл .env")
+    if WEBHOOK_WORKERS > 1:
+        logger.warning(f"WEBHOOK_WORKERS={WEBHOOK_WORKERS} не учитывается при запуске в одном процессе")
+    await user_bot.register_webhook()
+    await user_bot.webhook_worker_main(workers=1)
+
+
+async def main():
+    """Запустить оба бота и остановить их по сигналу или завершению любого из них"""
+    logger.info("Запуск User Bot и Admin Bot в одном процессе...")
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    
+    tasks = [
+        asyncio.create_task(run_user_bot(), name='user_bot'),
+        asyncio.create_task(admin_bot.main(handle_signals=False), name='admin_bot'),
+    ]
+    stop_waiter = asyncio.create_task(stop.wait())
+    done, _ = await asyncio.wait([*tasks, stop_waiter], return_when=asyncio.FIRST_COMPLETED)
+    
+    for task in done:
+        if task is not stop_waiter:
+            logger.warning(f"{task.get_name()} завершился, останавливаем остальные")
+    
+    # Отмена прерывает polling/webhook, а finally в main каждого бота
+    # сохраняет накопленные данные и закрывает сессии
+    for task in (*tasks, stop_waiter):
+        task.cancel()
+    for task, result in zip(tasks, await asyncio.gather(*tasks, return_exceptions=True)):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка в {task.get_name()}: {result}")
+    logger.info("Боты остановлены")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        logger.info("Боты остановлены пользователем")
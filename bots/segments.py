@@ -0,0 +1,351 @@
+"""
+Язык описания сегментов пользователей
+
+Кроме встроенных сегментов ('all', 'new', 'active', 'inactive') рассылку
+можно отправить по условию, например:
+
+    registered < 14d and start_param = "vk_ads" and not blocked
+
+Условие компилируется в параметризованный SQL-запрос по таблице users
+(значения никогда не подставляются в текст запроса). Скомпилированные
+запросы кешируются, а план выполнения проверяется через EXPLAIN QUERY PLAN:
+если запрос требует полного просмотра таблицы, администратор видит
+предупреждение.
+
+Поля:
+    registered, active      - время регистрации / последней активности:
+                              ``registered < 14d`` (моложе 14 дней),
+                              ``active > 30d`` (неактивен дольше 30 дней),
+                              ``registered >= 2024-12-01`` (с даты)
+    start_param             - последний start параметр
+    campaign                - start параметр при регистрации (первое касание)
+    username                - username пользователя
+    user_id                 - ID пользователя (``user_id in (1, 2)``)
+Флаги: blocked, has_username, has_start_param
+Операторы: = != < <= > >= in ("a", "b"), and, or, not, скобки.
+Единицы времени: m (минуты), h (часы), d (дни), w (недели).
+
+Ключевые слова и имена полей не зависят от регистра, значения - зависят
+(``start_param = VK2`` и ``start_param = vk2`` - разные кампании).
+Значение, совпадающее с ключевым словом или полем, берется в кавычки.
+
+Если в условии не упоминается blocked, заблокированные пользователи
+исключаются, как и во встроенных сегментах.
+"""
+import html
+import re
+from datetime import datetime
+from functools import lru_cache
+from typing import List, NamedTuple, Tuple
+
+# Префикс сегмента, заданного выражением (хранится в segment_type)
+EXPR_PREFIX = 'expr:'
+
+# Максимальная длина выражения
+MAX_EXPRESSION_LENGTH = 500
+
+# Названия встроенных сегментов
+SEGMENT_NAMES = {
+    'all': '👥 Все пользователи',
+    'new': '🆕 Новые (7 дней)',
+    'active': '✅ Активные (30 дней)',
+    'inactive': '😴 Неактивные',
+}
+
+# Поля времени: имя в выражении -> колонка
+TIME_FIELDS = {
+    'registered': 'registered_at',
+    'active': 'last_activity',
+}
+
+# Текстовые поля
+TEXT_FIELDS = {
+    'start_param': 'start_param',
+    'campaign': 'first_start_param',
+    'username': 'username',
+}
+
+# Целочисленные поля
+INT_FIELDS = {
+    'user_id': 'user_id',
+}
+
+# Диапазон INTEGER в SQLite (знаковое 64-битное): большее число sqlite3 не передаст в запрос
+MAX_INT_VALUE = 2 ** 63 - 1
+
+# Флаги: имя -> (условие, условие с not)
+FLAGS = {
+    'blocked': ('is_active = 0', 'is_active = 1'),
+    'has_username': ('username IS NOT NULL', 'username IS NULL'),
+    'has_start_param': ('start_param IS NOT NULL', 'start_param IS NULL'),
+}
+
+# Единицы длительности -> модификатор datetime() SQLite
+DURATION_UNITS = {
+    'm': ('minutes', 1),
+    'h': ('hours', 1),
+    'd': ('days', 1),
+    'w': ('days', 7),
+}
+
+# "моложе N" (registered < 14d) означает, что время события больше now - N
+AGE_OPERATORS = {'<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<duration>\d+[mhdw])\b
+      | (?P<date>\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2})?)
+      | (?P<number>\d+)
+      | (?P<string>"[^"]*"|'[^']*')
+      | (?P<op><=|>=|!=|=|<|>)
+      | (?P<punct>[(),])
+      | (?P<word>[A-Za-z_][A-Za-z0-9_-]*)
+    )
+''', re.VERBOSE)
+
+# Слова, которые не зависят от регистра (остальные слова - значения)
+KEYWORDS = {'and', 'or', 'not', 'in'} | set(TIME_FIELDS) | set(TEXT_FIELDS) | set(INT_FIELDS) | set(FLAGS)
+
+
+class SegmentError(ValueError):
+    """Ошибка в выражении сегмента"""
+
+
+class CompiledSegment(NamedTuple):
+    """Скомпилированный сегмент: запрос ID пользователей и его параметры"""
+    sql: str
+    params: Tuple
+
+
+def _tokenize(text: str) -> List[Tuple[str, str]]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    
+    while position < len(text):
+        match = TOKEN_RE.match(text, position)
+        if not match or match.end() == position:
+            raise SegmentError(f"Непонятный фрагмент: {text[position:position + 20].strip()}")
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == 'word' and value.lower() in KEYWORDS:
+            value = value.lower()
+        tokens.append((kind, value))
+        position = match.end()
+    
+    return tokens
+
+
+class _Parser:
+    """Рекурсивный разбор выражения сразу в SQL"""
+    
+    def __init__(self, tokens: List[Tuple[str, str]]):
+        self.tokens = tokens
+        self.position = 0
+        self.params: List = []
+        self.mentions_blocked = False
+    
+    def peek(self) -> Tuple[str, str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return ('end', '')
+    
+    def take(self) -> Tuple[str, str]:
+        token = self.peek()
+        if token[0] == 'end':
+            raise SegmentError("Неожиданный конец выражения")
+        self.position += 1
+        return token
+    
+    def expect(self, kind: str, value: str = None) -> str:
+        token_kind, token_value = self.take()
+        if token_kind != kind or (value is not None and token_value != value):
+            raise SegmentError(f"Ожидалось {value or kind}, получено {token_value}")
+        return token_value
+    
+    def parse(self) -> str:
+        sql = self.parse_or()
+        if self.peek()[0] != 'end':
+            raise SegmentError(f"Лишний фрагмент: {self.peek()[1]}")
+        return sql
+    
+    def parse_or(self) -> str:
+        parts = [self.parse_and()]
+        while self.peek() == ('word', 'or'):
+            self.take()
+            parts.append(self.parse_and())
+        return parts[0] if len(parts) == 1 else '(' + ' OR '.join(parts) + ')'
+    
+    def parse_and(self) -> str:
+        parts = [self.parse_not()]
+        while self.peek() == ('word', 'and'):
+            self.take()
+            parts.append(self.parse_not())
+        return parts[0] if len(parts) == 1 else '(' + ' AND '.join(parts) + ')'
+    
+    def parse_not(self) -> str:
+        if self.peek() == ('word', 'not'):
+            self.take()
+            # Отрицание флага превращаем в прямое условие, чтобы сохранить индекс
+            kind, value = self.peek()
+            if kind == 'word' and value in FLAGS and self._next_is_boundary():
+                self.take()
+                self.mentions_blocked |= value == 'blocked'
+                return FLAGS[value][1]
+            return f'NOT {self.parse_not()}'
+        return self.parse_atom()
+    
+    def _next_is_boundary(self) -> bool:
+        """Следующий после текущего токен завершает условие"""
+        if self.position + 1 >= len(self.tokens):
+            return True
+        return self.tokens[self.position + 1] in (('word', 'and'), ('word', 'or'), ('punct', ')'))
+    
+    def parse_atom(self) -> str:
+        kind, value = self.take()
+        
+        if (kind, value) == ('punct', '('):
+            sql = self.parse_or()
+            self.expect('punct', ')')
+            return sql
+        
+        if kind != 'word':
+            raise SegmentError(f"Ожидалось поле или флаг, получено {value}")
+        
+        if value in FLAGS:
+            self.mentions_blocked |= value == 'blocked'
+            return FLAGS[value][0]
+        if value in TIME_FIELDS:
+            return self.parse_time(TIME_FIELDS[value])
+        if value in TEXT_FIELDS:
+            return self.parse_text(TEXT_FIELDS[value])
+        if value in INT_FIELDS:
+            return self.parse_int(INT_FIELDS[value])
+        
+        raise SegmentError(f"Неизвестное поле: {value}")
+    
+    def parse_time(self, column: str) -> str:
+        operator = self.expect('op')
+        kind, value = self.take()
+        
+        if kind == 'duration':
+            if operator not in AGE_OPERATORS:
+                raise SegmentError("Для длительности используйте <, <=, > или >=")
+            unit, multiplier = DURATION_UNITS[value[-1]]
+            self.params.append(f'-{int(value[:-1]) * multiplier} {unit}')
+            return f"{column} {AGE_OPERATORS[operator]} datetime('now', ?)"
+        
+        if kind == 'date':
+            date_value = value.replace('T', ' ')
+            try:
+                datetime.fromisoformat(date_value)
+            except ValueError:
+                raise SegmentError(f"Неверная дата: {value}")
+            if operator == '=':
+                # Весь день: диапазон вместо date(column), чтобы работал индекс
+                self.params.extend([date_value, date_value])
+                return f"({column} >= ? AND {column} < datetime(?, '+1 day'))"
+            if operator == '!=':
+                raise SegmentError("Для дат оператор != не поддерживается")
+            self.params.append(date_value)
+            return f"{column} {operator} ?"
+        
+        raise SegmentError(f"Ожидалась длительность (14d) или дата (2024-12-01), получено {value}")
+    
+    def parse_text(self, column: str) -> str:
+        kind, value = self.take()
+        
+        if (kind, value) == ('word', 'in'):
+            self.expect('punct', '(')
+            values = [self._string_value()]
+            while self.peek() == ('punct', ','):
+                self.take()
+                values.append(self._string_value())
+            self.expect('punct', ')')
+            self.params.extend(values)
+            return f"{column} IN ({', '.join('?' for _ in values)})"
+        
+        if kind != 'op' or value not in ('=', '!='):
+            raise SegmentError("Для текстовых полей используйте =, != или in")
+        self.params.append(self._string_value())
+        # IS NOT учитывает и пользователей без значения (NULL)
+        return f"{column} = ?" if value == '=' else f"{column} IS NOT ?"
+    
+    def _string_value(self) -> str:
+        kind, value = self.take()
+        if kind == 'string':
+            return value[1:-1]
+        if kind in ('word', 'number'):
+            return value
+        raise SegmentError(f"Ожидалась строка, получено {value}")
+    
+    def _int_value(self) -> int:
+        value = int(self.expect('number'))
+        if value > MAX_INT_VALUE:
+            raise SegmentError(f"Слишком большое число: {value}")
+        return value
+    
+    def parse_int(self, column: str) -> str:
+        kind, value = self.take()
+        
+        if (kind, value) == ('word', 'in'):
+            self.expect('punct', '(')
+            values = [self._int_value()]
+            while self.peek() == ('punct', ','):
+                self.take()
+                values.append(self._int_value())
+            self.expect('punct', ')')
+            self.params.extend(values)
+            return f"{column} IN ({', '.join('?' for _ in values)})"
+        
+        if kind != 'op':
+            raise SegmentError("Для числовых полей используйте =, !=, <, <=, >, >= или in")
+        self.params.append(self._int_value())
+        return f"{column} {value} ?"
+
+
+@lru_cache(maxsize=256)
+def compile_segment(expression: str) -> CompiledSegment:
+    """
+    Скомпилировать выражение сегмента в запрос ID пользователей
+    
+    Raises:
+        SegmentError: если выражение некорректно
+    """
+    expression = expression.strip()
+    if not expression:
+        raise SegmentError("Пустое выражение")
+    if len(expression) > MAX_EXPRESSION_LENGTH:
+        raise SegmentError(f"Выражение длиннее {MAX_EXPRESSION_LENGTH} символов")
+    
+    parser = _Parser(_tokenize(expression))
+    condition = parser.parse()
+    if not parser.mentions_blocked:
+        condition = f'is_active = 1 AND {condition}'
+    
+    return CompiledSegment(f'SELECT user_id FROM users WHERE {condition}', tuple(parser.params))
+
+
+def is_expression(segment_type: str) -> bool:
+    """Является ли сегмент выражением"""
+    return bool(segment_type) and segment_type.startswith(EXPR_PREFIX)
+
+
+def describe_segment(segment_type: str) -> str:
+    """Название сегмента для сообщений с parse_mode=HTML"""
+    if is_expression(segment_type):
+        return f"🧩 <code>{html.escape(segment_type[len(EXPR_PREFIX):])}</code>"
+    return SEGMENT_NAMES.get(segment_type, html.escape(segment_type or 'all'))
+
+
+def plan_uses_index(plan_details: List[str]) -> bool:
+    """
+    Сужает ли индекс выборку по плану EXPLAIN QUERY PLAN
+
+    Полным просмотром считается SCAN, а также поиск только по is_active:
+    он перебирает всех незаблокированных пользователей.
+    """
+    for detail in plan_details:
+        if detail.startswith('SCAN') or detail.endswith('(is_active=?)'):
+            return False
+    return True
@@ -0,0 +1,234 @@
+"""
+HTTP сессия ботов: общий настроенный пул соединений с Bot API
+
+По умолчанию каждый Bot создает свою сессию aiogram с пулом на 100
+соединений и стандартными настройками aiohttp. Здесь все боты процесса
+(shared.get_bot) используют одну сессию с настраиваемыми параметрами:
+- размер пула (BOT_HTTP_POOL_SIZE) - по умолчанию столько, сколько
+  обновлений user_bot обрабатывается одновременно (WEBHOOK_MAX_CONCURRENCY),
+  плюс запас на рассылки и admin_bot (рассылка отправляет по одному
+  сообщению, поэтому держит одно соединение);
+- время жизни простаивающих keep-alive соединений, кеш DNS, таймаут запроса.
+TCP_NODELAY aiohttp включает на каждом соединении сам.
+
+С TELEGRAM_API_URL боты работают через свой сервер telegram-bot-api.
+В режиме --local (TELEGRAM_API_LOCAL) сервер отдает файлы путями на диске
+и принимает файлы по путям file://: save_file и input_file обходятся без
+скачивания и загрузки по HTTP.
+
+PoolMetrics считает по событиям aiohttp (TraceConfig), сколько запросов
+выполняется и ждет свободного соединения и какая доля запросов
+переиспользует открытое соединение, - это показывает /pool в admin_bot.
+"""
+import asyncio
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional, Union
+
+from aiohttp import ClientSession, TraceConfig
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import Bot, __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.types import FSInputFile
+
+from config import (
+    WEBHOOK_MAX_CONCURRENCY, BOT_HTTP_POOL_SIZE, BOT_HTTP_KEEPALIVE_SECONDS,
+    BOT_HTTP_DNS_CACHE_SECONDS, BOT_HTTP_TIMEOUT_SECONDS,
+    TELEGRAM_API_URL, TELEGRAM_API_LOCAL
+)
+
+logger = logging.getLogger(__name__)
+
+# Соединения сверх WEBHOOK_MAX_CONCURRENCY: рассылки, уведомления, admin_bot
+POOL_RESERVE = 10
+
+
+@dataclass
+class PoolStats:
+    """Состояние пула соединений"""
+    limit: int
+    in_flight: int      # Выполняющиеся запросы
+    queued: int         # Запросы, ждущие свободного соединения
+    requests: int       # Всего запросов
+    queued_total: int   # Всего запросов, ждавших соединения
+    created: int        # Открыто новых соединений
+    reused: int         # Запросов через уже открытое соединение
+    
+    @property
+    def reuse_ratio(self) -> Optional[float]:
+        """Доля запросов, переиспользовавших соединение"""
+        total = self.created + self.reused
+        return self.reused / total if total else None
+
+
+class PoolMetrics:
+    """Счетчики пула по событиям aiohttp"""
+    
+    def __init__(self):
+        self.in_flight = 0
+        self.queued = 0
+        self.requests = 0
+        self.queued_total = 0
+        self.created = 0
+        self.reused = 0
+    
+    def trace_config(self) -> TraceConfig:
+        """TraceConfig для ClientSession, обновляющий счетчики"""
+        config = TraceConfig()
+        config.on_request_start.append(self._on_request_start)
+        config.on_request_end.append(self._on_request_done)
+        config.on_request_exception.append(self._on_request_done)
+        config.on_connection_queued_start.append(self._on_queued_start)
+        config.on_connection_queued_end.append(self._on_queued_end)
+        config.on_connection_create_end.append(self._on_connection_created)
+        config.on_connection_reuseconn.append(self._on_connection_reused)
+        return config
+    
+    async def _on_request_start(self, session: ClientSession, context: SimpleNamespace, params):
+        self.requests += 1
+        self.in_flight += 1
+    
+    async def _on_request_done(self, session: ClientSession, context: SimpleNamespace, params):
+        self.in_flight -= 1
+    
+    async def _on_queued_start(self, session: ClientSession, context: SimpleNamespace, params):
+        self.queued += 1
+        self.queued_total += 1
+    
+    async def _on_queued_end(self, session: ClientSession, context: SimpleNamespace, params):
+        self.queued -= 1
+    
+    async def _on_connection_created(self, session: ClientSession, context: SimpleNamespace, params):
+        self.created += 1
+    
+    async def _on_connection_reused(self, session: ClientSession, context: SimpleNamespace, params):
+        self.reused += 1
+
+
+class PooledAiohttpSession(AiohttpSession):
+    """Сессия aiogram с настроенным пулом соединений и метриками"""
+    
+    def __init__(self, limit: int, keepalive_timeout: float = 30,
+                 dns_cache_seconds: int = 3600, timeout: float = 60,
+                 api: TelegramAPIServer = PRODUCTION):
+        """
+        Args:
+            limit: Максимум одновременных соединений
+            keepalive_timeout: Сколько держать простаивающее соединение открытым (секунды)
+            dns_cache_seconds: Время жизни записей кеша DNS (секунды)
+            timeout: Таймаут запроса к Bot API (секунды)
+            api: Сервер Bot API
+        """
+        super().__init__(limit=limit, timeout=timeout, api=api)
+        self.limit = limit
+        self._connector_init.update(
+            limit_per_host=limit,
+            keepalive_timeout=keepalive_timeout,
+            use_dns_cache=True,
+            ttl_dns_cache=dns_cache_seconds,
+        )
+        self.metrics = PoolMetrics()
+    
+    async def create_session(self) -> ClientSession:
+        if self._should_reset_connector:
+            await self.close()
+        
+        if self._session is None or self._session.closed:
+            # Как в AiohttpSession.create_session, но с TraceConfig метрик
+            self._session = ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+                trace_configs=[self.metrics.trace_config()],
+            )
+            self._should_reset_connector = False
+        return self._session
+    
+    def stats(self) -> PoolStats:
+        """Текущее состояние пула"""
+        metrics = self.metrics
+        return PoolStats(
+            limit=self.limit,
+            in_flight=metrics.in_flight,
+            queued=metrics.queued,
+            requests=metrics.requests,
+            queued_total=metrics.queued_total,
+            created=metrics.created,
+            reused=metrics.reused,
+        )
+
+
+def pool_size() -> int:
+    """Размер пула: BOT_HTTP_POOL_SIZE или по одновременной обработке обновлений"""
+    return BOT_HTTP_POOL_SIZE or WEBHOOK_MAX_CONCURRENCY + POOL_RESERVE
+
+
+def api_server() -> TelegramAPIServer:
+    """Сервер Bot API из конфигурации (TELEGRAM_API_URL или api.telegram.org)"""
+    if not TELEGRAM_API_URL:
+        return PRODUCTION
+    return TelegramAPIServer.from_base(TELEGRAM_API_URL, is_local=TELEGRAM_API_LOCAL)
+
+
+def create_session() -> PooledAiohttpSession:
+    """Сессия с параметрами пула из конфигурации"""
+    session = PooledAiohttpSession(
+        limit=pool_size(),
+        keepalive_timeout=BOT_HTTP_KEEPALIVE_SECONDS,
+        dns_cache_seconds=BOT_HTTP_DNS_CACHE_SECONDS,
+        timeout=BOT_HTTP_TIMEOUT_SECONDS,
+        api=api_server(),
+    )
+    if TELEGRAM_API_URL:
+        mode = " (--local)" if TELEGRAM_API_LOCAL else ""
+        logger.info(f"Сервер Bot API: {TELEGRAM_API_URL}{mode}")
+    logger.info(f"Пул соединений Bot API: до {session.limit} соединений")
+    return session
+
+
+async def save_file(bot: Bot, file_id: str, destination: str):
+    """
+    Сохранить файл Telegram в destination
+    
+    В режиме --local файл уже лежит на диске сервера Bot API: он связывается
+    жесткой ссылкой (на другой файловой системе - копируется) без скачивания.
+    """
+    file = await bot.get_file(file_id)
+    api = bot.session.api
+    if not api.is_local:
+        await bot.download_file(file.file_path, destination=destination)
+        return
+    
+    source = str(api.wrap_local_file.to_local(file.file_path))
+    try:
+        os.link(source, destination)
+    except OSError:
+        await asyncio.to_thread(shutil.copyfile, source, destination)
+
+
+def input_file(bot: Bot, path: str) -> Union[FSInputFile, str]:
+    """Файл для отправки: в режиме --local - путь file://, сервер читает его с диска сам"""
+    if bot.session.api.is_local:
+        return Path(path).resolve().as_uri()
+    return FSInputFile(path)
+
+
+def render_stats(stats: PoolStats) -> str:
+    """Состояние пула в виде сообщения (parse_mode=HTML)"""
+    reuse = "—" if stats.reuse_ratio is None else f"{stats.reuse_ratio * 100:.1f}%"
+    return (
+        "📡 <b>Пул соединений Bot API</b>\n\n"
+        f"• Лимит соединений: <b>{stats.limit}</b>\n"
+        f"• Выполняется запросов: <b>{stats.in_flight}</b>\n"
+        f"• Ждут соединения: <b>{stats.queued}</b>\n\n"
+        f"• Всего запросов: <b>{stats.requests}</b>\n"
+        f"• Ждали соединения: <b>{stats.queued_total}</b>\n"
+        f"• Открыто соединений: <b>{stats.created}</b>\n"
+        f"• Переиспользование соединений: <b>{reuse}</b>\n\n"
+        "<i>Счетчики - с запуска процесса, общие для всех ботов процесса.</i>"
+    )
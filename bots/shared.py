@@ -0,0 +1,47 @@
+"""
+Общие объекты процесса: база данных и боты
+
+user_bot и admin_bot получают базу и экземпляры Bot через эти функции.
+При раздельном запуске у каждого процесса свои объекты, как и раньше.
+При запуске обоих ботов в одном процессе (run_all.py) у них одна база
+(и один кеш планов сегментов) и по одному Bot на токен. admin_bot
+делает рассылки тем же ботом, который принимает обновления user_bot,
+а user_bot уведомляет о новых пользователях тем же ботом, который
+обслуживает админов.
+Все боты процесса работают через одну HTTP сессию с общим пулом
+соединений (sessions.py).
+"""
+from typing import Dict, Optional
+
+from aiogram import Bot
+
+from database import Database
+from sessions import PooledAiohttpSession, create_session
+
+_database: Optional[Database] = None
+_session: Optional[PooledAiohttpSession] = None
+_bots: Dict[str, Bot] = {}
+
+
+def get_database() -> Database:
+    """База данных процесса (создается при первом обращении)"""
+    global _database
+    if _database is None:
+        _database = Database()
+    return _database
+
+
+def get_session() -> PooledAiohttpSession:
+    """HTTP сессия ботов процесса (общий пул соединений)"""
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
+
+
+def get_bot(token: str) -> Bot:
+    """Бот для токена: один экземпляр на процесс"""
+    bot = _bots.get(token)
+    if bot is None:
+        bot = _bots[token] = Bot(token=token, session=get_session())
+    return bot
@@ -4,17 +4,29 @@ User Bot - Бот для пользователей
 - Приветственное сообщение по /start
 - Кнопка для открытия мини-приложения
 - Сбор start параметров
-- Отправка уведомлений в админ бот о новых пользователях
+- Отправка уведомлений в админ бот о новых пользователях (сводками при наплыве)
 """
 import asyncio
 import logging
-from aiogram import Bot, Dispatcher, types
+from aiogram import Dispatcher, types
 from aiogram.filters import Command
 from aiogram.types import WebAppInfo, InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.enums import ParseMode
 
-from config import USER_BOT_TOKEN, ADMIN_BOT_TOKEN, ADMIN_BOT_CHAT_ID, WEB_APP_URL
-from database import Database
+from config import (
+    USER_BOT_TOKEN, ADMIN_BOT_TOKEN, ADMIN_BOT_CHAT_ID, WEB_APP_URL,
+    NOTIFY_MIN_WINDOW_SECONDS, NOTIFY_MAX_WINDOW_SECONDS,
+    USER_BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_WORKERS, WEBHOOK_MAX_CONCURRENCY,
+    THROTTLE_RATE, THROTTLE_BURST, THROTTLE_MAX_USERS, ACTIVITY_FLUSH_SECONDS,
+    EVENTS_BUFFER_SIZE, EVENTS_FLUSH_SECONDS
+)
+from shared import get_database, get_bot
+from notifications import NewUserNotifier
+from middlewares import ThrottlingMiddleware
+from activity import ActivityTracker
+from events import EventLog
+from webhook import serve_webhook, set_webhook, run_webhook_workers
 
 # Проверка обязательных параметров
 if not USER_BOT_TOKEN:
@@ -28,57 +40,51 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Инициализация бота и диспетчера
-bot = Bot(token=USER_BOT_TOKEN)
+bot = get_bot(USER_BOT_TOKEN)
 dp = Dispatcher()
 
 # Инициализация базы данных
-db = Database()
+db = get_database()
+
+# Антифлуд: лишние обновления отбрасываются до обработчиков и базы данных
+throttling = ThrottlingMiddleware(
+    db,
+    rate=THROTTLE_RATE,
+    burst=THROTTLE_BURST,
+    max_users=THROTTLE_MAX_USERS
+)
+dp.update.outer_middleware(throttling)
+
+# Дневные скетчи активных пользователей (DAU/WAU/MAU в admin_bot)
+activity_tracker = ActivityTracker(db, flush_interval=ACTIVITY_FLUSH_SECONDS)
+
+# События воронки сохраняются в базу пачками
+event_log = EventLog(db, capacity=EVENTS_BUFFER_SIZE, flush_interval=EVENTS_FLUSH_SECONDS)
 
 # Бот для отправки уведомлений админу
-admin_bot = Bot(token=ADMIN_BOT_TOKEN) if ADMIN_BOT_TOKEN else None
+admin_bot = get_bot(ADMIN_BOT_TOKEN) if ADMIN_BOT_TOKEN else None
 
 
-async def send_notification_to_admin(user_id: int, username: str, 
-                                     first_name: str, start_param: str, 
-                                     total_users: int):
-    """
-    Отправить уведомление в админ бот о новом пользователе
-    
-    Args:
-        user_id: ID пользователя
-        username: Username пользователя
-        first_name: Имя пользователя
-        start_param: Start параметр
-        total_users: Общее количество пользователей
-    """
+async def send_admin_message(text: str):
+    """Отправить HTML-сообщение в чат администратора"""
     if not admin_bot or not ADMIN_BOT_CHAT_ID:
         logger.warning("Админ бот не настроен, уведомление не отправлено")
         return
     
-    try:
-        # Формируем сообщение
-        message_text = (
-            "🆕 <b>Новый пользователь!</b>\n\n"
-            f"👤 <b>ID:</b> {user_id}\n"
-            f"📛 <b>Имя:</b> {first_name}\n"
-        )
-        
-        if username:
-            message_text += f"🔗 <b>Username:</b> @{username}\n"
-        
-        if start_param:
-            message_text += f"🔑 <b>Start параметр:</b> {start_param}\n"
-        
-        message_text += f"\n📊 <b>Всего пользователей:</b> {total_users}"
-        
-        await admin_bot.send_message(
-            chat_id=ADMIN_BOT_CHAT_ID,
-            text=message_text,
-            parse_mode=ParseMode.HTML
-        )
-        logger.info(f"Уведомление отправлено админу о пользователе {user_id}")
-    except Exception as e:
-        logger.error(f"Ошибка при отправке уведомления админу: {e}")
+    await admin_bot.send_message(
+        chat_id=ADMIN_BOT_CHAT_ID,
+        text=text,
+        parse_mode=ParseMode.HTML
+    )
+
+
+# Уведомления о новых пользователях отправляются в фоне пачками
+notifier = NewUserNotifier(
+    send_text=send_admin_message,
+    get_total_users=db.get_user_count,
+    min_window=NOTIFY_MIN_WINDOW_SECONDS,
+    max_window=NOTIFY_MAX_WINDOW_SECONDS
+)
 
 
 @dp.message(Command("start"))
@@ -103,6 +109,8 @@ async def cmd_start(message: types.Message):
         last_name=user.last_name,
         start_param=start_param
     )
+    activity_tracker.track(user_id)
+    event_log.record(user_id, 'start', start_param)
     
     # Формируем приветственное сообщение
     welcome_text = (
@@ -131,15 +139,13 @@ async def cmd_start(message: types.Message):
         parse_mode=ParseMode.HTML
     )
     
-    # Если пользователь новый, отправляем уведомление админу
+    # Если пользователь новый, ставим уведомление админу в очередь
     if is_new_user:
-        total_users = db.get_user_count()
-        await send_notification_to_admin(
+        notifier.notify(
             user_id=user_id,
-            username=user.username or "не указан",
-            first_name=user.first_name or "не указано",
-            start_param=start_param or "не указан",
-            total_users=total_users
+            username=user.username,
+            first_name=user.first_name,
+            start_param=start_param
         )
         logger.info(f"Новый пользователь зарегистрирован: {user_id} (@{user.username})")
     else:
@@ -168,6 +174,7 @@ async def handle_message(message: types.Message):
         first_name=message.from_user.first_name,
         last_name=message.from_user.last_name
     )
+    activity_tracker.track(message.from_user.id)
     
     # Отправляем подсказку
     await message.answer(
@@ -176,8 +183,13 @@ async def handle_message(message: types.Message):
     )
 
 
-async def main():
-    """Главная функция для запуска бота"""
+async def main(handle_signals: bool = True):
+    """
+    Главная функция для запуска бота
+    
+    Args:
+        handle_signals: Останавливаться по SIGINT/SIGTERM (run_all.py обрабатывает их сам)
+    """
     logger.info("Запуск User Bot...")
     
     # Проверяем подключение к базе данных
@@ -188,20 +200,87 @@ async def main():
         logger.error(f"Ошибка подключения к базе данных: {e}")
         return
     
+    # Запускаем фоновую отправку уведомлений админу, сохранение счетчиков антифлуда,
+    # скетчей активности и событий
+    notifier.start()
+    throttling.start()
+    activity_tracker.start()
+    event_log.start()
+    
     # Запускаем бота
     try:
-        await dp.start_polling(bot)
+        await dp.start_polling(bot, handle_signals=handle_signals)
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}")
     finally:
+        await notifier.stop()
+        await throttling.stop()
+        await activity_tracker.stop()
+        await event_log.stop()
         await bot.session.close()
         if admin_bot:
             await admin_bot.session.close()
 
 
+async def webhook_worker_main(workers: int = WEBHOOK_WORKERS):
+    """
+    Воркер режима webhook: принимает обновления от nginx и обрабатывает их
+    
+    Args:
+        workers: Сколько воркеров принимают обновления (делят между собой лимит антифлуда)
+    """
+    throttling.split_between_workers(workers)
+    notifier.start()
+    throttling.start()
+    activity_tracker.start()
+    event_log.start()
+    
+    try:
+        await serve_webhook(
+            dp, bot,
+            host=WEBHOOK_HOST,
+            port=WEBHOOK_PORT,
+            path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_concurrency=WEBHOOK_MAX_CONCURRENCY,
+            reuse_port=workers > 1
+        )
+    finally:
+        await notifier.stop()
+        await throttling.stop()
+        await activity_tracker.stop()
+        await event_log.stop()
+        await bot.session.close()
+        if admin_bot:
+            await admin_bot.session.close()
+
+
+async def register_webhook():
+    """Зарегистрировать webhook в Telegram"""
+    try:
+        await set_webhook(bot, f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}", WEBHOOK_SECRET, dp)
+    finally:
+        await bot.session.close()
+
+
+def run_webhook():
+    """Запуск в режиме webhook (один или несколько процессов)"""
+    if not WEBHOOK_SECRET:
+        raise ValueError("WEBHOOK_SECRET не установлен в переменных окружения. Проверьте файл .env")
+    
+    logger.info(f"Запуск User Bot в режиме webhook (воркеров: {WEBHOOK_WORKERS})...")
+    user_count = db.get_user_count()
+    logger.info(f"База данных подключена. Всего пользователей: {user_count}")
+    
+    asyncio.run(register_webhook())
+    run_webhook_workers(webhook_worker_main, WEBHOOK_WORKERS)
+
+
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if USER_BOT_MODE == 'webhook':
+            run_webhook()
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
-
@@ -0,0 +1,173 @@
+"""
+API мини-приложения: учет открытий
+
+Мини-приложение при запуске отправляет Telegram.WebApp.initData на
+/api/webapp/open. Сервис проверяет подпись initData (HMAC-SHA256 с ключом,
+полученным из USER_BOT_TOKEN, см. документацию Telegram "Validating data
+received via the Mini App") и возраст auth_date, после чего:
+- отмечает активность пользователя (ActivityTracker: скетч DAU/WAU/MAU
+  и users.last_activity, сохраняются пачками);
+- записывает событие воронки webapp_open.
+
+Проверенные initData запоминаются на WEBAPP_VERIFY_CACHE_SECONDS: повторные
+запросы с теми же данными (перезагрузка страницы, повторная отправка)
+не пересчитывают подпись. Запрос не обращается к базе - все пишется
+в фоне, поэтому один процесс обрабатывает тысячи открытий в секунду.
+
+Запуск: python webapp_server.py (за nginx, location /api/webapp/ в deploy/nginx.conf).
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+from config import (
+    USER_BOT_TOKEN, WEBAPP_API_HOST, WEBAPP_API_PORT, WEBAPP_AUTH_MAX_AGE,
+    WEBAPP_VERIFY_CACHE_SECONDS, ACTIVITY_FLUSH_SECONDS,
+    EVENTS_BUFFER_SIZE, EVENTS_FLUSH_SECONDS
+)
+from activity import ActivityTracker
+from database import Database
+from events import EventLog
+
+logger = logging.getLogger(__name__)
+
+OPEN_PATH = '/api/webapp/open'
+
+# initData - несколько сотен байт; все, что сильно больше, отклоняется
+MAX_BODY_SIZE = 8 * 1024
+
+# Сколько проверенных initData держать в памяти
+VERIFY_CACHE_SIZE = 100000
+
+
+class InitDataVerifier:
+    """Проверка подписи initData с кешем уже проверенных данных"""
+    
+    def __init__(self, bot_token: str, max_age: int = 86400, cache_seconds: int = 300,
+                 cache_size: int = VERIFY_CACHE_SIZE):
+        """
+        Args:
+            bot_token: Токен бота, из которого открыто мини-приложение
+            max_age: Максимальный возраст auth_date (секунды)
+            cache_seconds: Сколько помнить проверенные initData
+            cache_size: Максимум записей в кеше
+        """
+        self._secret_key = hmac.new(b'WebAppData', bot_token.encode(), hashlib.sha256).digest()
+        self.max_age = max_age
+        self.cache_seconds = cache_seconds
+        self.cache_size = cache_size
+        # initData -> (ID пользователя, start_param, срок действия записи)
+        self._cache: OrderedDict = OrderedDict()
+    
+    def verify(self, init_data: str) -> Optional[Tuple[int, Optional[str]]]:
+        """
+        Проверить initData
+        
+        Returns:
+            (ID пользователя, start_param) или None, если подпись неверна,
+            данные устарели или в них нет пользователя
+        """
+        now = time.time()
+        cached = self._cache.get(init_data)
+        if cached is not None and cached[2] > now:
+            return cached[0], cached[1]
+        
+        fields = dict(parse_qsl(init_data, keep_blank_values=True))
+        received_hash = fields.pop('hash', None)
+        if not received_hash:
+            return None
+        
+        data_check_string = '\n'.join(f"{key}={fields[key]}" for key in sorted(fields))
+        expected_hash = hmac.new(self._secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(expected_hash, received_hash):
+            return None
+        
+        try:
+            auth_date = int(fields.get('auth_date', 0))
+            user_id = int(json.loads(fields['user'])['id'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if now - auth_date > self.max_age:
+            return None
+        
+        # Запись живет не дольше, чем сами данные остаются действительными
+        expires = min(now + self.cache_seconds, auth_date + self.max_age)
+        self._remember(init_data, (user_id, fields.get('start_param'), expires), now)
+        return user_id, fields.get('start_param')
+    
+    def _remember(self, init_data: str, entry: tuple, now: float):
+        self._cache[init_data] = entry
+        self._cache.move_to_end(init_data)
+        # Вытесняем просроченные записи с начала и лишние сверх лимита
+        while self._cache:
+            oldest = next(iter(self._cache.values()))
+            if oldest[2] > now and len(self._cache) <= self.cache_size:
+                break
+            self._cache.popitem(last=False)
+
+
+def create_webapp_app(verifier: InitDataVerifier, tracker: ActivityTracker,
+                      event_log: EventLog) -> web.Application:
+    """Создать aiohttp приложение API мини-приложения"""
+    
+    async def handle_open(request: web.Request) -> web.Response:
+        init_data = await request.text()
+        verified = verifier.verify(init_data.strip())
+        if verified is None:
+            raise web.HTTPForbidden()
+        user_id, start_param = verified
+        
+        tracker.track(user_id, touch=True)
+        event_log.record(user_id, 'webapp_open', start_param)
+        return web.Response(status=204)
+    
+    app = web.Application(client_max_size=MAX_BODY_SIZE)
+    app.router.add_post(OPEN_PATH, handle_open)
+    return app
+
+
+async def serve_webapp_api(db: Database, bot_token: str, host: str, port: int):
+    """Запустить API мини-приложения и работать до отмены"""
+    verifier = InitDataVerifier(
+        bot_token, max_age=WEBAPP_AUTH_MAX_AGE, cache_seconds=WEBAPP_VERIFY_CACHE_SECONDS
+    )
+    tracker = ActivityTracker(db, flush_interval=ACTIVITY_FLUSH_SECONDS)
+    event_log = EventLog(db, capacity=EVENTS_BUFFER_SIZE, flush_interval=EVENTS_FLUSH_SECONDS)
+    app = create_webapp_app(verifier, tracker, event_log)
+    
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port)
+    await site.start()
+    tracker.start()
+    event_log.start()
+    logger.info(f"API мини-приложения слушает http://{host}:{port}{OPEN_PATH}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await tracker.stop()
+        await event_log.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if not USER_BOT_TOKEN:
+        raise ValueError("USER_BOT_TOKEN не установлен в переменных окружения. Проверьте файл .env")
+    
+    try:
+        asyncio.run(serve_webapp_api(Database(), USER_BOT_TOKEN, WEBAPP_API_HOST, WEBAPP_API_PORT))
+    except KeyboardInterrupt:
+        logger.info("API мини-приложения остановлено")
@@ -0,0 +1,139 @@
+"""
+Режим webhook для ботов
+
+Вместо long polling Telegram сам присылает обновления POST-запросами
+на WEBHOOK_BASE_URL + путь бота. nginx проксирует их на локальный
+aiohttp сервер (см. deploy/nginx.conf). Каждое обновление подтверждается
+ответом 200 сразу, а обрабатывается в фоне, поэтому медленный обработчик
+не задерживает прием следующих обновлений.
+
+Можно запустить несколько процессов-воркеров: все они слушают один порт
+(SO_REUSEPORT), и ядро распределяет входящие соединения между ними.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик webhook с ограничением числа одновременно обрабатываемых обновлений
+    
+    Ответ Telegram отправляется сразу, а обработка ждет свободного слота,
+    чтобы всплеск обновлений не создал тысячи одновременных запросов к БД.
+    """
+    
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrency: int,
+                 secret_token: Optional[str] = None, **data: Any):
+        super().__init__(dispatcher, bot, handle_in_background=True,
+                         secret_token=secret_token, **data)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        async with self._semaphore:
+            try:
+                await super()._background_feed_update(bot=bot, update=update)
+            except Exception as e:
+                # Ответ Telegram уже отправлен, поэтому ошибку остается только залогировать
+                logger.error(f"Ошибка при обработке обновления {update.get('update_id')}: {e}")
+
+
+def create_webhook_app(dp: Dispatcher, bot: Bot, path: str, secret_token: str,
+                       max_concurrency: int) -> web.Application:
+    """Создать aiohttp приложение, принимающее обновления бота"""
+    app = web.Application()
+    LimitedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        max_concurrency=max_concurrency,
+        secret_token=secret_token
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def set_webhook(bot: Bot, url: str, secret_token: str, dp: Dispatcher):
+    """Зарегистрировать webhook в Telegram (выполняется один раз, а не в каждом воркере)"""
+    await bot.set_webhook(
+        url=url,
+        secret_token=secret_token,
+        allowed_updates=dp.resolve_used_update_types(),
+        drop_pending_updates=False
+    )
+    logger.info(f"Webhook установлен: {url}")
+
+
+async def serve_webhook(dp: Dispatcher, bot: Bot, host: str, port: int, path: str,
+                        secret_token: str, max_concurrency: int, reuse_port: bool = False):
+    """Запустить aiohttp сервер webhook и работать до отмены"""
+    app = create_webhook_app(dp, bot, path, secret_token, max_concurrency)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host=host, port=port, reuse_port=reuse_port)
+    await site.start()
+    logger.info(f"Webhook сервер слушает http://{host}:{port}{path}")
+    
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def _raise_keyboard_interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _run_worker(worker_main: Callable[[], Awaitable[None]]):
+    """Точка входа процесса-воркера"""
+    # systemd останавливает сервис через SIGTERM: завершаемся так же, как по Ctrl+C,
+    # чтобы отработали блоки finally (закрытие сессий, отправка накопленного)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    try:
+        asyncio.run(worker_main())
+    except KeyboardInterrupt:
+        pass
+
+
+def run_webhook_workers(worker_main: Callable[[], Awaitable[None]], workers: int):
+    """
+    Запустить воркеры webhook
+    
+    Args:
+        worker_main: Корутина-функция уровня модуля, запускающая serve_webhook
+            (должна импортироваться по имени - процессы запускаются через spawn)
+        workers: Количество процессов
+    """
+    if workers <= 1:
+        _run_worker(worker_main)
+        return
+    
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=_run_worker, args=(worker_main,), name=f"webhook-worker-{index}")
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info(f"Запущено воркеров webhook: {workers}")
+    
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Воркеры завершаются по SIGTERM штатно (см. _run_worker)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.kill()
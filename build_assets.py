@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+"""
+Сборка статики сайта в dist/
+
+- CSS и JS, подключенные в index.html, минифицируются и получают в имени
+  хеш содержимого (assets/styles.3f2a9c1b.css) - такие файлы nginx отдает
+  с кешем на год, а новая версия автоматически получает новое имя
+  (update-version.sh с ?v=... больше не нужен);
+- ссылки в index.html переписываются на собранные файлы;
+- рядом с каждым файлом пишутся .gz и .br (если установлен пакет brotli),
+  чтобы nginx отдавал готовое сжатие (gzip_static/brotli_static)
+  и не сжимал файлы на каждый запрос;
+- images/ копируется в dist/images, build_images.py создает рядом
+  WebP/AVIF варианты, а <img> в index.html заменяются на <picture> с srcset.
+
+Сборка инкрементальная: в dist/manifest.json хранится хеш каждого исходника,
+неизмененные файлы не минифицируются и не сжимаются повторно.
+
+Запуск: python3 build_assets.py [--force]
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli нужен только для .br файлов
+    brotli = None
+
+import build_images
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent
+DIST = ROOT / 'dist'
+ASSETS_DIR = 'assets'
+MANIFEST_NAME = 'manifest.json'
+
+# Меняется при изменении минификации: все файлы пересобираются
+BUILD_VERSION = 1
+
+# Длина хеша в имени файла
+HASH_LENGTH = 8
+
+# Файлы меньше этого размера не сжимаются (как gzip_min_length в nginx)
+COMPRESS_MIN_SIZE = 1024
+
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg')
+
+# Ссылки на локальные CSS/JS в index.html
+ASSET_REFERENCE = re.compile(
+    r'(<(?:link|script)\b[^>]*?\b(?:href|src)=")([^"?#:]+\.(?:css|js))(?:\?[^"]*)?(")'
+)
+
+WORD_CHARS = re.compile(r'[\w$\\\u0080-\uffff]')
+
+# После этих символов и слов "/" начинает регулярное выражение, а не деление
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = {
+    'return', 'typeof', 'instanceof', 'case', 'in', 'of', 'new',
+    'delete', 'void', 'throw', 'else', 'do', 'yield', 'await',
+}
+
+
+def minify_css(source: str) -> str:
+    """Удалить комментарии и лишние пробелы (строки не изменяются)"""
+    out = []
+    i, length = 0, len(source)
+    pending_space = False
+    
+    while i < length:
+        char = source[i]
+        if char == '/' and source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            i = length if end == -1 else end + 2
+            pending_space = True
+            continue
+        if char.isspace():
+            pending_space = True
+            i += 1
+            continue
+        
+        if pending_space and out:
+            # Пробел нужен только между словами (селекторы потомков, значения
+            # вроде "1px solid"), вокруг скобок и разделителей он лишний
+            if out[-1][-1] not in '{};,>:(' and char not in '{};,>)':
+                out.append(' ')
+        pending_space = False
+        
+        if char in '"\'':
+            end = _string_end(source, i)
+            out.append(source[i:end])
+            i = end
+            continue
+        if char == '}' and out and out[-1] == ';':
+            out.pop()
+        out.append(char)
+        i += 1
+    return ''.join(out)
+
+
+def minify_js(source: str) -> str:
+    """
+    Безопасная минификация JS: удалить комментарии, отступы и пробелы,
+    не нужные для разбора. Переводы строк сохраняются там, где от них может
+    зависеть автоматическая вставка точки с запятой; строки, шаблоны
+    и регулярные выражения не изменяются.
+    """
+    out = []
+    i, length = 0, len(source)
+    whitespace: Optional[str] = None   # None, ' ' или '\n' - пропущенный разделитель
+    last_token = ''                    # Последнее слово или символ (для поиска регулярок)
+    
+    def emit(text: str):
+        nonlocal whitespace
+        if whitespace is not None and out:
+            previous, following = out[-1][-1], text[0]
+            if whitespace == '\n' and previous not in '{;,([' and following not in ')]},;':
+                out.append('\n')
+            elif (WORD_CHARS.match(previous) and WORD_CHARS.match(following)) \
+                    or (previous in '+-/' and following in '+-/'):
+                out.append(' ')
+        whitespace = None
+        out.append(text)
+    
+    while i < length:
+        char = source[i]
+        if char.isspace():
+            if char == '\n' or whitespace == '\n':
+                whitespace = '\n'
+            else:
+                whitespace = ' '
+            i += 1
+            continue
+        
+        if char == '/' and source.startswith('//', i):
+            end = source.find('\n', i)
+            i = length if end == -1 else end
+            continue
+        if char == '/' and source.startswith('/*', i):
+            end = source.find('*/', i + 2)
+            comment = source[i:length if end == -1 else end + 2]
+            i += len(comment)
+            if '\n' in comment:
+                whitespace = '\n'
+            elif whitespace is None:
+                whitespace = ' '
+            continue
+        
+        if char in '"\'':
+            end = _string_end(source, i)
+        elif char == '`':
+            end = _template_end(source, i)
+        elif char == '/' and (not last_token or last_token in REGEX_PRECEDERS
+                              or last_token in REGEX_KEYWORDS):
+            end = _regex_end(source, i)
+        elif WORD_CHARS.match(char):
+            end = i + 1
+            while end < length and WORD_CHARS.match(source[end]):
+                end += 1
+        else:
+            end = i + 1
+        
+        token = source[i:end]
+        emit(token)
+        last_token = token if WORD_CHARS.match(char) or len(token) == 1 else token[-1]
+        i = end
+    return ''.join(out)
+
+
+def _string_end(source: str, start: int) -> int:
+    """Позиция после строки в кавычках, начинающейся в start"""
+    quote = source[start]
+    i = start + 1
+    while i < len(source):
+        if source[i] == '\\':
+            i += 2
+            continue
+        if source[i] == quote or source[i] == '\n':
+            return i + 1
+        i += 1
+    return i
+
+
+def _template_end(source: str, start: int) -> int:
+    """Позиция после шаблонной строки `...${...}...` (с вложенными шаблонами)"""
+    i = start + 1
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '`':
+            return i + 1
+        if source.startswith('${', i):
+            i += 2
+            depth = 1
+            while i < len(source) and depth:
+                char = source[i]
+                if char in '"\'':
+                    i = _string_end(source, i)
+                    continue
+                if char == '`':
+                    i = _template_end(source, i)
+                    continue
+                if char == '{':
+                    depth += 1
+                elif char == '}':
+                    depth -= 1
+                i += 1
+            continue
+        i += 1
+    return i
+
+
+def _regex_end(source: str, start: int) -> int:
+    """Позиция после регулярного выражения /.../флаги"""
+    i = start + 1
+    in_class = False
+    while i < len(source):
+        char = source[i]
+        if char == '\\':
+            i += 2
+            continue
+        if char == '\n':
+            return i
+        if char == '[':
+            in_class = True
+        elif char == ']':
+            in_class = False
+        elif char == '/' and not in_class:
+            i += 1
+            while i < len(source) and source[i].isalpha():
+                i += 1
+            return i
+        i += 1
+    return i
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def write_compressed(path: Path, data: bytes):
+    """Записать .gz и .br рядом с файлом (или удалить устаревшие)"""
+    variants = {'.gz': lambda: gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = lambda: brotli.compress(data, quality=11)
+    
+    for suffix in ('.gz', '.br'):
+        target = path.with_name(path.name + suffix)
+        if len(data) < COMPRESS_MIN_SIZE or suffix not in variants:
+            target.unlink(missing_ok=True)
+            continue
+        compressed = variants[suffix]()
+        # Сжатая версия больше исходной бесполезна - nginx отдаст исходную
+        if len(compressed) < len(data):
+            target.write_bytes(compressed)
+        else:
+            target.unlink(missing_ok=True)
+
+
+def write_file(path: Path, data: bytes):
+    """Записать файл и его сжатые версии"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    if path.suffix in COMPRESSIBLE:
+        write_compressed(path, data)
+
+
+class AssetBuilder:
+    """Сборка dist/ с учетом предыдущего манифеста"""
+    
+    def __init__(self, root: Path = ROOT, dist: Path = DIST, force: bool = False):
+        self.root = root
+        self.dist = dist
+        self.force = force
+        self.previous = {} if force else self._load_manifest()
+        self.manifest: Dict[str, Dict] = {}
+        # Манифест вариантов изображений (build_images.py)
+        self.images: Dict[str, Dict] = {}
+        self.built = 0
+        self.skipped = 0
+    
+    def _load_manifest(self) -> Dict[str, Dict]:
+        try:
+            manifest = json.loads((self.dist / MANIFEST_NAME).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != BUILD_VERSION:
+            return {}
+        return manifest.get('files', {})
+    
+    def _unchanged(self, name: str, source_hash: str) -> bool:
+        entry = self.previous.get(name)
+        return (
+            entry is not None
+            and entry['source'] == source_hash
+            and (self.dist / entry['file']).exists()
+        )
+    
+    def build_asset(self, name: str) -> Optional[str]:
+        """
+        Собрать CSS/JS файл
+        
+        Returns:
+            Путь собранного файла относительно dist/ или None, если исходника нет
+        """
+        source_path = self.root / name
+        if not source_path.is_file():
+            logger.warning(f"Файл {name} подключен в index.html, но не найден - ссылка не изменена")
+            return None
+        
+        source = source_path.read_bytes()
+        source_hash = content_hash(source)
+        if self._unchanged(name, source_hash):
+            self.manifest[name] = self.previous[name]
+            self.skipped += 1
+            return self.manifest[name]['file']
+        
+        minified = MINIFIERS[source_path.suffix](source.decode('utf-8')).encode('utf-8')
+        stem = Path(name).stem
+        output = f"{ASSETS_DIR}/{stem}.{content_hash(minified)[:HASH_LENGTH]}{source_path.suffix}"
+        write_file(self.dist / output, minified)
+        
+        self.manifest[name] = {'source': source_hash, 'file': output, 'size': len(minified)}
+        self.built += 1
+        logger.info(f"{name}: {len(source)} -> {len(minified)} байт ({output})")
+        return output
+    
+    def build_html(self, name: str = 'index.html'):
+        """Переписать ссылки на CSS/JS и изображения в HTML на собранные файлы"""
+        html = (self.root / name).read_text(encoding='utf-8')
+        
+        def replace(match: re.Match) -> str:
+            built = self.build_asset(match.group(2))
+            if built is None:
+                return match.group(0)
+            return f"{match.group(1)}{built}{match.group(3)}"
+        
+        html = ASSET_REFERENCE.sub(replace, html)
+        output = build_images.rewrite_images(html, self.images).encode('utf-8')
+        target = self.dist / name
+        # HTML зависит от собранных файлов, поэтому сравнивается результат
+        if self.force or not target.exists() or target.read_bytes() != output:
+            write_file(target, output)
+    
+    def copy_tree(self, directory: str):
+        """Скопировать каталог в dist/, пропуская файлы без изменений"""
+        source_dir = self.root / directory
+        if not source_dir.is_dir():
+            return
+        
+        for source in source_dir.rglob('*'):
+            if not source.is_file():
+                continue
+            target = self.dist / source.relative_to(self.root)
+            stat = source.stat()
+            if not self.force and target.exists():
+                target_stat = target.stat()
+                if target_stat.st_size == stat.st_size and target_stat.st_mtime >= stat.st_mtime:
+                    continue
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.copy2(source, target)
+            if target.suffix in COMPRESSIBLE:
+                write_compressed(target, target.read_bytes())
+    
+    def remove_stale(self):
+        """
+        Удалить собранные файлы, которых нет ни в текущей, ни в предыдущей сборке
+        
+        Файлы предыдущей сборки остаются: браузеры с закешированным старым
+        index.html еще некоторое время запрашивают их.
+        """
+        keep = {entry['file'] for entry in self.manifest.values()}
+        keep.update(entry['file'] for entry in self.previous.values())
+        assets = self.dist / ASSETS_DIR
+        if not assets.is_dir():
+            return
+        
+        for path in assets.iterdir():
+            name = path.name.removesuffix('.gz').removesuffix('.br')
+            if f"{ASSETS_DIR}/{name}" not in keep:
+                path.unlink()
+    
+    def save_manifest(self):
+        manifest = {'version': BUILD_VERSION, 'files': self.manifest}
+        (self.dist / MANIFEST_NAME).write_text(
+            json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True), encoding='utf-8'
+        )
+    
+    def build(self):
+        self.dist.mkdir(exist_ok=True)
+        self.copy_tree('images')
+        if build_images.Image is not None:
+            self.images = build_images.ImagePipeline(
+                self.root / build_images.SOURCE_DIR, self.dist / build_images.SOURCE_DIR,
+                force=self.force
+            ).build()
+        else:
+            logger.warning("Pillow не установлен - варианты изображений не создаются (pip install Pillow)")
+        self.build_html()
+        self.remove_stale()
+        self.save_manifest()
+        logger.info(f"Сборка завершена: собрано {self.built}, без изменений {self.skipped}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сборка статики сайта в dist/")
+    parser.add_argument('--force', action='store_true', help="Пересобрать все файлы")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if brotli is None:
+        logger.warning("Пакет brotli не установлен - .br файлы не создаются (pip install brotli)")
+    
+    AssetBuilder(force=args.force).build()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Адаптивные варианты изображений из images/ (WebP и AVIF нескольких ширин)
+
+Исходные PNG весят сотни килобайт и больше, а мини-приложение показывает
+их в колонке шириной 440px. Для каждого изображения создаются уменьшенные
+копии шириной WIDTHS (не больше исходной) в форматах WebP и AVIF (если
+Pillow собран с поддержкой AVIF), браузер выбирает подходящую по srcset.
+Изображения обрабатываются параллельно в нескольких процессах.
+
+Имена вариантов содержат хеш исходника (hero.3f2a9c1b.640.webp), поэтому
+nginx отдает их с кешем на год. В dist/images/variants.json хранится
+хеш каждого исходника и список его вариантов: неизмененные изображения
+не обрабатываются повторно, а build_assets.py по этому манифесту
+заменяет <img> в index.html на <picture> с srcset.
+
+Запуск: python3 build_images.py [--force] [--workers N]
+(build_assets.py запускает его сам)
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from html import escape
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from PIL import Image, ImageOps, features
+except ImportError:  # Pillow нужен только для вариантов изображений
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent
+SOURCE_DIR = 'images'
+OUTPUT_DIR = ROOT / 'dist' / SOURCE_DIR
+MANIFEST_NAME = 'variants.json'
+
+# Меняется при изменении ширин или настроек сжатия: все варианты пересоздаются
+PIPELINE_VERSION = 1
+
+# Ширины вариантов: иконки (96) и колонка 440px при плотности экрана 1x-3x
+WIDTHS = (96, 320, 440, 660, 880, 1320)
+
+# Формат -> параметры сохранения Pillow; порядок - порядок <source> в <picture>
+FORMATS = {
+    'avif': {'quality': 50, 'speed': 6},
+    'webp': {'quality': 80, 'method': 6},
+}
+
+SOURCE_SUFFIXES = ('.png', '.jpg', '.jpeg')
+
+# Ширина изображения на странице, если у <img> нет своего атрибута sizes
+DEFAULT_SIZES = '(max-width: 440px) 100vw, 440px'
+
+IMG_TAG = re.compile(r'<img\b[^>]*>')
+IMG_SOURCE = re.compile(r'\b(data-src|src)="([^"]+)"')
+
+
+def available_formats() -> Dict[str, Dict]:
+    """Форматы из FORMATS, которые поддерживает установленный Pillow"""
+    return {name: options for name, options in FORMATS.items() if features.check(name)}
+
+
+def variant_widths(width: int) -> List[int]:
+    """Ширины вариантов для исходной ширины (без увеличения)"""
+    widths = {w for w in WIDTHS if w < width}
+    widths.add(min(width, WIDTHS[-1]))
+    return sorted(widths)
+
+
+def process_image(source: str, output_dir: str, source_hash: str,
+                  formats: Dict[str, Dict]) -> Dict:
+    """
+    Создать варианты одного изображения (выполняется в процессе пула)
+    
+    Returns:
+        Запись манифеста: размеры исходника и файлы вариантов по форматам
+    """
+    stem = Path(source).stem
+    with Image.open(source) as opened:
+        image = ImageOps.exif_transpose(opened)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        width, height = image.size
+        
+        resized = {
+            w: image if w == width else image.resize((w, round(height * w / width)), Image.LANCZOS)
+            for w in variant_widths(width)
+        }
+        variants = {}
+        for name, options in formats.items():
+            files = []
+            for w, variant in resized.items():
+                filename = f"{stem}.{source_hash[:8]}.{w}.{name}"
+                variant.save(os.path.join(output_dir, filename), name.upper(), **options)
+                files.append([w, filename])
+            variants[name] = files
+    
+    return {'source': source_hash, 'width': width, 'height': height, 'variants': variants}
+
+
+class ImagePipeline:
+    """Создание вариантов изображений с учетом предыдущего манифеста"""
+    
+    def __init__(self, source_dir: Path = ROOT / SOURCE_DIR, output_dir: Path = OUTPUT_DIR,
+                 workers: Optional[int] = None, force: bool = False):
+        """
+        Args:
+            source_dir: Каталог исходных изображений
+            output_dir: Каталог вариантов (dist/images)
+            workers: Количество процессов (по умолчанию - по числу ядер)
+            force: Пересоздать все варианты
+        """
+        self.source_dir = source_dir
+        self.output_dir = output_dir
+        self.workers = workers
+        self.formats = available_formats()
+        self.previous = {} if force else self._load_manifest()
+    
+    def _load_manifest(self) -> Dict[str, Dict]:
+        try:
+            manifest = json.loads((self.output_dir / MANIFEST_NAME).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+        if manifest.get('version') != PIPELINE_VERSION or manifest.get('formats') != list(self.formats):
+            return {}
+        return manifest.get('images', {})
+    
+    def _unchanged(self, key: str, source_hash: str) -> bool:
+        entry = self.previous.get(key)
+        return (
+            entry is not None
+            and entry['source'] == source_hash
+            and all((self.output_dir / filename).exists()
+                    for files in entry['variants'].values() for _, filename in files)
+        )
+    
+    def build(self) -> Dict[str, Dict]:
+        """
+        Создать варианты измененных изображений
+        
+        Returns:
+            Манифест: путь исходника на сайте (images/hero.png) -> запись
+        """
+        if 'avif' not in self.formats:
+            logger.warning("Pillow собран без поддержки AVIF - создаются только WebP")
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        
+        manifest: Dict[str, Dict] = {}
+        jobs = {}
+        for source in sorted(self.source_dir.iterdir()):
+            if source.suffix.lower() not in SOURCE_SUFFIXES:
+                continue
+            key = f"{SOURCE_DIR}/{source.name}"
+            source_hash = hashlib.sha256(source.read_bytes()).hexdigest()
+            if self._unchanged(key, source_hash):
+                manifest[key] = self.previous[key]
+            else:
+                jobs[key] = (str(source), str(self.output_dir), source_hash, self.formats)
+        unchanged = len(manifest)
+        
+        if jobs:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {pool.submit(process_image, *args): key for key, args in jobs.items()}
+                for future in as_completed(futures):
+                    key = futures[future]
+                    try:
+                        manifest[key] = future.result()
+                    except Exception as e:
+                        # Без вариантов страница использует исходное изображение
+                        logger.error(f"Ошибка при обработке {key}: {e}")
+                        continue
+                    logger.info(f"{key}: {self._describe(key, manifest[key])}")
+        
+        self._remove_stale(manifest)
+        self._save_manifest(manifest)
+        logger.info(f"Изображения: обработано {len(jobs)}, без изменений {unchanged}")
+        return manifest
+    
+    def _describe(self, key: str, entry: Dict) -> str:
+        original = (self.source_dir / Path(key).name).stat().st_size
+        parts = []
+        for name, files in entry['variants'].items():
+            width, filename = files[-1]
+            size = (self.output_dir / filename).stat().st_size
+            parts.append(f"{name} {width}px {size // 1024} КБ")
+        return f"{original // 1024} КБ -> " + ", ".join(parts)
+    
+    def _remove_stale(self, manifest: Dict[str, Dict]):
+        """Удалить варианты из предыдущего манифеста, которых нет в новом"""
+        current = {filename for entry in manifest.values()
+                   for files in entry['variants'].values() for _, filename in files}
+        for entry in self.previous.values():
+            for files in entry['variants'].values():
+                for _, filename in files:
+                    if filename not in current:
+                        (self.output_dir / filename).unlink(missing_ok=True)
+    
+    def _save_manifest(self, manifest: Dict[str, Dict]):
+        data = {'version': PIPELINE_VERSION, 'formats': list(self.formats), 'images': manifest}
+        (self.output_dir / MANIFEST_NAME).write_text(
+            json.dumps(data, ensure_ascii=False, indent=2, sort_keys=True), encoding='utf-8'
+        )
+
+
+def srcset(entry: Dict, image_format: str) -> str:
+    """Значение srcset для формата: "images/a.1b2c.320.webp 320w, ..." """
+    return ', '.join(f"{SOURCE_DIR}/{filename} {width}w"
+                     for width, filename in entry['variants'][image_format])
+
+
+def render_picture(tag: str, entry: Dict) -> str:
+    """
+    Обернуть <img> в <picture> с вариантами
+    
+    Ленивые изображения (data-src) получают data-srcset - script.js переносит
+    его в srcset при появлении изображения на экране. Исходный src остается
+    запасным вариантом.
+    """
+    lazy = 'data-src="' in tag
+    attribute = 'data-srcset' if lazy else 'srcset'
+    sizes_match = re.search(r'\bsizes="([^"]*)"', tag)
+    sizes = sizes_match.group(1) if sizes_match else DEFAULT_SIZES
+    
+    formats = list(entry['variants'])
+    # Последний формат (WebP) - в самом <img>, остальные - в <source>
+    sources = ''.join(
+        f'<source type="image/{name}" {attribute}="{escape(srcset(entry, name))}" sizes="{escape(sizes)}">'
+        for name in formats[:-1]
+    )
+    extra = f' {attribute}="{escape(srcset(entry, formats[-1]))}"'
+    if not sizes_match:
+        extra += f' sizes="{escape(sizes)}"'
+    img = tag[:-1].rstrip('/ ') + extra + '>'
+    return f"<picture>{sources}{img}</picture>"
+
+
+def rewrite_images(html: str, manifest: Dict[str, Dict]) -> str:
+    """Заменить <img> с изображениями из манифеста на <picture>"""
+    
+    def replace(match: re.Match) -> str:
+        tag = match.group(0)
+        sources = dict(IMG_SOURCE.findall(tag))
+        entry = manifest.get(sources.get('data-src') or sources.get('src'))
+        if not entry or not entry['variants'] or 'srcset=' in tag:
+            return tag
+        return render_picture(tag, entry)
+    
+    return IMG_TAG.sub(replace, html)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Варианты изображений из images/ в dist/images")
+    parser.add_argument('--force', action='store_true', help="Пересоздать все варианты")
+    parser.add_argument('--workers', type=int, default=None, help="Количество процессов")
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if Image is None:
+        raise SystemExit("Pillow не установлен: pip install Pillow")
+    
+    ImagePipeline(workers=args.workers, force=args.force).build()
+
+
+if __name__ == "__main__":
+    main()
@@ -8,21 +8,17 @@ echo "🚀 Быстрый деплой исправлений..."
 echo "Сервер: $SERVER"
 echo ""
 
-# Обновляем версию файлов для обхода кеша
-echo "🔄 Обновление версии файлов..."
-./update-version.sh
+# Собираем статику (неизмененные файлы не пересобираются)
+echo "🔨 Сборка статики..."
+python3 build_assets.py
 
-# Копируем только измененные файлы
+# Копируем только измененные файлы собранной статики
 echo "📦 Копирование файлов..."
-scp styles.css "$SERVER:$REMOTE_DIR/styles.css"
-scp telegram-webapp.js "$SERVER:$REMOTE_DIR/telegram-webapp.js"
-scp debug-panel.js "$SERVER:$REMOTE_DIR/debug-panel.js"
-scp index.html "$SERVER:$REMOTE_DIR/index.html"
+rsync -az dist/ "$SERVER:$REMOTE_DIR/dist/"
 
 # Настройка прав
 echo "🔐 Настройка прав доступа..."
-ssh "$SERVER" "chown www-data:www-data $REMOTE_DIR/styles.css $REMOTE_DIR/telegram-webapp.js $REMOTE_DIR/debug-panel.js $REMOTE_DIR/index.html"
-ssh "$SERVER" "chmod 644 $REMOTE_DIR/styles.css $REMOTE_DIR/telegram-webapp.js $REMOTE_DIR/debug-panel.js $REMOTE_DIR/index.html"
+ssh "$SERVER" "chown -R www-data:www-data $REMOTE_DIR/dist && chmod -R 755 $REMOTE_DIR/dist"
 
 # Обновление nginx конфигурации (если изменилась)
 echo "🌐 Проверка конфигурации Nginx..."
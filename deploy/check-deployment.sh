@@ -49,6 +49,22 @@ else
     echo -e "${RED}❌${NC}"
 fi
 
+echo -n "Проверка API мини-приложения... "
+if ssh "$SERVER" "systemctl is-active --quiet webapp-api.service"; then
+    echo -e "${GREEN}✅${NC}"
+else
+    echo -e "${RED}❌${NC}"
+fi
+
+echo -n "Проверка сервиса переходов... "
+if ssh "$SERVER" "systemctl is-active --quiet click-redirect.service"; then
+    echo -e "${GREEN}✅${NC}"
+elif ssh "$SERVER" "grep -qE '^CLICK_SECRET=.+' /var/www/annaivaschenko.ru/bots/.env 2>/dev/null"; then
+    echo -e "${RED}❌${NC}"
+else
+    echo -e "${YELLOW}⚠️  не используется (CLICK_SECRET не задан)${NC}"
+fi
+
 # Проверка Nginx
 echo -n "Проверка Nginx... "
 if ssh "$SERVER" "systemctl is-active --quiet nginx"; then
@@ -38,11 +38,9 @@ echo -e "${GREEN}✅ Подключение установлено${NC}"
 echo -e "${YELLOW}📁 Создание директорий на сервере...${NC}"
 ssh "$SERVER" "mkdir -p $REMOTE_DIR/bots $REMOTE_DIR/logs /var/log/annaivaschenko"
 
-# Обновление версии файлов для обхода кеша
-echo -e "${YELLOW}🔄 Обновление версии файлов...${NC}"
-if [ -f "$LOCAL_DIR/update-version.sh" ]; then
-    bash "$LOCAL_DIR/update-version.sh"
-fi
+# Сборка статики (минификация, хеши в именах, .gz/.br) в dist/
+echo -e "${YELLOW}🔨 Сборка статики...${NC}"
+python3 "$LOCAL_DIR/build_assets.py"
 
 # Копирование файлов проекта
 echo -e "${YELLOW}📦 Копирование файлов проекта...${NC}"
@@ -97,13 +95,18 @@ fi
 echo -e "${YELLOW}⚙️  Настройка systemd сервисов...${NC}"
 scp "$LOCAL_DIR/deploy/user-bot.service" "$SERVER:/tmp/user-bot.service"
 scp "$LOCAL_DIR/deploy/admin-bot.service" "$SERVER:/tmp/admin-bot.service"
+scp "$LOCAL_DIR/deploy/click-redirect.service" "$SERVER:/tmp/click-redirect.service"
+scp "$LOCAL_DIR/deploy/webapp-api.service" "$SERVER:/tmp/webapp-api.service"
 
 ssh "$SERVER" << 'ENDSSH'
 sudo mv /tmp/user-bot.service /etc/systemd/system/user-bot.service
 sudo mv /tmp/admin-bot.service /etc/systemd/system/admin-bot.service
+sudo mv /tmp/click-redirect.service /etc/systemd/system/click-redirect.service
+sudo mv /tmp/webapp-api.service /etc/systemd/system/webapp-api.service
 sudo systemctl daemon-reload
 sudo systemctl enable user-bot.service
 sudo systemctl enable admin-bot.service
+sudo systemctl enable webapp-api.service
 ENDSSH
 
 # Настройка Nginx
@@ -121,8 +124,20 @@ echo -e "${YELLOW}🔄 Перезапуск ботов...${NC}"
 ssh "$SERVER" << 'ENDSSH'
 sudo systemctl restart user-bot.service
 sudo systemctl restart admin-bot.service
+sudo systemctl restart webapp-api.service
 sudo systemctl status user-bot.service --no-pager
 sudo systemctl status admin-bot.service --no-pager
+sudo systemctl status webapp-api.service --no-pager
+
+# Сервис переходов (location /c/ в nginx) нужен, только если задан CLICK_SECRET
+if grep -qE '^CLICK_SECRET=.+' /var/www/annaivaschenko.ru/bots/.env 2>/dev/null; then
+    sudo systemctl enable click-redirect.service
+    sudo systemctl restart click-redirect.service
+    sudo systemctl status click-redirect.service --no-pager
+else
+    sudo systemctl disable --now click-redirect.service 2>/dev/null || true
+    echo "CLICK_SECRET не задан в .env: сервис переходов не запущен (кнопки ведут прямо на ссылки)"
+fi
 ENDSSH
 
 echo ""
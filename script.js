@@ -1,4 +1,18 @@
 document.addEventListener('DOMContentLoaded', function() {
+    // Variants from the build (<picture>, data-srcset): the browser picks size and format
+    const showImage = (img) => {
+        const picture = img.parentElement;
+        if (picture && picture.tagName === 'PICTURE') {
+            picture.querySelectorAll('source[data-srcset]').forEach(source => {
+                source.srcset = source.dataset.srcset;
+            });
+        }
+        if (img.dataset.srcset) {
+            img.srcset = img.dataset.srcset;
+        }
+        img.src = img.dataset.src;
+    };
+
     // Lazy loading with Intersection Observer
     const lazyLoadImages = () => {
         const imageObserverConfig = {
@@ -16,10 +30,7 @@ document.addEventListener('DOMContentLoaded', function() {
                     
                     const loadImage = () => {
                         if (src) {
-                            const tempImg = new Image();
-                            
-                            tempImg.onload = () => {
-                                img.src = src;
+                            img.addEventListener('load', () => {
                                 requestAnimationFrame(() => {
                                     img.classList.add('loaded');
                                     img.classList.remove('lazy');
@@ -30,17 +41,16 @@ document.addEventListener('DOMContentLoaded', function() {
                                         }, 400);
                                     }
                                 });
-                            };
+                            }, { once: true });
                             
-                            tempImg.onerror = () => {
+                            img.addEventListener('error', () => {
                                 console.warn('Failed to load image:', src);
-                                img.src = src;
                                 if (parent) {
                                     parent.classList.remove('skeleton-loader');
                                 }
-                            };
+                            }, { once: true });
                             
-                            tempImg.src = src;
+                            showImage(img);
                         }
                         observer.unobserve(img);
                     };
@@ -64,7 +74,7 @@ document.addEventListener('DOMContentLoaded', function() {
     } else {
         document.querySelectorAll('img.lazy').forEach(img => {
             if (img.dataset.src) {
-                img.src = img.dataset.src;
+                showImage(img);
                 img.classList.add('loaded');
                 img.classList.remove('lazy');
             }
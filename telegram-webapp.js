@@ -35,6 +35,9 @@ class TelegramWebApp {
             // Уведомляем Telegram, что приложение готово
             this.webApp.ready();
 
+            // Сообщаем серверу об открытии (учет активности пользователей)
+            this.reportOpen();
+
             // ВАЖНО: Сначала запрашиваем viewport для получения правильных размеров
             this.webApp.requestViewport();
 
@@ -624,6 +627,27 @@ class TelegramWebApp {
         }
     }
 
+    /**
+     * Отправка initData на сервер при открытии мини-приложения
+     * Сервер проверяет подпись и учитывает открытие (bots/webapp_server.py)
+     */
+    reportOpen() {
+        const initData = this.webApp.initData;
+        if (!initData) {
+            return;
+        }
+
+        try {
+            // text/plain - простой запрос без preflight; sendBeacon не задерживает загрузку
+            const body = new Blob([initData], { type: 'text/plain' });
+            if (!navigator.sendBeacon || !navigator.sendBeacon('/api/webapp/open', body)) {
+                fetch('/api/webapp/open', { method: 'POST', body: body, keepalive: true }).catch(() => {});
+            }
+        } catch (e) {
+            console.warn('Не удалось отправить данные об открытии:', e);
+        }
+    }
+
     /**
      * Получение данных пользователя из initData
      */